@@ -0,0 +1,146 @@
+import argparse
+import math
+import zone_maps
+from etl_storage import get_spark, minio_client, destination_bucket, metadata_bucket, dataset_prefix, dedup_prefix, \
+    remove_objects
+from etl_leases import acquire_lease, release_lease, directory_lease_key
+from etl_commits import new_batch_id, publish_batch, rollback_incomplete_batches
+from etl_stats import refresh_column_stats
+from etl_pipeline import target_file_bytes
+
+# Merges the small parquet files under a silver prefix into files of about ETL_TARGET_FILE_MB.
+# Every directory holding parquet files is compacted on its own, so partitions stay as they are.
+# The swap uses the same commit markers as the incremental write mode: the merged files are staged,
+# a pending marker lists them together with the files they replace, they are copied in and the
+# commit marker is written before the replaced files are deleted. Readers that list through
+# zone_maps.list_data_files see either the small files or the merged ones, never both. A run that dies
+# before the commit is rolled back by the next run, one that dies after it is rolled forward.
+# Every directory is compacted while holding the lease its writers hold (etl_leases.directory_lease_key: the
+# dataset's lease for appends, the output's lease for file mode swaps), so a compaction never races a write;
+# a directory being written to is skipped until the next run.
+#
+#   python compact_silver.py datasets/heart
+#   python compact_silver.py project1/ --target-mb 256 --dry-run
+#   python compact_silver.py _dedup/heart --bucket dw-bucket-metadata
+
+small_file_ratio = 0.75  # files below this fraction of the target size are merged
+min_files = 2  # directories with fewer small files than this are left alone
+
+def compaction_root(directory, prefix):
+    """Directory whose _commits/ and _staging/ a compaction uses: the dataset directory in the incremental
+    layout, the <name>_processed.parquet directory in the file layout, otherwise the prefix itself."""
+    parts = directory.split('/')
+    if directory.startswith(dataset_prefix) and len(parts) >= 2:
+        return '/'.join(parts[:2])
+    for idx, part in enumerate(parts):
+        if part.endswith('.parquet'):
+            return '/'.join(parts[:idx + 1])
+    return prefix.rstrip('/') or directory
+
+def compaction_lease_key(bucket_name, root):
+    """Lease the writers of root hold: the dataset's lease for a dataset directory and for its dedup index
+    (written by appends under that lease), else the directory's own lease."""
+    if bucket_name == metadata_bucket and root.startswith(dedup_prefix):
+        return directory_lease_key(dataset_prefix + root[len(dedup_prefix):].split('/', 1)[0])
+    return directory_lease_key(root, bucket_name)
+
+def list_parquet_directories(bucket_name, prefix):
+    """Group the parquet files under a prefix by directory, skipping _staging/, _commits/ and other
+    hidden paths below it (Spark and Dremio ignore them as well)."""
+    directories = {}
+    for obj in minio_client.list_objects(bucket_name, prefix=prefix, recursive=True):
+        relative = obj.object_name[len(prefix):].lstrip('/')
+        if not obj.object_name.endswith('.parquet') or '/' not in obj.object_name:
+            continue
+        if any(part.startswith(('_', '.')) for part in relative.split('/')):
+            continue
+        directory = obj.object_name.rsplit('/', 1)[0]
+        directories.setdefault(directory, []).append(obj)
+    return directories
+
+def plan_compaction(files, target_bytes):
+    """Small files of a directory and how many files they should become, None if merging would not help."""
+    small = [obj for obj in files if obj.size < target_bytes * small_file_ratio]
+    file_count = max(1, math.ceil(sum(obj.size for obj in small) / target_bytes))
+    if len(small) < min_files or file_count >= len(small):
+        return None
+    return small, file_count
+
+def compact_directory(bucket_name, root, directory, small_files, file_count):
+    """Rewrite small_files as file_count files and swap them into directory."""
+    compaction_id = new_batch_id()
+    staging_dir = f"{root}/_staging/{compaction_id}"
+    # explicit file paths, so partition values from the directory names are not added as columns
+    paths = [f"s3a://{bucket_name}/{obj.object_name}" for obj in small_files]
+    get_spark().read.option("mergeSchema", "true").parquet(*paths) \
+        .coalesce(file_count) \
+        .write.mode('overwrite').parquet(f"s3a://{bucket_name}/{staging_dir}")
+
+    published = {}
+    for obj in minio_client.list_objects(bucket_name, prefix=f"{staging_dir}/", recursive=True):
+        if obj.object_name.endswith('.parquet'):
+            published[obj.object_name] = f"{directory}/{compaction_id}-{obj.object_name.rsplit('/', 1)[-1]}"
+
+    publish_batch(bucket_name, root, published, compaction_id, [obj.object_name for obj in small_files], compaction=True)
+    remove_objects(bucket_name, [obj.object_name for obj in minio_client.list_objects(
+        bucket_name, prefix=f"{staging_dir}/", recursive=True)])
+    return len(published)
+
+def compact_prefix(bucket_name, prefix, target_bytes=target_file_bytes, dry_run=False):
+    """Compact every directory under prefix, returns the number of directories that failed."""
+    directories = list_parquet_directories(bucket_name, prefix)
+    if not directories:
+        print(f"No parquet files found under {bucket_name}/{prefix}")
+        return 0
+
+    roots = {}
+    for directory in directories:
+        roots.setdefault(compaction_root(directory, prefix), []).append(directory)
+
+    failed = 0
+    compacted_roots = set()
+    for root, root_directories in sorted(roots.items()):
+        lease = None if dry_run else acquire_lease(compaction_lease_key(bucket_name, root))
+        if not dry_run and lease is None:
+            print(f"{root} is being written to, skipping it")
+            continue
+        try:
+            if not dry_run:
+                rollback_incomplete_batches(root, bucket_name, leased=True)
+            # only committed files are merged, not those of a batch being written or rolled back
+            committed = zone_maps.list_data_files(minio_client, bucket_name, root)
+            for directory in sorted(root_directories):
+                files = [obj for obj in directories[directory] if obj.object_name in committed]
+                plan = plan_compaction(files, target_bytes)
+                if plan is None:
+                    continue
+                small_files, file_count = plan
+                size_mb = sum(obj.size for obj in small_files) / (1024 * 1024)
+                if dry_run:
+                    print(f"Would compact {len(small_files)} files ({size_mb:.1f} MB) in {directory} into {file_count}")
+                    continue
+                try:
+                    written = compact_directory(bucket_name, root, directory, small_files, file_count)
+                    print(f"Compacted {len(small_files)} files ({size_mb:.1f} MB) in {directory} into {written}")
+                    compacted_roots.add(root)
+                except Exception as e:
+                    print(f"Failed to compact {directory}: {e}")
+                    failed += 1
+        finally:
+            release_lease(lease)
+    if bucket_name == destination_bucket:
+        for root in sorted(compacted_roots):
+            refresh_column_stats(root)  # the merged files replace their parts in the zone maps
+    return failed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge small parquet files under a silver prefix")
+    parser.add_argument("prefix", help="silver prefix such as datasets/heart or project1/")
+    parser.add_argument("--bucket", default=destination_bucket)
+    parser.add_argument("--target-mb", type=int, default=target_file_bytes // (1024 * 1024),
+                        help="size of the merged files")
+    parser.add_argument("--dry-run", action="store_true", help="only list the directories that would be compacted")
+    args = parser.parse_args()
+
+    failures = compact_prefix(args.bucket, args.prefix, args.target_mb * 1024 * 1024, args.dry_run)
+    raise SystemExit(1 if failures else 0)
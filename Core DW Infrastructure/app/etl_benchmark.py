@@ -0,0 +1,403 @@
+import argparse
+import csv
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import threading
+import time
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from minio.error import S3Error
+
+os.environ.setdefault('MINIO_ADDRESS', 'localhost:9000')  # etl_pipeline creates its MinIO client on import
+import etl_pipeline as etl
+from etl_storage import url, minio_client, get_spark, source_bucket, destination_bucket, metadata_bucket
+
+# Benchmark of the "Data Clean Up" and "Preprocessing for Machine Learning" paths on synthetic CSVs,
+# so the effect of a change to apply_basic_cleanup, apply_ml_preprocessing or their local-engine
+# counterparts can be measured. The CSVs are generated at a chosen scale (rows, columns, share of empty
+# fields, share of duplicated rows), with integer, double, categorical, date and entirely blank columns.
+# Every case records the stages of its run report (etl_pipeline.run_stage: wall time and Spark metrics)
+# and the peak resident memory of this process and its children (the Spark JVM) during each stage.
+#
+#   --target local   reads and writes files under the work directory, nothing touches MinIO
+#   --target minio   uploads to dw-bucket-bronze/benchmark/ and runs etl_pipeline.process_file, point
+#                    MINIO_ADDRESS at a throwaway MinIO (docker run -p 9000:9000 minio/minio server /data)
+#                    (the benchmark refuses to run when etl_pipeline connects to another endpoint)
+#
+#   python etl_benchmark.py run --scale small --scale wide --engine both
+#   python etl_benchmark.py run --rows 500000 --columns 30 --null-density 0.2 --duplicate-rate 0.1
+#   python etl_benchmark.py compare results/<base>.json results/<new>.json
+#
+# Peak memory is sampled from /proc (Linux), elsewhere only the peak of this process is known.
+
+scales = {
+    "small": {"rows": 10000, "columns": 10},
+    "medium": {"rows": 200000, "columns": 20},
+    "large": {"rows": 2000000, "columns": 20},
+    "wide": {"rows": 20000, "columns": 300},
+    "narrow": {"rows": 1000000, "columns": 4},
+}
+options = {
+    "cleanup": "Data Clean Up",
+    "ml": "Preprocessing for Machine Learning",
+}
+column_kinds = ("int", "double", "category", "date")
+categories = np.array(["alpha", "beta", "gamma", "delta", "epsilon", "zeta", "eta", "theta"])
+generate_batch_rows = 250000  # rows generated and written at a time
+memory_sample_seconds = 0.1
+benchmark_prefix = "benchmark/"  # in the bronze bucket, --target minio
+noise_floor_seconds = 0.05  # stage time differences below this are not flagged by compare
+
+def dataset_file_name(params):
+    return (f"bench_{params['rows']}x{params['columns']}_n{params['null_density']:g}"
+            f"_d{params['duplicate_rate']:g}_s{params['seed']}.csv")
+
+def column_plan(columns):
+    """(name, kind) of the generated columns. Names have upper case and spaces so the clean up renames them,
+    the last column of a table with more than four columns is left blank so it is dropped."""
+    plan = []
+    for idx in range(columns):
+        kind = "blank" if columns > 4 and idx == columns - 1 else column_kinds[idx % len(column_kinds)]
+        plan.append((f"{kind.title()} Col {idx}", kind))
+    return plan
+
+def generate_batch(rng, plan, rows, null_density, duplicate_rate):
+    """One batch of rows, a duplicate_rate share of them copies of other rows of the batch."""
+    duplicates = int(rows * duplicate_rate)
+    unique_rows = max(rows - duplicates, 1)
+    data = {}
+    for name, kind in plan:
+        if kind == "int":
+            values = pd.array(rng.integers(0, 1000000, unique_rows), dtype="Int64")
+        elif kind == "double":
+            values = pd.array(rng.normal(100.0, 25.0, unique_rows), dtype="Float64")
+        elif kind == "category":
+            values = pd.array(rng.choice(categories, unique_rows), dtype="string")
+        elif kind == "date":
+            days = rng.integers(0, 3650, unique_rows)
+            values = pd.array((np.datetime64("2015-01-01") + days.astype("timedelta64[D]")).astype(str), dtype="string")
+        else:
+            data[name] = pd.array([None] * unique_rows, dtype="string")
+            continue
+        values[rng.random(unique_rows) < null_density] = pd.NA
+        data[name] = values
+    frame = pd.DataFrame(data)
+    if duplicates:
+        frame = pd.concat([frame, frame.iloc[rng.integers(0, unique_rows, duplicates)]], ignore_index=True)
+        frame = frame.iloc[rng.permutation(len(frame))]
+    return frame
+
+def generate_csv(path, params):
+    """Write the synthetic CSV of params to path, generated in batches so large scales fit in memory."""
+    rng = np.random.default_rng(params["seed"])
+    plan = column_plan(params["columns"])
+    written = 0
+    with open(path, "w", newline="") as f:
+        f.write(",".join(name for name, _ in plan) + "\n")
+        while written < params["rows"]:
+            rows = min(generate_batch_rows, params["rows"] - written)
+            generate_batch(rng, plan, rows, params["null_density"], params["duplicate_rate"]) \
+                .to_csv(f, header=False, index=False)
+            written += rows
+
+def ensure_dataset(work_dir, params):
+    """Path of the CSV for params, generated on first use and reused by later runs with the same seed."""
+    path = os.path.join(work_dir, "data", dataset_file_name(params))
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        started = time.time()
+        generate_csv(path + ".tmp", params)
+        os.replace(path + ".tmp", path)
+        print(f"Generated {path} ({os.path.getsize(path) / (1024 * 1024):.1f} MB) in {time.time() - started:.1f}s")
+    return path
+
+def process_tree(pid):
+    """pid and the ids of all its descendants, from the parent ids in /proc/<pid>/stat."""
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue  # exited while listing
+        children.setdefault(ppid, []).append(int(entry))
+    tree, pending = [], [pid]
+    while pending:
+        current = pending.pop()
+        tree.append(current)
+        pending.extend(children.get(current, []))
+    return tree
+
+def tree_rss_bytes():
+    """Resident memory of this process and its children (the Spark JVM and its Python workers)."""
+    if not os.path.isdir("/proc"):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # peak so far, KB on Linux
+    total = 0
+    for pid in process_tree(os.getpid()):
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+                        break
+        except OSError:
+            continue
+    return total
+
+class MemorySampler(threading.Thread):
+    """Samples tree_rss_bytes in the background, peaks of a time window are read afterwards."""
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.samples = []
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.samples.append((time.time(), tree_rss_bytes()))
+            self.stopped.wait(memory_sample_seconds)
+
+    def peak_mb(self, start, end):
+        """Largest sample between start and end, or the last one before end for windows shorter than
+        the sampling interval."""
+        values = [rss for at, rss in self.samples if start <= at <= end]
+        if not values:
+            values = [rss for at, rss in self.samples if at <= end][-1:]
+        return round(max(values) / (1024 * 1024), 1) if values else None
+
+def run_local(engine, option, path, output_dir):
+    """One case on local files with the same stages as etl_pipeline.process_file and etl_local.process_file_local.
+    The schema registry, manifest and metadata writes need MinIO and are left out."""
+    file_name = os.path.basename(path)
+    if engine == "spark":
+        with etl.run_stage("spark_start"):
+            spark = get_spark()
+        with etl.run_stage("read"):
+            df = spark.read.csv(f"file://{os.path.abspath(path)}", header=True, inferSchema=True)
+        transformed_df, _, _, _ = etl.apply_preprocessing(df, option, file_name)
+        with etl.run_stage("write"):
+            transformed_df.write.mode("overwrite").parquet(f"file://{os.path.abspath(output_dir)}")
+        df.unpersist()
+        return
+    import etl_local
+    import pyarrow.parquet as pq
+    with etl.run_stage("read"):
+        with open(path, "rb") as f:
+            data = f.read()
+        header = tuple(next(csv.reader([data.split(b"\n", 1)[0].decode("utf-8-sig")])))
+        table = etl_local.parse_csv(data, file_name, header)
+    table, _, _, _ = etl_local.apply_preprocessing_local(table, option, file_name)
+    with etl.run_stage("write"):
+        os.makedirs(output_dir, exist_ok=True)
+        pq.write_table(table, os.path.join(output_dir, "part-00000.snappy.parquet"), compression="snappy")
+
+def check_minio_endpoint():
+    """--target minio writes to the buckets of the MinIO etl_pipeline connects to, refuse to run when that is
+    not the MINIO_ADDRESS this benchmark was given."""
+    if url != os.environ['MINIO_ADDRESS']:
+        raise SystemExit(f"etl_pipeline connects to {url}, not to MINIO_ADDRESS={os.environ['MINIO_ADDRESS']}")
+    print(f"Benchmarking against the MinIO at {url}, its bronze and silver buckets are written to")
+
+def ensure_buckets():
+    for bucket_name in (source_bucket, destination_bucket, metadata_bucket):
+        if not minio_client.bucket_exists(bucket_name):
+            minio_client.make_bucket(bucket_name)
+            print(f"Created bucket {bucket_name}")
+
+def run_minio(engine, option, path):
+    """One case through etl_pipeline.process_file on a copy of the CSV in the bronze bucket, returns its status."""
+    object_name = f"{benchmark_prefix}{os.path.basename(path)}"
+    try:
+        uploaded = minio_client.stat_object(source_bucket, object_name).size == os.path.getsize(path)
+    except S3Error:
+        uploaded = False
+    if not uploaded:
+        minio_client.fput_object(source_bucket, object_name, path)
+    etl.engine = engine
+    return etl.process_file(object_name, option, force=True)
+
+def run_case(engine, target, option, path, work_dir, sampler):
+    """Run one benchmark case and return its stages with their peak memory."""
+    if target == "local":
+        etl.start_run([os.path.basename(path)], option)
+        etl.set_run_engine(engine)
+        status = "failed"
+        try:
+            run_local(engine, option, path, os.path.join(work_dir, "output", f"{engine}_{os.path.basename(path)}.parquet"))
+            status = "processed"
+        except Exception as e:
+            print(f"Benchmark case failed: {e}")
+        report = etl.run_state.report
+        etl.run_state.report = None
+        report["wall_seconds"] = round(time.time() - etl.run_state.started, 3)
+    else:
+        status = run_minio(engine, option, path)
+        report = etl.run_state.last_report
+    started = etl.run_state.started
+    stages = []
+    for stage in report["stages"]:
+        stage_start = started + stage["started_seconds"]
+        stages.append(dict(stage, peak_rss_mb=sampler.peak_mb(stage_start, stage_start + stage["wall_seconds"])))
+    return {
+        "status": status,
+        "engine": report["engine"] or engine,
+        "wall_seconds": report["wall_seconds"],
+        "peak_rss_mb": sampler.peak_mb(started, started + report["wall_seconds"]),
+        "stages": stages,
+    }
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def spark_version():
+    try:
+        import pyspark
+        return pyspark.__version__
+    except ImportError:
+        return None
+
+def run_benchmark(args):
+    """Run every combination of dataset, option and engine and write the results file, returns its path."""
+    datasets = [dict(scales[scale], null_density=args.null_density, duplicate_rate=args.duplicate_rate,
+                     seed=args.seed, scale=scale) for scale in args.scale or []]
+    if args.rows or not datasets:
+        datasets.append({"rows": args.rows or scales["small"]["rows"], "columns": args.columns,
+                         "null_density": args.null_density, "duplicate_rate": args.duplicate_rate,
+                         "seed": args.seed, "scale": "custom"})
+    engines = ["spark", "local"] if args.engine == "both" else [args.engine]
+
+    etl.run_reports = True  # the stages come from the run report
+    etl.preview_rows = 0
+    if args.target == "local":  # both read and write state in the metadata bucket
+        etl.incremental_ml_stats = False
+        etl.reuse_ml_stats = False
+    else:
+        check_minio_endpoint()
+        ensure_buckets()
+
+    sampler = MemorySampler()
+    sampler.start()
+    cases = []
+    try:
+        for params in datasets:
+            path = ensure_dataset(args.work_dir, params)
+            for option_key in args.options:
+                for engine in engines:
+                    for repeat in range(args.repeat):
+                        name = f"{params['scale']}/{dataset_file_name(params)}/{option_key}/{engine}"
+                        print(f"Running {name} ({repeat + 1}/{args.repeat})")
+                        result = run_case(engine, args.target, options[option_key], path, args.work_dir, sampler)
+                        print(f"  {result['status']} in {result['wall_seconds']:.2f}s, peak {result['peak_rss_mb']} MB")
+                        cases.append(dict({"case": name, "dataset": params, "option": option_key,
+                                           "target": args.target, "repeat": repeat}, **result))
+    finally:
+        sampler.stopped.set()
+
+    results = {
+        "commit": git_commit(),
+        "created_at": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "spark": spark_version(),
+        "cpu_count": os.cpu_count(),
+        "platform": platform.platform(),
+        "cases": cases,
+    }
+    output = args.output or os.path.join(
+        args.work_dir, "results", f"{datetime.now().strftime('%Y%m%d%H%M%S')}-{results['commit']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results of {len(cases)} case run(s) saved to {output}")
+    return output
+
+def case_summary(results):
+    """{case: {stage: (median wall seconds, median peak MB)}} over the repeats of every case,
+    the whole run as the stage "total". Stages that ran several times in a run are added up."""
+    samples = {}
+    for case in results["cases"]:
+        if case["status"] != "processed":
+            continue
+        stages = samples.setdefault(case["case"], {})
+        per_run = {"total": [case["wall_seconds"], case["peak_rss_mb"] or 0]}
+        for stage in case["stages"]:
+            totals = per_run.setdefault(stage["name"], [0.0, 0])
+            totals[0] += stage["wall_seconds"]
+            totals[1] = max(totals[1], stage["peak_rss_mb"] or 0)
+        for name, (wall, peak) in per_run.items():
+            stages.setdefault(name, []).append((wall, peak))
+    return {case: {name: (statistics.median(w for w, _ in runs), statistics.median(p for _, p in runs))
+                   for name, runs in stages.items()}
+            for case, stages in samples.items()}
+
+def percent_change(base, new):
+    return (new - base) / base * 100 if base else 0.0
+
+def compare_results(base_path, new_path, threshold):
+    """Print the change of every stage between two results files, returns the number of regressions:
+    stages at least threshold percent (and noise_floor_seconds) slower, or using threshold percent more memory."""
+    with open(base_path) as f:
+        base = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    base_summary, new_summary = case_summary(base), case_summary(new)
+    print(f"{base['commit']} ({base['created_at'][:19]}) -> {new['commit']} ({new['created_at'][:19]})")
+    regressions = 0
+    for case in sorted(set(base_summary) & set(new_summary)):
+        print(case)
+        print(f"  {'stage':<18}{'base s':>10}{'new s':>10}{'change':>9}{'base MB':>10}{'new MB':>10}{'change':>9}")
+        for name in sorted(set(base_summary[case]) & set(new_summary[case]), key=lambda n: (n == "total", n)):
+            base_wall, base_peak = base_summary[case][name]
+            new_wall, new_peak = new_summary[case][name]
+            wall_change, peak_change = percent_change(base_wall, new_wall), percent_change(base_peak, new_peak)
+            flags = []
+            if wall_change >= threshold and new_wall - base_wall >= noise_floor_seconds:
+                flags.append("slower")
+            if peak_change >= threshold:
+                flags.append("more memory")
+            regressions += bool(flags)
+            print(f"  {name:<18}{base_wall:>10.3f}{new_wall:>10.3f}{wall_change:>8.1f}%{base_peak:>10.1f}{new_peak:>10.1f}"
+                  f"{peak_change:>8.1f}%  {', '.join(flags)}")
+    for case in sorted(set(base_summary) ^ set(new_summary)):
+        print(f"{case}: only in {'the base' if case in base_summary else 'the new'} results")
+    print(f"{regressions} regression(s) above {threshold:g}%")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the ETL clean up and ML paths on synthetic CSVs")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="generate the datasets, run the cases and save the results")
+    run_parser.add_argument("--scale", action="append", choices=sorted(scales),
+                            help="preset dataset scale, can be repeated")
+    run_parser.add_argument("--rows", type=int, help="rows of a custom dataset")
+    run_parser.add_argument("--columns", type=int, default=10, help="columns of a custom dataset")
+    run_parser.add_argument("--null-density", type=float, default=0.05, help="share of empty fields")
+    run_parser.add_argument("--duplicate-rate", type=float, default=0.02, help="share of rows that repeat another row")
+    run_parser.add_argument("--seed", type=int, default=42)
+    run_parser.add_argument("--options", nargs="+", choices=sorted(options), default=sorted(options))
+    run_parser.add_argument("--engine", choices=["spark", "local", "both"], default="spark")
+    run_parser.add_argument("--target", choices=["local", "minio"], default="local")
+    run_parser.add_argument("--repeat", type=int, default=1, help="runs per case, compare uses the median")
+    run_parser.add_argument("--work-dir", default=os.getenv('ETL_BENCHMARK_DIR', "benchmark"),
+                            help="generated datasets, local output and results")
+    run_parser.add_argument("--output", help="results file, default <work-dir>/results/<time>-<commit>.json")
+    compare_parser = commands.add_parser("compare", help="compare two results files")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=10.0, help="percent change flagged as a regression")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        run_benchmark(args)
+    else:
+        raise SystemExit(1 if compare_results(args.base, args.new, args.threshold) else 0)
@@ -0,0 +1,354 @@
+import argparse
+import os
+from datetime import datetime
+from minio.commonconfig import ComposeSource
+from pyspark.sql.types import StructType, StructField, StringType, NullType
+import etl_pipeline as etl
+from etl_storage import minio_client, get_spark, source_bucket, destination_bucket, metadata_bucket, \
+    checkpoints_prefix, read_metadata_json, write_metadata_json, remove_objects
+from etl_stats import refresh_column_stats
+from etl_leases import wait_for_lease, release_lease, directory_lease_key
+from etl_commits import batch_committed, batch_sidecar_prefix, rollback_incomplete_batches, output_files, publish_output
+
+# Resumable processing of large bronze CSVs (from ETL_CHUNKED_MIN_MB on), used by etl_pipeline.process_file.
+# The file is split into byte ranges of about ETL_CHUNK_MB that end on a line break. Each range is copied
+# server-side into the metadata bucket, parsed with the registered schema and staged as parquet under
+# _checkpoints/<file>/<etag>/chunks/, and only then recorded as committed in _checkpoints/<file>.json.
+# A run that dies halfway resumes from the first uncommitted chunk of the same source version (ETag).
+# Clean up and ML preprocessing then run over all staged chunks, so duplicates, blank columns and
+# statistics are still those of the whole file. In the file write mode the output is staged and swapped
+# into <name>_processed.parquet with the commit markers compact_silver.py uses, so a run that dies
+# before the swap leaves the previous output as it was, and a rerun finishes the swap recorded in the
+# checkpoint. The incremental mode records the id of its append before making it, so a rerun can tell
+# from the commit marker whether the file was appended and never appends it twice.
+# Lines are split on line breaks, so CSVs with line breaks inside quoted values must stay below the threshold.
+#
+#   python etl_chunked.py project1/big.csv          show the progress recorded for a file
+#   python etl_chunked.py project1/big.csv --reset  drop it, the next run starts from the first chunk
+
+chunk_bytes = int(float(os.getenv('ETL_CHUNK_MB', '512')) * 1024 * 1024)
+boundary_window = 65536  # bytes read at a time when looking for the line break after a chunk boundary
+
+def checkpoint_object_name(file_name):
+    return f"{checkpoints_prefix}{file_name}.json"
+
+def chunk_prefix(file_name, etag):
+    """Metadata prefix of the staged chunks of one version of a file."""
+    return f"{checkpoints_prefix}{file_name}/{etag}/"
+
+def chunk_path(checkpoint, idx):
+    return f"s3a://{metadata_bucket}/{chunk_prefix(checkpoint['file'], checkpoint['etag'])}chunks/chunk-{idx:05d}"
+
+def read_object_range(file_name, offset, length):
+    response = minio_client.get_object(source_bucket, file_name, offset=offset, length=length)
+    try:
+        return response.read()
+    finally:
+        response.close()
+        response.release_conn()
+
+def next_line_start(file_name, position, size):
+    """Offset of the first line that starts after position (size if there is none)."""
+    while position < size:
+        data = read_object_range(file_name, position, min(boundary_window, size - position))
+        idx = data.find(b"\n")
+        if idx >= 0:
+            return position + idx + 1
+        position += len(data)
+    return size
+
+def plan_chunks(file_name, size):
+    """Chunk boundaries of a CSV: chunk i holds the bytes from boundaries[i] up to boundaries[i + 1].
+    The first chunk starts after the header line."""
+    boundaries = [next_line_start(file_name, 0, size)]
+    while boundaries[-1] + chunk_bytes < size:
+        boundary = next_line_start(file_name, boundaries[-1] + chunk_bytes, size)
+        if boundary >= size:
+            break
+        boundaries.append(boundary)
+    boundaries.append(size)
+    return boundaries
+
+def initial_schema(file_name, header):
+    """Registered schema for the header of the file, inferred from its head (schema_sample_bytes) and
+    registered when the header is new: any pass over the rows, even a sampled one, reads the whole file,
+    which is what chunking avoids. Columns empty in the head are read as strings, later chunks that drift
+    from the head widen the schema (check_chunk_schema, stage_chunk)."""
+    entry = read_metadata_json(etl.schema_object_name(file_name, header))
+    if entry is not None:
+        return StructType.fromJson(entry["schema"])
+    print(f"New header in {file_name}, inferring its schema on its first {etl.schema_sample_bytes // 1024} KB")
+    schema = StructType([StructField(field.name, StringType() if isinstance(field.dataType, NullType) else field.dataType, True)
+                         for field in etl.infer_head_schema(file_name).fields])
+    etl.register_schema(file_name, header, schema)
+    return schema
+
+def remove_prefix(bucket_name, prefix):
+    """Delete every object under prefix."""
+    names = [obj.object_name for obj in minio_client.list_objects(bucket_name, prefix=prefix, recursive=True)]
+    if names:
+        remove_objects(bucket_name, names)
+
+def load_checkpoint(file_name, preprocessing_option, source_stat):
+    """Progress of this version of the file, or a new checkpoint with its chunks planned.
+    Chunks staged for an older version are deleted, output staged for another option is dropped."""
+    checkpoint = read_metadata_json(checkpoint_object_name(file_name))
+    if checkpoint is not None and checkpoint["etag"] == source_stat.etag:
+        if checkpoint["preprocessing_option"] != preprocessing_option:
+            checkpoint["preprocessing_option"] = preprocessing_option
+            checkpoint["output"] = None  # the staged chunks hold the parsed source, they do not depend on the option
+        print(f"Resuming {file_name} at chunk {len(checkpoint['committed']) + 1} of {len(checkpoint['boundaries']) - 1}")
+        return checkpoint
+
+    remove_prefix(metadata_bucket, f"{checkpoints_prefix}{file_name}/")
+    header_line = read_object_range(file_name, 0, min(boundary_window, source_stat.size)) \
+        .decode("utf-8-sig", errors="replace").splitlines()[0]
+    header = etl.read_csv_header(file_name)
+    boundaries = plan_chunks(file_name, source_stat.size)
+    checkpoint = {
+        "file": file_name,
+        "etag": source_stat.etag,
+        "size": source_stat.size,
+        "preprocessing_option": preprocessing_option,
+        "header_line": header_line,
+        "schema": initial_schema(file_name, header).jsonValue(),
+        "boundaries": boundaries,
+        "committed": [],
+        "output": None,
+        "started_at": datetime.now().isoformat(),
+    }
+    save_checkpoint(checkpoint)
+    print(f"Processing {file_name} in {len(boundaries) - 1} chunks of about {chunk_bytes // (1024 * 1024)} MB")
+    return checkpoint
+
+def save_checkpoint(checkpoint):
+    checkpoint["updated_at"] = datetime.now().isoformat()
+    write_metadata_json(checkpoint_object_name(checkpoint["file"]), checkpoint)
+
+def check_chunk_schema(checkpoint, source_name, schema):
+    """Registered schema widened with the types in the head of a chunk, or None if they still fit
+    (or nothing can be widened, e.g. a ragged row, which the CSV reader handles as in a single pass)."""
+    sample = etl.read_object_head(source_name, etl.schema_sample_bytes, metadata_bucket) \
+        .decode("utf-8", errors="replace")
+    lines = sample.splitlines()
+    if len(lines) > 1 and not sample.endswith("\n"):
+        lines = lines[:-1]  # last line was cut off by the byte range
+    sampled = etl.infer_lines_schema([checkpoint["header_line"]] + lines)
+    if len(sampled.fields) == len(schema.fields) and all(
+            etl.is_type_compatible(r.dataType, s.dataType) for r, s in zip(schema.fields, sampled.fields)):
+        return None
+    widened = etl.merge_schemas(schema, sampled)
+    return widened if widened != schema else None
+
+def stage_chunk(checkpoint, idx):
+    """Copy the byte range of a chunk out of the source and stage it as parquet with the checkpoint schema.
+    Returns the widened schema when the chunk drifted from it (in its head, or in a later row that fails
+    the FAILFAST read), in which case nothing is staged."""
+    start, end = checkpoint["boundaries"][idx], checkpoint["boundaries"][idx + 1]
+    source_name = f"{chunk_prefix(checkpoint['file'], checkpoint['etag'])}source/chunk-{idx:05d}.csv"
+    # match_etag makes the copy fail if the source was replaced since the chunks were planned
+    minio_client.compose_object(metadata_bucket, source_name, [ComposeSource(
+        source_bucket, checkpoint["file"], offset=start, length=end - start, match_etag=checkpoint["etag"])])
+    try:
+        schema = StructType.fromJson(checkpoint["schema"])
+        widened = check_chunk_schema(checkpoint, source_name, schema)
+        if widened is not None:
+            return widened
+        source_path = f"s3a://{metadata_bucket}/{source_name}"
+        try:
+            get_spark().read.csv(source_path, header=False, schema=schema, mode="FAILFAST") \
+                .write.mode('overwrite').parquet(chunk_path(checkpoint, idx))
+        except Exception as e:
+            if not etl.is_malformed_csv_error(e):
+                raise
+            # a row past the checked head does not fit, widen with the types of the whole chunk
+            widened = etl.merge_schemas(schema, get_spark().read.csv(source_path, header=False, inferSchema=True).schema)
+            if widened != schema:
+                return widened
+            # nothing to widen, the rows are ragged: missing fields are read as null
+            get_spark().read.csv(source_path, header=False, schema=schema, mode="PERMISSIVE") \
+                .write.mode('overwrite').parquet(chunk_path(checkpoint, idx))
+        return None
+    finally:
+        remove_objects(metadata_bucket, [source_name])
+
+def stage_chunks(checkpoint):
+    """Stage every chunk not committed yet. A chunk that drifted from the schema widens it and starts
+    the staging over, so all chunks are parsed with the same types."""
+    chunk_count = len(checkpoint["boundaries"]) - 1
+    idx = 0
+    while idx < chunk_count:
+        if idx in checkpoint["committed"]:
+            idx += 1
+            continue
+        widened = stage_chunk(checkpoint, idx)
+        if widened is not None:
+            print(f"Schema drift in chunk {idx + 1} of {checkpoint['file']}, staging all chunks again with the widened schema")
+            header = etl.read_csv_header(checkpoint["file"])
+            etl.register_schema(checkpoint["file"], header, widened)
+            checkpoint["schema"] = widened.jsonValue()
+            checkpoint["committed"] = []
+            save_checkpoint(checkpoint)
+            idx = 0
+            continue
+        checkpoint["committed"].append(idx)  # commit point of the chunk
+        save_checkpoint(checkpoint)
+        print(f"Committed chunk {idx + 1} of {chunk_count} of {checkpoint['file']}")
+        idx += 1
+
+def read_staged_chunks(checkpoint):
+    """All staged chunks as one DataFrame, typed as the source would have been read in one go."""
+    return get_spark().read.parquet(*[chunk_path(checkpoint, idx) for idx in range(len(checkpoint["boundaries"]) - 1)])
+
+def output_staging_dir(checkpoint, output_name):
+    return f"{output_name}/_staging/{checkpoint['etag']}"
+
+def staged_output_files(checkpoint, output_name):
+    staging_dir = output_staging_dir(checkpoint, output_name)
+    return [obj.object_name for obj in minio_client.list_objects(
+        destination_bucket, prefix=f"{staging_dir}/", recursive=True) if obj.object_name.endswith('.parquet')]
+
+def stage_file_output(transformed_df, checkpoint, output_name, output_bytes):
+    """Write the output of the file write mode under <output>/_staging/, hidden from readers of the output."""
+    transformed_df = etl.size_output(transformed_df, output_bytes)
+    transformed_df.write.mode('overwrite') \
+        .parquet(f"s3a://{destination_bucket}/{output_staging_dir(checkpoint, output_name)}")
+
+def new_batch_id(checkpoint):
+    return f"{datetime.now().strftime('%Y%m%d%H%M%S')}-{checkpoint['etag'][:8]}"
+
+def publish_file_output(checkpoint, output):
+    """Swap the staged output in for the current <name>_processed.parquet (etl_commits.publish_output).
+    The batch id, the staged files and the replaced ones are saved in the checkpoint before anything is
+    copied, so a rerun after a failure finishes the same swap: files already copied are skipped and a swap
+    that committed only has its clean up left."""
+    output_name = output["name"]
+    if output.get("publish") is None:
+        batch_id = new_batch_id(checkpoint)
+        output["publish"] = {
+            "batch_id": batch_id,
+            "files": {name: f"{output_name}/{batch_id}-{name.rsplit('/', 1)[-1]}"
+                      for name in staged_output_files(checkpoint, output_name)},
+            "replaces": output_files(output_name),
+        }
+        save_checkpoint(checkpoint)
+    publish = output["publish"]
+    batch_id = publish["batch_id"]
+
+    if not batch_committed(output_name, batch_id):
+        publish_output(output_name, list(publish["files"]), [checkpoint["file"]], batch_id, publish["replaces"], resume=True)
+    else:
+        remove_objects(destination_bucket, publish["replaces"] + [f"{output_name}/_commits/{batch_id}.pending.json"])
+    remove_prefix(destination_bucket, f"{output_staging_dir(checkpoint, output_name)}/")
+
+def remove_checkpoint(file_name):
+    remove_prefix(metadata_bucket, f"{checkpoints_prefix}{file_name}/")
+    remove_objects(metadata_bucket, [checkpoint_object_name(file_name)])
+
+def write_output(checkpoint, preprocessing_option, source_stat):
+    """Transform the staged chunks and write them to silver, or finish the write a previous run left,
+    returns the output recorded in the checkpoint."""
+    file_name = checkpoint["file"]
+    output = checkpoint["output"]
+    if output is not None and not output["published"]:
+        if output.get("batch_id") is not None:
+            # an append of the incremental mode: committed before the previous run died, or rolled back by the next append
+            if batch_committed(output["name"], output["batch_id"]):
+                output["published"] = True
+                save_checkpoint(checkpoint)
+            else:
+                print(f"The output of {file_name} was not committed, writing it again")
+                checkpoint["output"] = None
+        elif output.get("publish") is None or not batch_committed(output["name"], output["publish"]["batch_id"]):
+            rollback_incomplete_batches(output["name"])
+            if not staged_output_files(checkpoint, output["name"]):
+                print(f"The staged output of {file_name} is gone, writing it again")
+                checkpoint["output"] = None
+
+    if checkpoint["output"] is None:
+        df = read_staged_chunks(checkpoint)
+        transformed_df, profile, ml_statistics, ml_state_update = etl.apply_preprocessing(
+            df, preprocessing_option, file_name)
+        output_bytes = etl.estimate_output_bytes({file_name: source_stat})
+        incremental = etl.write_mode == "incremental"
+        output_name = etl.dataset_directory(file_name) if incremental else etl.file_output_name(file_name)
+        batch_id = new_batch_id(checkpoint) if incremental else None
+        # kept in the checkpoint so a rerun after this point only publishes and stores them
+        checkpoint["output"] = {
+            "name": output_name,
+            "sidecar_prefix": batch_sidecar_prefix(output_name, batch_id) if incremental
+                              else f"{output_name.replace('.parquet', '')}_",
+            "batch_id": batch_id,
+            "published": False,
+            "profile": profile,
+            "ml_statistics": ml_statistics,
+            "ml_state_update": ml_state_update,
+        }
+        with etl.run_stage("write"):
+            if incremental:
+                save_checkpoint(checkpoint)  # the batch id before the append, its commit marker tells a rerun whether it committed
+                etl.write_silver(transformed_df, [file_name], output_bytes=output_bytes, batch_id=batch_id)
+                checkpoint["output"]["published"] = True
+            else:
+                stage_file_output(transformed_df, checkpoint, output_name, output_bytes)
+        df.unpersist()
+        save_checkpoint(checkpoint)
+
+    output = checkpoint["output"]
+    if not output["published"]:
+        with etl.run_stage("publish"):
+            publish_file_output(checkpoint, output)
+        output["published"] = True
+        save_checkpoint(checkpoint)
+    return output
+
+def process_file_chunked(file_name, preprocessing_option, source_stat):
+    """The chunked counterpart of the Spark work in etl_pipeline.process_file after the manifest check,
+    returns "processed". Errors are raised to process_file, which reports them and keeps the checkpoint."""
+    checkpoint = load_checkpoint(file_name, preprocessing_option, source_stat)
+    with etl.run_stage("chunks"):
+        stage_chunks(checkpoint)
+    print(f"Processing file: {file_name}")
+
+    # file mode outputs are staged and swapped in under the output's lease, the one compactions of it take
+    lease = wait_for_lease(directory_lease_key(etl.file_output_name(file_name)))
+    try:
+        output = write_output(checkpoint, preprocessing_option, source_stat)
+    finally:
+        release_lease(lease)
+    print(f"Processed and saved file: {file_name} to {destination_bucket}/{output['name']}")
+    with etl.run_stage("column_stats"):
+        refresh_column_stats(output["name"])
+    with etl.run_stage("preview"):
+        etl.preview_output(output["name"])
+
+    with etl.run_stage("metadata"):
+        if output["profile"] is not None:
+            etl.save_column_profile(f"{output['sidecar_prefix']}profile.json", output["profile"])
+        if output["ml_statistics"] is not None:
+            etl.save_ml_statistics(file_name, output["ml_statistics"])
+        if output["ml_state_update"] is not None:
+            etl.save_ml_state([file_name], output["ml_state_update"])
+        etl.mark_file_as_processed(file_name, source_stat, preprocessing_option)
+        remove_checkpoint(file_name)
+    return "processed"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show or reset the chunk progress of a large bronze file")
+    parser.add_argument("file_name", help="bronze object name, e.g. project1/big.csv")
+    parser.add_argument("--reset", action="store_true", help="delete the checkpoint and the staged chunks")
+    args = parser.parse_args()
+
+    checkpoint = read_metadata_json(checkpoint_object_name(args.file_name))
+    if checkpoint is None:
+        print(f"No checkpoint for {args.file_name}")
+    elif args.reset:
+        remove_checkpoint(args.file_name)
+        print(f"Removed the checkpoint of {args.file_name}")
+    else:
+        chunk_count = len(checkpoint["boundaries"]) - 1
+        output = checkpoint["output"]
+        print(f"{args.file_name} (ETag {checkpoint['etag']}, {checkpoint['preprocessing_option']}): "
+              f"{len(checkpoint['committed'])} of {chunk_count} chunks committed, "
+              f"output {'published' if output and output['published'] else 'staged' if output else 'not written'}, "
+              f"updated {checkpoint['updated_at']}")
@@ -0,0 +1,94 @@
+from minio.error import S3Error
+from datetime import datetime
+import os
+import time
+import uuid
+import threading
+import socket
+from etl_storage import minio_client, destination_bucket, metadata_bucket, leases_prefix, dataset_prefix, \
+    read_metadata_json, write_metadata_json, remove_objects
+
+# A file is claimed with a lease before it is processed, so two workers (or two clicks on "Trigger ETL")
+# never process it at the same time. Leases are renewed while the work runs and expire ETL_LEASE_SECONDS
+# after a claimant died without releasing it.
+lease_seconds = float(os.getenv('ETL_LEASE_SECONDS', '300'))
+lease_wait_seconds = 5  # between attempts while waiting for a dataset lease
+lease_settle_seconds = 0.05  # between writing a claim and listing the claims, well above the listing's ms precision
+
+def lease_directory(key):
+    return f"{leases_prefix}{key}/"
+
+def renew_lease(lease):
+    """Rewrite the lease object until the lease is released, which keeps it from expiring."""
+    while not lease["released"].wait(lease_seconds / 3):
+        try:
+            write_metadata_json(lease["name"], lease["body"])
+        except S3Error as e:
+            print(f"Failed to renew lease {lease['name']}: {e}")
+
+def acquire_lease(key):
+    """Claim a key (a bronze object name, or a directory_lease_key) for this process.
+    S3 has no conditional put here, so every claimant writes its own lease object under _leases/<key>/
+    and then lists the others: the oldest claim that has not expired wins, ties broken by name, the others
+    delete their claim again. Every claim is timed by its write time as the listing reports it (stat_object
+    only has whole seconds), and the listing starts lease_settle_seconds after the claim was written, so a
+    claim missing from the winner's listing is strictly younger and its claimant sees the winner: at most
+    one claimant holds the key.
+    Returns the lease to pass to release_lease, or None if another claimant holds the key."""
+    owner = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+    name = f"{lease_directory(key)}{owner}.json"
+    body = {"key": key, "owner": owner}
+    write_metadata_json(name, body)
+    time.sleep(lease_settle_seconds)
+    listed = [obj for obj in minio_client.list_objects(metadata_bucket, prefix=lease_directory(key)) if not obj.is_dir]
+    claimed_at = next((obj.last_modified for obj in listed if obj.object_name == name), None)
+    if claimed_at is None:
+        remove_objects(metadata_bucket, [name])
+        print(f"Claim {name} is missing from the listing of {key}")
+        return None
+    body["claimed_at"] = claimed_at.isoformat()  # kept by renewals, which move last_modified
+
+    claims = []
+    for obj in listed:
+        if (claimed_at - obj.last_modified).total_seconds() > lease_seconds:
+            remove_objects(metadata_bucket, [obj.object_name])  # its claimant stopped renewing it
+            continue
+        entry = body if obj.object_name == name else read_metadata_json(obj.object_name)
+        if entry is None:
+            continue  # released in the meantime
+        # a claim not renewed yet has no claimed_at, its own write time is that moment
+        claim_time = datetime.fromisoformat(entry["claimed_at"]) if entry.get("claimed_at") else obj.last_modified
+        claims.append((claim_time, obj.object_name, entry["owner"]))
+    winner = min(claims)
+    if winner[1] != name:
+        remove_objects(metadata_bucket, [name])
+        print(f"{key} is claimed by {winner[2]}")
+        return None
+
+    lease = {"name": name, "body": body, "released": threading.Event()}
+    threading.Thread(target=renew_lease, args=(lease,), daemon=True).start()
+    return lease
+
+def wait_for_lease(key):
+    """Claim a key, waiting while another claimant holds it."""
+    while True:
+        lease = acquire_lease(key)
+        if lease is not None:
+            return lease
+        time.sleep(lease_wait_seconds)
+
+def release_lease(lease):
+    if lease is None:
+        return
+    lease["released"].set()
+    try:
+        remove_objects(metadata_bucket, [lease["name"]])
+    except S3Error as e:
+        print(f"Failed to release lease {lease['name']}, it expires in {lease_seconds:.0f}s: {e}")
+
+def directory_lease_key(directory, bucket_name=destination_bucket):
+    """Lease held by every writer of a silver directory: appends, compactions and the ML state of a dataset
+    directory, swaps and compactions of a file mode output (<name>_processed.parquet)."""
+    if bucket_name == destination_bucket and directory.startswith(dataset_prefix):
+        return f"_datasets/{directory[len(dataset_prefix):]}"
+    return f"_directories/{bucket_name}/{directory}"
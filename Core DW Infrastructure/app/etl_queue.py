@@ -0,0 +1,170 @@
+import sqlite3
+import subprocess
+import os
+import sys
+import time
+from datetime import datetime
+
+# Local job queue shared by the Streamlit front end and the ETL worker (etl_worker.py).
+# The front end only queues jobs and reads their status, the worker keeps one SparkSession
+# warm and runs the jobs on a pool of threads so there is one JVM start-up instead of one per file.
+
+app_dir = os.path.dirname(os.path.abspath(__file__))
+queue_db = os.getenv('ETL_QUEUE_DB', os.path.join(app_dir, "etl_jobs.db"))
+worker_log = os.path.join(app_dir, "etl_worker.log")
+heartbeat_timeout = 30  # seconds without a heartbeat before the worker is considered dead
+poll_interval = 1  # seconds between status checks
+job_wait_timeout = int(os.getenv('ETL_JOB_WAIT_SECONDS', 3600))  # how long a front end waits for a job
+
+def get_connection():
+    """Open the queue database, creating the tables on first use."""
+    conn = sqlite3.connect(queue_db, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS etl_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            file_name TEXT NOT NULL,
+            preprocessing_option TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            output TEXT,
+            submitted_at TEXT,
+            started_at TEXT,
+            finished_at TEXT
+        )
+        """
+    )
+    conn.execute("CREATE TABLE IF NOT EXISTS etl_worker (id INTEGER PRIMARY KEY CHECK (id = 1), pid INTEGER, heartbeat REAL)")
+    return conn
+
+def submit_job(file_name, preprocessing_option):
+    """Queue a file for the ETL worker and return the job id."""
+    conn = get_connection()
+    try:
+        cursor = conn.execute(
+            "INSERT INTO etl_jobs (file_name, preprocessing_option, submitted_at) VALUES (?, ?, ?)",
+            (file_name, preprocessing_option, datetime.now().isoformat())
+        )
+        return cursor.lastrowid
+    finally:
+        conn.close()
+
+def claim_next_job():
+    """Move the oldest queued job to 'running' and return it, None if the queue is empty.
+    Jobs for a file that is already running wait, so a double-click runs after the first job
+    (and is skipped if that one processed the file) instead of next to it."""
+    conn = get_connection()
+    try:
+        conn.execute("BEGIN IMMEDIATE")  # take the write lock so a job is only claimed once
+        job = conn.execute(
+            "SELECT * FROM etl_jobs WHERE status = 'queued' "
+            "AND file_name NOT IN (SELECT file_name FROM etl_jobs WHERE status = 'running') "
+            "ORDER BY id LIMIT 1"
+        ).fetchone()
+        if job is not None:
+            conn.execute(
+                "UPDATE etl_jobs SET status = 'running', started_at = ? WHERE id = ?",
+                (datetime.now().isoformat(), job["id"])
+            )
+        conn.execute("COMMIT")
+        return dict(job) if job is not None else None
+    finally:
+        conn.close()
+
+def requeue_interrupted_jobs():
+    """Put jobs left 'running' by a worker that died back in the queue, returns how many were requeued."""
+    conn = get_connection()
+    try:
+        cursor = conn.execute("UPDATE etl_jobs SET status = 'queued', started_at = NULL WHERE status = 'running'")
+        return cursor.rowcount
+    finally:
+        conn.close()
+
+def finish_job(job_id, status, output):
+    """Record the final status ('processed', 'skipped' or 'failed') and captured output of a job."""
+    conn = get_connection()
+    try:
+        conn.execute(
+            "UPDATE etl_jobs SET status = ?, output = ?, finished_at = ? WHERE id = ?",
+            (status, output, datetime.now().isoformat(), job_id)
+        )
+    finally:
+        conn.close()
+
+def get_job(job_id):
+    conn = get_connection()
+    try:
+        job = conn.execute("SELECT * FROM etl_jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(job) if job is not None else None
+    finally:
+        conn.close()
+
+def fail_unfinished_job(job_id, output):
+    """Mark a job that is still queued or running as failed, a job that finished in the meantime is left alone."""
+    conn = get_connection()
+    try:
+        conn.execute(
+            "UPDATE etl_jobs SET status = 'failed', output = ?, finished_at = ? "
+            "WHERE id = ? AND status IN ('queued', 'running')",
+            (output, datetime.now().isoformat(), job_id)
+        )
+    finally:
+        conn.close()
+
+def wait_for_job(job_id, timeout=None):
+    """Block until a job has finished and return it. Returns the job as it is if the timeout runs out.
+    When the worker's heartbeat goes stale a new worker is started, which requeues the jobs the old one
+    left running, and if none comes up the job is marked as failed."""
+    started = time.time()
+    while True:
+        job = get_job(job_id)
+        if job is None or job["status"] not in ("queued", "running"):
+            return job
+        if timeout is not None and time.time() - started > timeout:
+            return job
+        if not is_worker_alive():
+            ensure_worker_running()
+            if not is_worker_alive():
+                fail_unfinished_job(job_id, f"The ETL worker stopped and could not be restarted, check {worker_log}")
+                continue
+        time.sleep(poll_interval)
+
+def record_heartbeat():
+    """Called periodically by the worker so the front end knows it is alive."""
+    conn = get_connection()
+    try:
+        conn.execute(
+            "INSERT OR REPLACE INTO etl_worker (id, pid, heartbeat) VALUES (1, ?, ?)",
+            (os.getpid(), time.time())
+        )
+    finally:
+        conn.close()
+
+def is_worker_alive():
+    conn = get_connection()
+    try:
+        row = conn.execute("SELECT heartbeat FROM etl_worker WHERE id = 1").fetchone()
+        return row is not None and time.time() - row["heartbeat"] < heartbeat_timeout
+    finally:
+        conn.close()
+
+def ensure_worker_running():
+    """Start the ETL worker in the background if it is not running yet.
+    The worker holds a lock file, so a second copy started by another session exits straight away."""
+    if is_worker_alive():
+        return
+    with open(worker_log, "a") as log_file:
+        subprocess.Popen(
+            [sys.executable, os.path.join(app_dir, "etl_worker.py")],
+            cwd=app_dir,
+            stdout=log_file,
+            stderr=subprocess.STDOUT,
+            start_new_session=True
+        )
+    # wait for the first heartbeat so jobs are not queued against a worker that failed to start
+    for _ in range(heartbeat_timeout):
+        if is_worker_alive():
+            return
+        time.sleep(poll_interval)
+    print(f"ETL worker did not report a heartbeat yet, check {worker_log}")
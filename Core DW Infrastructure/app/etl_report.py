@@ -0,0 +1,129 @@
+import argparse
+import json
+import os
+import statistics
+from minio import Minio
+from minio.error import S3Error
+
+# Summarises the run reports the ETL writes to dw-bucket-metadata/_runs/<date>/<run_id>.json,
+# so a slower stage or a growing amount of data read or shuffled shows up across runs.
+#
+#   python etl_report.py                          per-stage summary of every run
+#   python etl_report.py --since 2024-12-01 --by-day
+#   python etl_report.py --option "Data Clean Up" --runs
+
+url = os.getenv('MINIO_ADDRESS')
+
+minio_client = Minio(
+    url,  # Minio IP
+    access_key=os.getenv('AWS_ACCESS_KEY_ID'),
+    secret_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
+    secure=False
+)
+
+metadata_bucket = "dw-bucket-metadata"
+run_reports_prefix = "_runs/"
+
+def load_reports(since=None, until=None):
+    """Read the run reports, optionally limited to the days between since and until (YYYY-MM-DD)."""
+    reports = []
+    for obj in minio_client.list_objects(metadata_bucket, prefix=run_reports_prefix, recursive=True):
+        day = obj.object_name[len(run_reports_prefix):].split('/', 1)[0]
+        if (since and day < since) or (until and day > until) or not obj.object_name.endswith('.json'):
+            continue
+        response = minio_client.get_object(metadata_bucket, obj.object_name)
+        try:
+            reports.append(json.loads(response.read()))
+        finally:
+            response.close()
+            response.release_conn()
+    return sorted(reports, key=lambda report: report["started_at"])
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def stage_rows(reports, by_day=False):
+    """One row per stage (and day with by_day) with the distribution of its wall time and
+    the median data volume. The whole run is reported as the stage "total"."""
+    samples = {}
+    for report in reports:
+        day = report["started_at"][:10] if by_day else ""
+        samples.setdefault((day, "total"), []).append(dict(report["totals"], wall_seconds=report["wall_seconds"]))
+        for stage in report["stages"]:
+            samples.setdefault((day, stage["name"]), []).append(stage)
+
+    rows = []
+    for (day, name), stages in sorted(samples.items()):
+        wall = [stage["wall_seconds"] for stage in stages]
+        read_mb = [stage["input_bytes"] / (1024 * 1024) for stage in stages]
+        rows.append({
+            "day": day,
+            "stage": name,
+            "runs": len(stages),
+            "median_s": statistics.median(wall),
+            "p95_s": percentile(wall, 0.95),
+            "max_s": max(wall),
+            "median_read_mb": statistics.median(read_mb),
+            "median_written_mb": statistics.median(stage["output_bytes"] / (1024 * 1024) for stage in stages),
+            "median_shuffle_mb": statistics.median(stage["shuffle_write_bytes"] / (1024 * 1024) for stage in stages),
+            "spark_jobs": statistics.median(stage["spark_jobs"] for stage in stages),
+            # seconds per GB read makes runs over files of different sizes comparable
+            "s_per_gb_read": round(sum(wall) / (sum(read_mb) / 1024), 1) if sum(read_mb) else None,
+        })
+    return rows
+
+def print_table(rows, columns):
+    widths = {column: max(len(column), *(len(format_value(row[column])) for row in rows)) for column in columns}
+    print("  ".join(column.ljust(widths[column]) for column in columns))
+    for row in rows:
+        print("  ".join(format_value(row[column]).ljust(widths[column]) for column in columns))
+
+def format_value(value):
+    if isinstance(value, float):
+        return f"{value:.2f}"
+    return "" if value is None else str(value)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Aggregate ETL run reports from the metadata bucket")
+    parser.add_argument("--since", help="first day to include, YYYY-MM-DD")
+    parser.add_argument("--until", help="last day to include, YYYY-MM-DD")
+    parser.add_argument("--option", help="only runs with this preprocessing option")
+    parser.add_argument("--status", default="processed", help="only runs with this status, 'all' for every run")
+    parser.add_argument("--by-day", action="store_true", help="one row per stage and day to follow trends")
+    parser.add_argument("--runs", action="store_true", help="list the individual runs instead of the stage summary")
+    parser.add_argument("--json", action="store_true", help="print the rows as JSON")
+    args = parser.parse_args()
+
+    try:
+        reports = load_reports(args.since, args.until)
+    except S3Error as e:
+        print(f"Failed to read run reports: {e}")
+        raise SystemExit(1)
+    reports = [report for report in reports
+               if (args.status == "all" or report["status"] == args.status)
+               and (args.option is None or report["preprocessing_option"] == args.option)]
+    if not reports:
+        print("No run reports found.")
+        raise SystemExit(0)
+
+    if args.runs:
+        rows = [{
+            "started_at": report["started_at"][:19],
+            "status": report["status"],
+            "files": len(report["files"]),
+            "wall_s": report["wall_seconds"],
+            "read_mb": report["totals"]["input_bytes"] / (1024 * 1024),
+            "written_mb": report["totals"]["output_bytes"] / (1024 * 1024),
+            "rows_in": report["totals"]["input_records"],
+            "rows_out": report["totals"]["output_records"],
+            "first_file": report["files"][0] if report["files"] else "",
+        } for report in reports]
+    else:
+        rows = stage_rows(reports, args.by_day)
+
+    if args.json:
+        print(json.dumps(rows, indent=2))
+    else:
+        print_table(rows, list(rows[0].keys()) if args.by_day or args.runs else [c for c in rows[0] if c != "day"])
@@ -0,0 +1,102 @@
+from pyspark.sql.functions import when, col, lit, count, input_file_name, sha2, substring, explode, array, struct, \
+    conv, length, bin, min as min_, max as max_
+from pyspark.sql.types import NumericType, StringType, DateType, TimestampType, BooleanType
+from datetime import datetime
+from urllib.parse import unquote
+import os
+import zone_maps
+from etl_storage import get_spark, minio_client, destination_bucket, read_json_object, write_json_object
+from etl_leases import wait_for_lease, release_lease
+
+# Keeps the zone maps of the silver directories (zone_maps.py) up to date after every write.
+
+# Set ETL_COLUMN_STATS=false to skip the zone maps (_stats.json: per file and column min/max, nulls and
+# a distinct-count sketch) that are kept next to the silver output for file pruning (zone_maps.py)
+column_stats = os.getenv('ETL_COLUMN_STATS', 'true').lower() == 'true'
+column_stats_types = {NumericType: "number", StringType: "string", DateType: "date", TimestampType: "timestamp",
+                      BooleanType: "boolean"}
+
+def stats_column_type(data_type):
+    """Zone map type of a Spark type, None for types without min/max (arrays, maps, structs, binary)."""
+    for spark_type, name in column_stats_types.items():
+        if isinstance(data_type, spark_type):
+            return name
+    return None
+
+def spark_file_stats(bucket_name, root, file_names):
+    """Zone map entries of parquet files under root, in two Spark jobs: min, max, nulls and row count
+    per file and column, and the HyperLogLog registers of every column (zone_maps.value_register in SQL)."""
+    base_path = f"s3a://{bucket_name}/{root}"
+    df = get_spark().read.option("basePath", base_path) \
+        .parquet(*[f"s3a://{bucket_name}/{name}" for name in file_names])  # partition columns included
+    columns = [(field.name, stats_column_type(field.dataType)) for field in df.schema.fields]
+    columns = [(name, column_type) for name, column_type in columns if column_type is not None]
+    df = df.withColumn("_file", input_file_name())
+
+    aggregations = [count(lit(1)).alias("rows")]
+    for idx, (name, _) in enumerate(columns):
+        aggregations += [min_(col(name)).alias(f"min_{idx}"), max_(col(name)).alias(f"max_{idx}"),
+                         count(when(col(name).isNull(), 1)).alias(f"nulls_{idx}")]
+    per_file = df.groupBy("_file").agg(*aggregations).collect()
+
+    ranks = {}
+    if columns:
+        registers = 1 << zone_maps.sketch_precision
+        entries = []
+        for idx, (name, _) in enumerate(columns):
+            digest = sha2(col(name).cast("string"), 256)
+            entries.append(when(col(name).isNotNull(), struct(
+                lit(idx).alias("column"),
+                (conv(substring(digest, 1, 4), 16, 10).cast("int") % registers).alias("register"),
+                (lit(53) - length(bin(conv(substring(digest, 5, 13), 16, 10).cast("long")))).alias("rank"))))
+        sketch_rows = df.select("_file", explode(array(*entries)).alias("entry")).where(col("entry").isNotNull()) \
+            .groupBy("_file", col("entry.column").alias("column"), col("entry.register").alias("register")) \
+            .agg(max_(col("entry.rank")).alias("rank")).collect()
+        for row in sketch_rows:
+            ranks.setdefault((row["_file"], row["column"]), {})[row["register"]] = row["rank"]
+
+    stats = {}
+    for row in per_file:
+        stats[unquote(row["_file"]).split(f"{bucket_name}/", 1)[-1]] = {
+            "rows": row["rows"],
+            "columns": {name: {
+                "type": column_type,
+                "min": zone_maps.json_bound(row[f"min_{idx}"], False),
+                "max": zone_maps.json_bound(row[f"max_{idx}"], True),
+                "nulls": row[f"nulls_{idx}"],
+                "sketch": zone_maps.sketch_from_ranks(ranks.get((row["_file"], idx), {})),
+            } for idx, (name, column_type) in enumerate(columns)},
+        }
+    return stats
+
+def refresh_column_stats(root, bucket_name=destination_bucket, compute=spark_file_stats):
+    """Bring the zone maps (<root>/_stats.json) of a silver directory up to date after a write: entries of
+    files that are gone are dropped and files without an entry are added, computed by compute(bucket_name,
+    root, file_names). Any writer (appends, overwrites, compactions) only has to call this afterwards.
+    A lease serializes concurrent updates of the same sidecar. Failures are reported, not raised."""
+    if not column_stats:
+        return
+    lease = None
+    try:
+        lease = wait_for_lease(f"_stats/{bucket_name}/{root}")
+        current = zone_maps.list_data_files(minio_client, bucket_name, root)
+        document = read_json_object(bucket_name, f"{root}/{zone_maps.stats_name}") or {}
+        files = {name: entry for name, entry in document.get("files", {}).items()
+                 if current.get(name) == entry.get("etag")
+                 and document.get("sketch_precision") == zone_maps.sketch_precision}
+        missing = [name for name in current if name not in files]
+        if missing:
+            for name, entry in compute(bucket_name, root, missing).items():
+                if name in current:
+                    files[name] = dict(entry, etag=current[name])
+        write_json_object(bucket_name, f"{root}/{zone_maps.stats_name}", {
+            "sketch_precision": zone_maps.sketch_precision,
+            "updated_at": datetime.now().isoformat(),
+            "files": files,
+            "dataset": zone_maps.summarize(files),
+        })
+        print(f"Updated column stats of {bucket_name}/{root} ({len(missing)} new file(s), {len(files)} in total)")
+    except Exception as e:
+        print(f"Failed to update column stats of {bucket_name}/{root}: {e}")
+    finally:
+        release_lease(lease)
@@ -0,0 +1,94 @@
+from pyspark.sql import SparkSession
+from minio import Minio
+from minio.error import S3Error
+from minio.deleteobjects import DeleteObject
+import os
+import io
+import json
+import threading
+
+# Object storage of the ETL: the MinIO client, the SparkSession that reads and writes the buckets through S3A,
+# the buckets and metadata prefixes of every layer, and the JSON documents kept next to the data.
+
+url = os.getenv('MINIO_ADDRESS', '10.137.0.149:9000')  # the File Upload Service VM's MinIO when unset
+
+# MinIO creds
+minio_client = Minio(
+    url,  # Minio IP
+    access_key=os.getenv('AWS_ACCESS_KEY_ID'),
+    secret_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
+    secure=False
+)
+
+# spark session with Minio using parquet (instead of Deltatables and no longer iceberg),
+# started on first use so files handled by the local engine (etl_local.py) never start the JVM
+spark = None
+spark_lock = threading.Lock()  # the worker pool starts jobs in several threads
+
+def get_spark():
+    """Return the SparkSession, starting it the first time it is needed."""
+    global spark
+    with spark_lock:
+        if spark is None:
+            spark = SparkSession.builder \
+                .appName("ETL with Spark and Parquet") \
+                .config("spark.jars.packages",
+                        "org.apache.hadoop:hadoop-aws:3.3.1,"
+                        "com.amazonaws:aws-java-sdk-bundle:1.11.1026") \
+                .config("spark.hadoop.fs.s3a.impl", "org.apache.hadoop.fs.s3a.S3AFileSystem") \
+                .config("spark.hadoop.fs.s3a.endpoint", "http://" + url) \
+                .config("spark.hadoop.fs.s3a.access.key", os.getenv('AWS_ACCESS_KEY_ID')) \
+                .config("spark.hadoop.fs.s3a.secret.key", os.getenv('AWS_SECRET_ACCESS_KEY')) \
+                .config("spark.hadoop.fs.s3a.path.style.access", "true") \
+                .config("spark.hadoop.fs.s3a.connection.ssl.enabled", "false") \
+                .config("spark.scheduler.mode", "FAIR") \
+                .getOrCreate()
+    return spark
+
+# for ETL the source will be coming from bronze with original data and the result will be stored in silver.
+source_bucket = "dw-bucket-bronze"
+destination_bucket = "dw-bucket-silver"
+metadata_bucket = "dw-bucket-metadata"  # Bucket to store metadata of processed files
+manifest_prefix = "_manifest/"  # Processed-file manifest inside the metadata bucket, one entry per source object
+ml_stats_prefix = "_ml_stats/"  # Fitted ML preprocessing statistics, one document per dataset
+ml_state_prefix = "_ml_state/"  # Mergeable statistics of every row seen per dataset (ml_state.py)
+schema_registry_prefix = "_schemas/"  # Inferred CSV schemas keyed by project and header signature
+dataset_prefix = "datasets/"  # Dataset-level directories in the silver bucket used by the incremental write mode
+run_reports_prefix = "_runs/"  # Per-run timing and Spark metrics reports, one JSON document per run
+dedup_prefix = "_dedup/"  # Row-hash index per incremental dataset, used to skip rows already in silver
+converted_prefix = "_converted/"  # Sources Spark cannot read directly, converted while they are processed
+leases_prefix = "_leases/"  # Claims on files (and datasets) being processed, one object per claimant
+checkpoints_prefix = "_checkpoints/"  # Progress of large files processed in chunks (etl_chunked.py)
+
+def read_json_object(bucket_name, object_name):
+    """Read a JSON document from a bucket, returns None if it does not exist."""
+    try:
+        response = minio_client.get_object(bucket_name, object_name)
+        try:
+            return json.loads(response.read())
+        finally:
+            response.close()
+            response.release_conn()
+    except S3Error as e:
+        if e.code == 'NoSuchKey':
+            return None
+        raise
+
+def write_json_object(bucket_name, object_name, payload):
+    """Write a JSON document in a single put so readers never see a partial object."""
+    data = json.dumps(payload, indent=2, default=str).encode("utf-8")
+    minio_client.put_object(bucket_name, object_name, io.BytesIO(data), len(data), content_type="application/json")
+
+def read_metadata_json(object_name):
+    """Read a JSON document from the metadata bucket, returns None if it does not exist."""
+    return read_json_object(metadata_bucket, object_name)
+
+def write_metadata_json(object_name, payload):
+    """Write a JSON document to the metadata bucket."""
+    write_json_object(metadata_bucket, object_name, payload)
+
+def remove_objects(bucket_name, object_names):
+    """Delete a list of objects, reporting (not raising) the ones that could not be deleted."""
+    errors = minio_client.remove_objects(bucket_name, [DeleteObject(name) for name in object_names])
+    for error in errors:  # deletion is lazy, iterating runs it
+        print(f"Failed to delete {error.name} from {bucket_name}: {error}")
@@ -0,0 +1,109 @@
+import fcntl
+import io
+import os
+import sys
+import threading
+import time
+import etl_queue
+
+# Long-running ETL worker: imports etl_pipeline once and then processes the jobs queued by the
+# Streamlit front end on a pool of ETL_WORKER_CONCURRENCY threads. Small files run on the local engine,
+# the SparkSession is started by the first file that needs Spark and shared by every later one
+# (one JVM per worker, its FAIR scheduler runs the jobs of the threads side by side).
+# Each file is claimed with a lease in the metadata bucket before it is processed (etl_leases.acquire_lease),
+# so workers on other hosts and direct runs of etl_pipeline.py never process the same file at the same time.
+# Started on demand by etl_queue.ensure_worker_running, or manually with `python etl_worker.py`.
+
+lock_path = os.path.join(etl_queue.app_dir, "etl_worker.lock")
+worker_concurrency = int(os.getenv('ETL_WORKER_CONCURRENCY', str(min(4, os.cpu_count() or 1))))
+finish_attempts = 5  # tries to store a job's status, a job left 'running' is requeued by the next worker start
+
+class JobOutput(io.TextIOBase):
+    """sys.stdout for the pool: what a job thread prints goes to the output of its job,
+    everything else to the worker log. contextlib.redirect_stdout would swap it for every thread."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def write(self, text):
+        buffer = getattr(self.local, "buffer", None)
+        return (buffer if buffer is not None else self.stream).write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+def heartbeat_loop():
+    """Keep the heartbeat fresh, also while a long job is running."""
+    while True:
+        try:
+            etl_queue.record_heartbeat()
+        except Exception as e:  # e.g. the queue database locked for longer than its timeout, the next beat tries again
+            print(f"Failed to record the heartbeat: {e}", flush=True)
+        time.sleep(etl_queue.heartbeat_timeout / 3)
+
+def finish_job(job, status, output):
+    """etl_queue.finish_job, tried again while the queue database is locked. Returns False if it never got through."""
+    for attempt in range(1, finish_attempts + 1):
+        try:
+            etl_queue.finish_job(job["id"], status, output)
+            return True
+        except Exception as e:
+            print(f"Failed to record job {job['id']} as {status} (attempt {attempt} of {finish_attempts}): {e}", flush=True)
+            time.sleep(etl_queue.poll_interval * attempt)
+    return False
+
+def run_job(etl_pipeline, job, job_output):
+    """Run one queued job and store its status and printed output."""
+    output = io.StringIO()
+    started = time.time()
+    job_output.local.buffer = output
+    try:
+        status = etl_pipeline.main(job["file_name"], job["preprocessing_option"])
+    except Exception as e:
+        print(f"Failed to process file {job['file_name']}: {e}")
+        status = "failed"
+    finally:
+        job_output.local.buffer = None
+    finish_job(job, status, output.getvalue())
+    print(f"Job {job['id']} ({job['file_name']}) {status} in {time.time() - started:.1f}s", flush=True)
+
+def job_loop(etl_pipeline, job_output):
+    """One thread of the pool: claim the next queued job and run it, forever."""
+    while True:
+        try:
+            job = etl_queue.claim_next_job()
+        except Exception as e:  # e.g. the queue database locked for longer than its timeout
+            print(f"Failed to claim a job: {e}", flush=True)
+            job = None
+        if job is None:
+            time.sleep(etl_queue.poll_interval)
+            continue
+        run_job(etl_pipeline, job, job_output)
+
+def main():
+    lock_file = open(lock_path, "w")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        print("Another ETL worker is already running, exiting.")
+        return
+
+    threading.Thread(target=heartbeat_loop, daemon=True).start()
+    requeued = etl_queue.requeue_interrupted_jobs()
+    if requeued:
+        print(f"Requeued {requeued} job(s) interrupted by a previous worker.", flush=True)
+
+    import etl_pipeline  # done once for every job this worker runs, Spark starts on first use
+    job_output = JobOutput(sys.stdout)
+    sys.stdout = job_output
+    threads = [threading.Thread(target=job_loop, args=(etl_pipeline, job_output), daemon=True)
+               for _ in range(worker_concurrency)]
+    for thread in threads:
+        thread.start()
+    print(f"ETL worker ready with {worker_concurrency} job threads, waiting for jobs.", flush=True)
+    for thread in threads:
+        thread.join()
+
+if __name__ == "__main__":
+    main()
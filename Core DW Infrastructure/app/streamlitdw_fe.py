@@ -6,7 +6,7 @@ from dotenv import load_dotenv
 import io
 import os
 import datetime
-import subprocess
+from etl_queue import ensure_worker_running, submit_job, wait_for_job, job_wait_timeout
 import pandas as pd
 import psycopg2
 from elasticsearch import Elasticsearch
@@ -164,20 +164,21 @@ def log_provenance(event_source, event_type, user_id, source_ip, bucket_name, ob
         print(f"Failed to log provenance data: {e}")
 
 def trigger_etl(file_name, preprocessing_option):
-    """Trigger the ETL pipeline with the selected preprocessing option."""
+    """Queue the file for the ETL worker, which keeps a warm Spark session, and wait for the result."""
     try:
-        result = subprocess.run(
-            ["python", "etl_pipeline.py", file_name, preprocessing_option], 
-            check=True, 
-            stdout=subprocess.PIPE, 
-            stderr=subprocess.PIPE, 
-            text=True
-        )
-        st.success("ETL pipeline executed successfully.")
-        st.text(f"ETL Output: {result.stdout}")
-    except subprocess.CalledProcessError as e:
+        ensure_worker_running()
+        job = wait_for_job(submit_job(file_name, preprocessing_option), timeout=job_wait_timeout)
+        if job["status"] in ("queued", "running"):
+            st.warning(f"ETL pipeline for {file_name} is still {job['status']} after {job_wait_timeout}s, "
+                       "the worker finishes it in the background.")
+            return
+        if job["status"] == "failed":
+            st.error(f"Failed to execute ETL pipeline for: {file_name}")
+        else:
+            st.success(f"ETL pipeline executed successfully ({job['status']}).")
+        st.text(f"ETL Output: {job['output']}")
+    except Exception as e:
         st.error(f"Failed to execute ETL pipeline: {e}")
-        st.text(f"ETL Error Output: {e.stderr}")
 
 def get_file_list(bucket):
     try:
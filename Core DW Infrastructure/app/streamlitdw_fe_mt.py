@@ -6,8 +6,9 @@ from dotenv import load_dotenv
 import io
 import os
 import datetime
-import subprocess
+from etl_queue import ensure_worker_running, submit_job, wait_for_job, job_wait_timeout
 import pandas as pd
+import time
 
 # Load environment variables
 load_dotenv()
@@ -56,21 +57,27 @@ def upload_to_minio(file, filename, bucket_name):
         st.error(f"Failed to upload {filename} to {bucket_name}: {e}")
 
 
-def trigger_etl(filename, preprocessing_option):
-    """Trigger the ETL pipeline with the selected preprocessing option."""
+def trigger_etl(filenames, preprocessing_option):
+    """Queue all files for the ETL worker, which keeps one warm Spark session for the whole batch,
+    then report the status of each job as it finishes."""
     try:
-        result = subprocess.run(
-            ["python", "etl_pipeline.py", filename, preprocessing_option],
-            check=True,
-            stdout=subprocess.PIPE, 
-            stderr=subprocess.PIPE, 
-            text=True
-        )
-        st.success(f"ETL pipeline executed successfully for: {filename}")
-        st.text(result.stdout)
-    except subprocess.CalledProcessError as e:
-        st.error(f"Failed to execute ETL pipeline for: {filename}")
-        st.text(f"ETL Error Output: {e.stderr}")
+        ensure_worker_running()
+        job_ids = [submit_job(filename, preprocessing_option) for filename in filenames]
+    except Exception as e:
+        st.error(f"Failed to queue ETL jobs: {e}")
+        return
+
+    deadline = time.time() + job_wait_timeout  # for the whole batch, not per file
+    for filename, job_id in zip(filenames, job_ids):
+        job = wait_for_job(job_id, timeout=max(deadline - time.time(), 0))
+        if job["status"] in ("queued", "running"):
+            st.warning(f"ETL pipeline for {filename} is still {job['status']}, the worker finishes it in the background.")
+            continue
+        if job["status"] == "failed":
+            st.error(f"Failed to execute ETL pipeline for: {filename}")
+        else:
+            st.success(f"ETL pipeline executed successfully for: {filename} ({job['status']})")
+        st.text(job["output"])
 
 
 def get_file_list(bucket):
@@ -158,8 +165,7 @@ def main():
         # Option to trigger ETL after all uploads
         if st.session_state.uploaded_filenames:
             if st.button("Triggering ETL for All Uploaded Files"):
-                for filename in st.session_state.uploaded_filenames:
-                    trigger_etl(filename, preprocessing)
+                trigger_etl(st.session_state.uploaded_filenames, preprocessing)
         
      # Tab 2: View Bronze Files
     with tabs[1]:
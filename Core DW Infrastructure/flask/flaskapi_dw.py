@@ -4,6 +4,7 @@ from minio.error import S3Error
 from dotenv import load_dotenv
 import os
 import io
+import zone_maps
 
 app = Flask(__name__)
 
@@ -82,5 +83,43 @@ def download_file():
     except S3Error as err:
         return jsonify({"error": str(err)}), 500
 
+# Endpoint to read the column statistics (zone maps) the ETL keeps for a silver dataset
+@app.route('/dataset-stats', methods=['GET'])
+def dataset_stats():
+    path = request.args.get('path')  # e.g. datasets/heart or project1/heart_processed.parquet
+    if not path:
+        return jsonify({"error": "Missing path"}), 400
+
+    try:
+        stats = zone_maps.load_stats(minio_client, 'dw-bucket-silver', path.rstrip('/'))
+        if stats is None:
+            return jsonify({"error": f"No column stats for {path}"}), 404
+        return jsonify(stats["dataset"])
+    except S3Error as err:
+        return jsonify({"error": str(err)}), 500
+
+# Endpoint to list only the silver files that can hold rows matching a predicate, e.g. where=age >= 60 and sex = 1
+@app.route('/prune-files', methods=['GET'])
+def prune_files():
+    path = request.args.get('path')
+    where = request.args.get('where', '')
+    if not path:
+        return jsonify({"error": "Missing path"}), 400
+
+    try:
+        files, total = zone_maps.select_files(minio_client, 'dw-bucket-silver', path.rstrip('/'), where)
+    except ValueError as err:
+        return jsonify({"error": str(err)}), 400
+    except S3Error as err:
+        return jsonify({"error": str(err)}), 500
+
+    return jsonify({
+        "path": path,
+        "where": where,
+        "files": files,
+        "total_files": total,
+        "skipped_files": total - len(files)
+    })
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000)  # Running on port 5000 IMPORTANT
\ No newline at end of file
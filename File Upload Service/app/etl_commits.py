@@ -0,0 +1,93 @@
+# Vendored from Core DW Infrastructure/app/etl_commits.py by scripts/sync_shared_modules.py, edit that file instead.
+from minio.commonconfig import CopySource
+from datetime import datetime
+import io
+import math
+import os
+import time
+import uuid
+from etl_storage import minio_client, destination_bucket, metadata_bucket, read_json_object, write_json_object, \
+    remove_objects
+from etl_dedup import publish_dedup_index
+
+# Commit protocol of the silver directories (appends of the incremental mode, file mode outputs, compactions).
+# New files are staged under <directory>/_staging/ first. A pending marker _commits/<batch_id>.pending.json
+# lists them and the files they replace, the files are copied into place and _commits/<batch_id>.json is
+# written as the commit point, only then are the replaced files and the pending marker deleted. Readers that
+# list through zone_maps.list_data_files see the directory before or after a batch, never halfway.
+# A batch that died before its commit point is rolled back, one that died after it is rolled forward.
+# Appends with ETL_DEDUP_INDEX also list their staged row hashes (dedup_index), moved into the dataset's
+# hash index between the commit point and the deletion of the pending marker (etl_dedup.py).
+
+stale_batch_seconds = float(os.getenv('ETL_STALE_BATCH_HOURS', '24')) * 3600  # uncommitted batches older than this are rolled back (appends, which hold the dataset lease, roll back any)
+
+def new_batch_id():
+    return f"{datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+
+def batch_committed(output_name, batch_id):
+    return read_json_object(destination_bucket, f"{output_name}/_commits/{batch_id}.json") is not None
+
+def batch_sidecar_prefix(dataset_dir, batch_id):
+    return f"{dataset_dir}/_batches/{batch_id}_"
+
+def publish_batch(bucket_name, directory, files, batch_id, replaces=(), resume=False, **fields):
+    """Copy staged files ({staged name: target name}) into a directory with the commit protocol, replacing the
+    files in replaces. fields are stored in the markers as well (sources, compaction, dedup_index). resume: a run that died
+    may have started the same batch, files it already copied are not copied again. Returns the commit marker."""
+    commit = dict({"batch_id": batch_id}, **fields)
+    commit.update({"files": list(files.values()), "replaces": list(replaces), "started_at": datetime.now().isoformat()})
+    pending_name = f"{directory}/_commits/{batch_id}.pending.json"
+    write_json_object(bucket_name, pending_name, commit)
+    present = set()
+    if resume:
+        present = {obj.object_name for obj in minio_client.list_objects(bucket_name, prefix=f"{directory}/", recursive=True)}
+    for staged_name, target_name in files.items():
+        if target_name not in present:
+            minio_client.copy_object(bucket_name, target_name, CopySource(bucket_name, staged_name))
+    commit["committed_at"] = datetime.now().isoformat()
+    write_json_object(bucket_name, f"{directory}/_commits/{batch_id}.json", commit)  # commit point
+    if commit.get("dedup_index"):
+        publish_dedup_index(commit["dedup_index"])
+    remove_objects(bucket_name, commit["replaces"] + [pending_name])
+    return commit
+
+def rollback_incomplete_batches(dataset_dir, bucket_name=destination_bucket, leased=False):
+    """Undo appends that never reached their commit marker (and are older than stale_batch_seconds,
+    so batches still being written by another run are left alone). A batch that did commit but died
+    before deleting the files it replaced (a compaction or a file mode output) or publishing its row hashes is
+    rolled forward instead. leased: the caller holds
+    the directory's lease (etl_leases.directory_lease_key), no other writer can be in the middle of a batch,
+    so every incomplete one is finished whatever its age."""
+    cutoff = math.inf if leased else time.time() - stale_batch_seconds
+    commits = {obj.object_name: obj for obj in minio_client.list_objects(bucket_name, prefix=f"{dataset_dir}/_commits/")}
+    for name, obj in commits.items():
+        if not name.endswith('.pending.json') or obj.last_modified.timestamp() > cutoff:
+            continue
+        pending = read_json_object(bucket_name, name)
+        if pending and name.replace('.pending.json', '.json') not in commits:
+            remove_objects(bucket_name, pending["files"])
+            remove_objects(metadata_bucket, list(pending.get("dedup_index", {})))
+            print(f"Rolled back uncommitted batch {pending['batch_id']} of {dataset_dir}")
+        elif pending and (pending.get("replaces") or pending.get("dedup_index")):
+            publish_dedup_index(pending.get("dedup_index", {}))
+            remove_objects(bucket_name, pending["replaces"])
+            print(f"Finished committed batch {pending['batch_id']} of {dataset_dir}")
+        remove_objects(bucket_name, [name])
+
+    staged = list(minio_client.list_objects(bucket_name, prefix=f"{dataset_dir}/_staging/", recursive=True))
+    remove_objects(bucket_name, [obj.object_name for obj in staged if obj.last_modified.timestamp() <= cutoff])
+
+def output_files(output_name):
+    """Parquet files of a file mode output directory, the ones a new version of it replaces."""
+    return [obj.object_name for obj in minio_client.list_objects(destination_bucket, prefix=f"{output_name}/", recursive=True)
+            if obj.object_name.endswith('.parquet') and not obj.object_name[len(output_name) + 1:].startswith('_')]
+
+def publish_output(output_name, staged_names, sources, batch_id, replaces=None, resume=False):
+    """Swap staged parquet files in for the files of a file mode output directory (<name>_processed.parquet)
+    with publish_batch. replaces defaults to the files the directory holds now, resume is passed on.
+    Returns the commit marker."""
+    files = {name: f"{output_name}/{batch_id}-{name.rsplit('/', 1)[-1]}" for name in staged_names}
+    replaces = output_files(output_name) if replaces is None else replaces
+    commit = publish_batch(destination_bucket, output_name, files, batch_id, replaces, resume, sources=sources)
+    minio_client.put_object(destination_bucket, f"{output_name}/_SUCCESS", io.BytesIO(b""), 0)
+    return commit
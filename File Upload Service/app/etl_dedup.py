@@ -0,0 +1,74 @@
+# Vendored from Core DW Infrastructure/app/etl_dedup.py by scripts/sync_shared_modules.py, edit that file instead.
+from pyspark.sql.functions import col, lit, coalesce, sha2, concat_ws, substring
+from pyspark.sql.utils import AnalysisException
+from minio.commonconfig import CopySource
+from minio.error import S3Error
+from etl_storage import minio_client, get_spark, metadata_bucket, dedup_prefix, dataset_prefix, remove_objects
+
+# Cross-run deduplication of the incremental write mode (ETL_DEDUP_INDEX=true): every row appended to a
+# dataset is recorded by the SHA-256 of its content in _dedup/<dataset>/ in the metadata bucket, partitioned
+# by the first two hex digits of the hash, and rows of later batches whose hash is already there are dropped.
+# The hashes of a batch are staged under _dedup/<dataset>/_staging/<batch_id>/ and listed in the batch's
+# pending marker, they move into the index after the commit point (etl_commits.publish_batch), or when
+# rollback_incomplete_batches finishes a batch that died in between.
+
+# added by the pipeline (clean up, grouped reads), not part of a row's content; project, the partition
+# column of appends, is added after the rows are hashed
+pipeline_columns = ("extract_date", "unique_id", "source_file")
+
+def row_hash_column(df, extra_columns=()):
+    """Deterministic SHA-256 of the content of a row: the data columns sorted by name, with nulls
+    kept distinct from empty strings. extra_columns are hashed as well, e.g. the source file."""
+    columns = sorted(c for c in df.columns if c not in pipeline_columns) + list(extra_columns)
+    return sha2(concat_ws("\x1f", *[coalesce(col(c).cast("string"), lit("\x00")) for c in columns]), 256)
+
+def dedup_index_prefix(dataset_dir):
+    return f"{dedup_prefix}{dataset_dir[len(dataset_prefix):]}"
+
+def dedup_index_path(dataset_dir):
+    return f"s3a://{metadata_bucket}/{dedup_index_prefix(dataset_dir)}"
+
+def drop_known_rows(df, dataset_dir):
+    """Remove rows of a batch that are already in the dataset: rows are hashed, duplicates within the
+    batch (also across its files) are dropped and the rest is anti-joined against the dataset's hash index,
+    which is partitioned by the first two hex digits of the hash. Adds a _row_hash column."""
+    df = df.withColumn("_row_hash", row_hash_column(df)).dropDuplicates(["_row_hash"])
+    try:
+        known_hashes = get_spark().read.parquet(dedup_index_path(dataset_dir)).select(col("row_hash").alias("_row_hash"))
+    except AnalysisException:
+        return df  # first batch of the dataset, no index yet
+    return df.join(known_hashes, on="_row_hash", how="left_anti")
+
+def stage_dedup_index(df, dataset_dir, batch_id):
+    """Write the hashes of a batch under the index's _staging/<batch_id>/, one file per hash bucket. Readers
+    of the index skip _ paths. Returns {staged name: index file name} for the batch's markers."""
+    index_prefix = dedup_index_prefix(dataset_dir)
+    staging_dir = f"{index_prefix}/_staging/{batch_id}"
+    df.select(col("_row_hash").alias("row_hash"), substring(col("_row_hash"), 1, 2).alias("bucket")) \
+        .repartition("bucket") \
+        .write.mode('overwrite').partitionBy("bucket").parquet(f"s3a://{metadata_bucket}/{staging_dir}")
+    # _staging/<batch_id>/bucket=xx/part-x.parquet -> bucket=xx/<batch_id>-part-x.parquet
+    files = {}
+    for obj in minio_client.list_objects(metadata_bucket, prefix=f"{staging_dir}/", recursive=True):
+        if obj.object_name.endswith('.parquet'):
+            partition_dir, part_file = obj.object_name[len(staging_dir) + 1:].rsplit('/', 1)
+            files[obj.object_name] = f"{index_prefix}/{partition_dir}/{batch_id}-{part_file}"
+    return files
+
+def publish_dedup_index(files):
+    """Move staged hashes ({staged name: index file name}) into the index. The staged files are deleted only
+    once all of them are copied, so a missing one was moved by an earlier attempt: calling this again for a
+    batch is harmless."""
+    for staged_name, index_name in files.items():
+        try:
+            minio_client.copy_object(metadata_bucket, index_name, CopySource(metadata_bucket, staged_name))
+        except S3Error as e:
+            if e.code != 'NoSuchKey':
+                raise
+    remove_objects(metadata_bucket, list(files))
+
+def remove_staged_hashes(dataset_dir):
+    """Delete hashes staged by appends that died before writing their pending marker. Only called with the
+    dataset's lease held, after rollback_incomplete_batches."""
+    staged = minio_client.list_objects(metadata_bucket, prefix=f"{dedup_index_prefix(dataset_dir)}/_staging/", recursive=True)
+    remove_objects(metadata_bucket, [obj.object_name for obj in staged])
@@ -0,0 +1,243 @@
+# Vendored from Core DW Infrastructure/app/etl_listener.py by scripts/sync_shared_modules.py, edit that file instead.
+import argparse
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from urllib.parse import unquote_plus
+from minio.error import S3Error
+import etl_queue
+from etl_storage import minio_client, source_bucket, read_json_object, read_metadata_json, write_metadata_json
+from etl_pipeline import source_format, strip_source_extension
+
+# Ingestion listener: queues new bronze uploads for the ETL worker without anyone clicking
+# "Trigger ETL" in the Streamlit app. New objects come from MinIO bucket notifications
+# (s3:ObjectCreated:*), or from polling the bucket listing against a checkpoint when notifications
+# are not available. Objects are debounced (an upload and its provenance JSON arrive one after the
+# other) and queued in batches with the preprocessing option recorded in their provenance JSON.
+# The checkpoint is also used on start-up to pick up what was uploaded while the listener was down.
+# Files already processed are skipped by the ETL through its manifest, so a file queued twice is harmless.
+#
+#   python etl_listener.py                 notifications, falling back to polling
+#   python etl_listener.py --mode poll     polling only
+#   python etl_listener.py --once          queue everything new since the checkpoint and exit
+#
+# Against a local MinIO container:
+#   docker run -p 9000:9000 minio/minio server /data
+#   MINIO_ADDRESS=localhost:9000 AWS_ACCESS_KEY_ID=minioadmin AWS_SECRET_ACCESS_KEY=minioadmin python etl_listener.py
+
+listener_mode = os.getenv('ETL_LISTENER_MODE', 'auto')  # auto, notify or poll
+debounce_seconds = float(os.getenv('ETL_LISTENER_DEBOUNCE_SECONDS', '10'))  # quiet time before an object is queued
+provenance_wait_seconds = float(os.getenv('ETL_LISTENER_PROVENANCE_WAIT_SECONDS', '120'))  # wait for a missing provenance JSON
+poll_seconds = float(os.getenv('ETL_LISTENER_POLL_SECONDS', '30'))
+batch_size = int(os.getenv('ETL_LISTENER_BATCH_SIZE', '100'))
+default_option = os.getenv('ETL_LISTENER_DEFAULT_OPTION', 'No Pre-processing')  # files without a recorded option
+checkpoint_name = "_listener/checkpoint.json"  # in the metadata bucket
+provenance_suffix = ".provenance.json"
+preprocessing_options = ("No Pre-processing", "Data Clean Up", "Preprocessing for Machine Learning")
+
+pending = {}  # object name -> {"seen": time of the last event, "first_seen": ..., "last_modified": datetime}
+pending_lock = threading.Lock()
+
+def data_object_name(object_name):
+    """Bronze object an event is about: the data file itself, or the file a provenance JSON describes.
+    None for objects the ETL does not read (provenance of other objects, hidden paths, unsupported types)."""
+    if any(part.startswith(('_', '.')) for part in object_name.split('/')):
+        return None
+    if object_name.endswith(provenance_suffix):
+        object_name = object_name[:-len(provenance_suffix)]
+    return object_name if source_format(object_name) else None
+
+def listed_object(object_name):
+    """Listing entry of a bronze object, None if it does not exist. Its last_modified has the milliseconds
+    the checkpoint is compared with, stat_object only reports whole seconds."""
+    return next((obj for obj in minio_client.list_objects(source_bucket, prefix=object_name)
+                 if obj.object_name == object_name), None)
+
+def track(object_name, last_modified):
+    """Record an event for a bronze object, restarting its debounce."""
+    name = data_object_name(object_name)
+    if name is None:
+        return
+    now = time.time()
+    with pending_lock:
+        entry = pending.setdefault(name, {"first_seen": now, "last_modified": last_modified})
+        entry["seen"] = now
+        entry["last_modified"] = min(entry["last_modified"], last_modified)
+
+def read_provenance(object_name):
+    """Provenance JSON uploaded with a file (<object>.provenance.json or <object without extension>.provenance.json)."""
+    for name in (f"{object_name}{provenance_suffix}", f"{strip_source_extension(object_name)}{provenance_suffix}"):
+        provenance = read_json_object(source_bucket, name)
+        if provenance is not None:
+            return provenance
+    return None
+
+def preprocessing_option(object_name):
+    """Option recorded in the latest provenance entry of a file, None if there is no provenance yet."""
+    provenance = read_provenance(object_name)
+    if provenance is None:
+        return None
+    history = provenance.get("history") or [{}]
+    option = history[-1].get("preprocessing") or default_option
+    if option not in preprocessing_options:
+        print(f"Unknown preprocessing option '{option}' in the provenance of {object_name}, using {default_option}")
+        option = default_option
+    return option
+
+def load_checkpoint():
+    """Last object modification time already queued and the objects queued at exactly that time."""
+    checkpoint = read_metadata_json(checkpoint_name)
+    if checkpoint is None:
+        return datetime.fromtimestamp(0, timezone.utc), set()
+    return datetime.fromisoformat(checkpoint["last_modified"]), set(checkpoint["objects"])
+
+def save_checkpoint(last_modified, objects):
+    write_metadata_json(checkpoint_name, {
+        "last_modified": last_modified.isoformat(),
+        "objects": sorted(objects),
+        "saved_at": datetime.now().isoformat(),
+    })
+
+def advance_checkpoint(queued):
+    """Move the checkpoint past the queued objects ({name: last_modified}), but not past an object
+    still waiting in pending, so a restart lists it again."""
+    last_modified, objects = load_checkpoint()
+    with pending_lock:
+        waiting = [entry["last_modified"] for entry in pending.values()]
+    for name, modified in sorted(queued.items(), key=lambda item: item[1]):
+        if waiting and modified >= min(waiting):
+            break
+        if modified > last_modified:
+            last_modified, objects = modified, set()
+        if modified == last_modified:
+            objects.add(name)
+    save_checkpoint(last_modified, objects)
+
+def poll_new_objects():
+    """Track every bronze object modified since the checkpoint."""
+    last_modified, objects = load_checkpoint()
+    found = 0
+    for obj in minio_client.list_objects(source_bucket, recursive=True):
+        if obj.last_modified > last_modified or (obj.last_modified == last_modified and obj.object_name not in objects):
+            track(obj.object_name, obj.last_modified)
+            found += 1
+    return found
+
+def take_ready(force=False):
+    """Remove and return the objects whose debounce has passed, at most batch_size of them."""
+    now = time.time()
+    with pending_lock:
+        ready = [name for name, entry in pending.items() if force or now - entry["seen"] >= debounce_seconds]
+        ready = sorted(ready, key=lambda name: pending[name]["last_modified"])[:batch_size]
+        return {name: pending.pop(name) for name in ready}
+
+def dispatch(ready, dry_run=False, force=False):
+    """Queue ready objects with the option from their provenance. Objects without provenance are put
+    back to wait for it, up to provenance_wait_seconds (no wait with force). Returns the number queued."""
+    queued = {}
+    by_option = {}
+    for name, entry in ready.items():
+        listed = listed_object(name)
+        if listed is None:
+            continue  # deleted again before it was queued
+        option = preprocessing_option(name)
+        if option is None:
+            if not force and time.time() - entry["first_seen"] < provenance_wait_seconds:
+                entry["seen"] = time.time()  # look again after another debounce period
+                with pending_lock:
+                    pending.setdefault(name, entry)
+                continue
+            print(f"No provenance found for {name}, using {default_option}")
+            option = default_option
+        by_option.setdefault(option, []).append(name)
+        queued[name] = listed.last_modified
+
+    if not queued:
+        return 0
+    if not dry_run:
+        etl_queue.ensure_worker_running()
+    for option, names in by_option.items():
+        for name in names:
+            if dry_run:
+                print(f"Would queue {name} ({option})")
+            else:
+                etl_queue.submit_job(name, option)
+        if not dry_run:
+            print(f"Queued {len(names)} file(s) with {option}: {', '.join(names)}", flush=True)
+    if not dry_run:
+        advance_checkpoint(queued)
+    return len(queued)
+
+def event_last_modified(object_name, record):
+    """Modification time of a notified object as the listing reports it, or the event's time when the object
+    is gone again (dispatch skips it then)."""
+    listed = listed_object(object_name)
+    if listed is not None:
+        return listed.last_modified
+    return datetime.fromisoformat(record["eventTime"].replace("Z", "+00:00"))
+
+def listen_for_notifications(stop):
+    """Track objects from s3:ObjectCreated notifications until the stream fails, then set stop."""
+    try:
+        events = minio_client.listen_bucket_notification(source_bucket, events=("s3:ObjectCreated:*",))
+        with events:
+            for event in events:
+                for record in event.get("Records", []):
+                    object_name = unquote_plus(record["s3"]["object"]["key"])
+                    track(object_name, event_last_modified(object_name, record))
+    except Exception as e:
+        print(f"Bucket notifications stopped: {e}", flush=True)
+    stop.set()
+
+def run(mode=listener_mode, dry_run=False):
+    """Listen (or poll) and queue new objects until interrupted."""
+    poll_new_objects()  # catch up on uploads made while the listener was not running
+    notifications_down = threading.Event()
+    if mode in ("auto", "notify"):
+        threading.Thread(target=listen_for_notifications, args=(notifications_down,), daemon=True).start()
+        print(f"Listening for new objects in {source_bucket}", flush=True)
+    else:
+        notifications_down.set()
+        print(f"Polling {source_bucket} every {poll_seconds:.0f}s", flush=True)
+
+    last_poll = time.time()
+    while True:
+        if notifications_down.is_set():
+            if mode == "notify":
+                # retry the stream after a pause, polling meanwhile so nothing is missed
+                time.sleep(poll_seconds)
+                notifications_down.clear()
+                threading.Thread(target=listen_for_notifications, args=(notifications_down,), daemon=True).start()
+            if time.time() - last_poll >= poll_seconds:
+                poll_new_objects()
+                last_poll = time.time()
+        try:
+            dispatch(take_ready(), dry_run)
+        except S3Error as e:
+            print(f"Failed to queue new objects: {e}", flush=True)
+        time.sleep(1)
+
+def run_once(dry_run=False):
+    """Queue everything new since the checkpoint without waiting for debounce or provenance."""
+    found = poll_new_objects()
+    queued = 0
+    while True:
+        ready = take_ready(force=True)
+        if not ready:
+            break
+        queued += dispatch(ready, dry_run, force=True)
+    print(f"{found} new object(s) since the checkpoint, {queued} queued")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Queue new bronze uploads for the ETL worker")
+    parser.add_argument("--mode", choices=["auto", "notify", "poll"], default=listener_mode,
+                        help="auto: notifications with polling as fallback")
+    parser.add_argument("--once", action="store_true", help="queue what is new since the checkpoint and exit")
+    parser.add_argument("--dry-run", action="store_true", help="print what would be queued, queue nothing")
+    args = parser.parse_args()
+
+    if args.once:
+        run_once(args.dry_run)
+    else:
+        run(args.mode, args.dry_run)
@@ -0,0 +1,498 @@
+# Vendored from Core DW Infrastructure/app/etl_local.py by scripts/sync_shared_modules.py, edit that file instead.
+import argparse
+import hashlib
+import io
+import logging
+import math
+import re
+import sys
+import uuid
+from datetime import datetime
+from decimal import Decimal
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+from pyspark.sql.types import StructType, StructField, StringType, IntegerType, LongType, ShortType, ByteType, \
+    FloatType, DoubleType, BooleanType, DecimalType, DateType, TimestampType, TimestampNTZType
+import etl_pipeline as etl
+from etl_storage import minio_client, get_spark, source_bucket, destination_bucket, read_metadata_json, \
+    remove_objects
+from etl_dedup import pipeline_columns
+from etl_stats import refresh_column_stats
+from etl_leases import wait_for_lease, release_lease, directory_lease_key
+from etl_commits import new_batch_id, rollback_incomplete_batches, publish_output
+import ml_state
+import zone_maps
+
+# In-process engine for small files: the same "Data Clean Up" and "Preprocessing for Machine Learning"
+# semantics as the Spark code in etl_pipeline.py, on pyarrow tables, so a small upload does not pay for
+# JVM start-up, package resolution and S3A set-up. etl_pipeline.process_file picks it for CSV and Parquet
+# files up to ETL_LOCAL_ENGINE_MAX_MB in the file write mode. It shares the schema registry, ML statistics,
+# manifest and run reports with the Spark engine and writes the same <name>_processed.parquet directory.
+# Timestamps without a zone are taken as UTC, as Spark does with the container's default time zone.
+#
+# Check that both engines agree on a file (schema inference, output schema and values):
+#   python etl_local.py --check-parity project1/heart.csv "Data Clean Up"
+
+logger = logging.getLogger(__name__)
+
+float_tolerance = 1e-9  # relative tolerance for doubles in the parity check, aggregation order differs
+
+def spark_to_arrow_type(data_type):
+    """Arrow type Spark writes to parquet for a Spark SQL type."""
+    if isinstance(data_type, IntegerType):
+        return pa.int32()
+    if isinstance(data_type, LongType):
+        return pa.int64()
+    if isinstance(data_type, ShortType):
+        return pa.int16()
+    if isinstance(data_type, ByteType):
+        return pa.int8()
+    if isinstance(data_type, FloatType):
+        return pa.float32()
+    if isinstance(data_type, DoubleType):
+        return pa.float64()
+    if isinstance(data_type, BooleanType):
+        return pa.bool_()
+    if isinstance(data_type, DecimalType):
+        return pa.decimal128(data_type.precision, data_type.scale)
+    if isinstance(data_type, DateType):
+        return pa.date32()
+    if isinstance(data_type, (TimestampType, TimestampNTZType)):
+        return pa.timestamp("us")
+    return pa.string()
+
+def arrow_to_spark_type(arrow_type):
+    """Spark SQL type of an arrow type, strings for anything Spark would not infer."""
+    mapping = [
+        (pa.types.is_int32, IntegerType), (pa.types.is_int64, LongType), (pa.types.is_int16, ShortType),
+        (pa.types.is_int8, ByteType), (pa.types.is_float32, FloatType), (pa.types.is_float64, DoubleType),
+        (pa.types.is_boolean, BooleanType), (pa.types.is_date32, DateType), (pa.types.is_timestamp, TimestampType),
+    ]
+    if pa.types.is_decimal(arrow_type):
+        return DecimalType(arrow_type.precision, arrow_type.scale)
+    for check, spark_type in mapping:
+        if check(arrow_type):
+            return spark_type()
+    return StringType()
+
+def csv_column_names(header):
+    """Column names as Spark gives them to a CSV header, _c<index> for empty names."""
+    return [name if name else f"_c{idx}" for idx, name in enumerate(header)]
+
+def parse_csv(data, file_name, header, column_types=None):
+    """Parse CSV bytes with Spark's defaults: only empty fields are null and only true/false are booleans."""
+    stream = pa.BufferReader(data)
+    if file_name.lower().endswith(".gz"):
+        stream = pa.CompressedInputStream(stream, "gzip")
+    names = csv_column_names(header)
+    return pa_csv.read_csv(
+        stream,
+        read_options=pa_csv.ReadOptions(column_names=names, skip_rows=1),
+        convert_options=pa_csv.ConvertOptions(
+            column_types=column_types or {},
+            null_values=[""],
+            strings_can_be_null=True,
+            true_values=["true", "True", "TRUE"],
+            false_values=["false", "False", "FALSE"],
+        ),
+    )
+
+def infer_spark_schema(table):
+    """Spark schema for a table parsed with inferred types: integers that fit in 32 bits are IntegerType
+    and columns without any value are strings, as Spark's inferSchema reports them."""
+    fields = []
+    for name, column in zip(table.column_names, table.columns):
+        data_type = arrow_to_spark_type(column.type)
+        if pa.types.is_int64(column.type) and column.null_count < len(column):
+            bounds = pc.min_max(column)
+            if -2 ** 31 <= bounds["min"].as_py() and bounds["max"].as_py() < 2 ** 31:
+                data_type = IntegerType()
+        fields.append(StructField(name, data_type, True))
+    return StructType(fields)
+
+def read_csv_local(file_name, data):
+    """Read a bronze CSV with the registered schema of its header, or infer and register one.
+    When the file no longer parses with the registered schema it is re-inferred, widened with
+    etl_pipeline.merge_schemas and registered again, like the Spark reader does on drift."""
+    header = etl.read_csv_header(file_name)
+    entry = read_metadata_json(etl.schema_object_name(file_name, header))
+    if entry is not None:
+        schema = StructType.fromJson(entry["schema"])
+        if len(schema.fields) == len(header):
+            try:
+                return parse_csv(data, file_name, header, {field.name: spark_to_arrow_type(field.dataType)
+                                                             for field in schema.fields})
+            except pa.ArrowInvalid as e:
+                print(f"Schema drift detected in {file_name} ({e}), re-inferring")
+
+    inferred = parse_csv(data, file_name, header)
+    sampled = infer_spark_schema(inferred)
+    schema = etl.merge_schemas(StructType.fromJson(entry["schema"]), sampled) \
+        if entry is not None and len(entry["schema"]["fields"]) == len(header) else sampled
+    etl.register_schema(file_name, header, schema)
+    return parse_csv(data, file_name, header, {field.name: spark_to_arrow_type(field.dataType)
+                                                for field in schema.fields})
+
+def read_source_local(file_name):
+    """Read a bronze CSV (also .csv.gz) or Parquet file into an arrow table."""
+    response = minio_client.get_object(source_bucket, file_name)
+    try:
+        data = response.read()
+    finally:
+        response.close()
+        response.release_conn()
+    if etl.source_format(file_name) == "parquet":
+        return pq.read_table(pa.BufferReader(data))
+    return read_csv_local(file_name, data)
+
+def java_number_string(value):
+    """Format a float like Java's Double.toString (and so Spark's cast to string):
+    plain notation between 1e-3 and 1e7, otherwise d.dddE<exponent>."""
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "Infinity" if value > 0 else "-Infinity"
+    if value == 0:
+        return "-0.0" if math.copysign(1.0, value) < 0 else "0.0"
+    sign = "-" if value < 0 else ""
+    shortest = Decimal(str(abs(value))).normalize()  # str gives the shortest digits that round-trip
+    digits = "".join(str(digit) for digit in shortest.as_tuple().digits)
+    exponent = len(digits) - 1 + shortest.as_tuple().exponent
+    if 1e-3 <= abs(value) < 1e7:
+        plain = format(shortest, "f")
+        return sign + (plain if "." in plain else plain + ".0")
+    return f"{sign}{digits[0]}.{digits[1:] or '0'}E{exponent}"
+
+def spark_strings(column):
+    """Values of a column cast to string the way Spark's cast(... as string) does, as an arrow string array
+    with the nulls kept. Floats are formatted once per distinct value, java_number_string being Python."""
+    if isinstance(column, pa.ChunkedArray):
+        column = column.combine_chunks()
+    data_type = column.type
+    if pa.types.is_string(data_type) or pa.types.is_large_string(data_type):
+        return column.cast(pa.string())
+    if pa.types.is_boolean(data_type):
+        return pc.if_else(column, "true", "false")
+    if pa.types.is_floating(data_type):
+        distinct = pc.unique(column)
+        number = np.float32 if pa.types.is_float32(data_type) else float
+        formatted = pa.array([None if value is None else java_number_string(number(value)) for value in distinct.to_pylist()], pa.string())
+        return formatted.take(pc.index_in(column, value_set=distinct))
+    if pa.types.is_timestamp(data_type):
+        # whole seconds, then the microseconds without trailing zeros (.5, .123456) unless there are none
+        seconds = pc.strftime(column.cast(pa.timestamp("s", data_type.tz), safe=False), "%Y-%m-%d %H:%M:%S")
+        micros = pc.add(pc.multiply(pc.millisecond(column), 1000), pc.microsecond(column))
+        digits = pc.utf8_rtrim(pc.utf8_slice_codeunits(pc.cast(pc.add(micros, 1000000), pa.string()), 1), characters="0")
+        fraction = pc.if_else(pc.equal(micros, 0), "", pc.binary_join_element_wise(".", digits, ""))
+        return pc.binary_join_element_wise(seconds, fraction, "")
+    if pa.types.is_date(data_type) or pa.types.is_integer(data_type) or pa.types.is_decimal(data_type):
+        return column.cast(pa.string())
+    return pa.array([None if value is None else str(value) for value in column.to_pylist()], pa.string())
+
+def row_hashes(table, extra_columns=()):
+    """SHA-256 per row, the same as etl_dedup.row_hash_column: the data columns sorted by name joined
+    with \\x1f, nulls as \\x00. Only the hashing itself runs per row."""
+    columns = sorted(c for c in table.column_names if c not in pipeline_columns) + list(extra_columns)
+    if not columns:
+        return [hashlib.sha256(b"").hexdigest()] * table.num_rows
+    joined = pc.binary_join_element_wise(*[spark_strings(table.column(c)).fill_null("\x00") for c in columns], "\x1f")
+    return [hashlib.sha256(value).hexdigest() for value in joined.cast(pa.binary()).to_pylist()]
+
+def valid_mask(column):
+    """Boolean numpy mask of the values that are neither null nor NaN."""
+    valid = column.is_valid()
+    if pa.types.is_floating(column.type):
+        valid = pc.and_(valid, pc.invert(pc.is_nan(column).fill_null(False)))
+    return valid.to_numpy(zero_copy_only=False)
+
+def profile_table(table):
+    """Column profile in the same layout as etl_pipeline.profile_columns, with exact distinct counts."""
+    row_count = table.num_rows
+    profiled = {}
+    for name, column in zip(table.column_names, table.columns):
+        non_null = len(column) - column.null_count
+        if pa.types.is_string(column.type):
+            non_empty = pc.sum(pc.not_equal(column, "")).as_py() or 0
+        else:
+            non_empty = non_null
+        profiled[name] = {
+            "non_null_count": non_null,
+            "non_empty_count": non_empty,
+            "null_ratio": round(1 - non_null / row_count, 6) if row_count else 1.0,
+            "distinct_estimate": pc.count_distinct(column, mode="only_valid").as_py(),
+        }
+    return {"row_count": row_count, "columns": profiled}
+
+def stats_column_type(data_type):
+    """Zone map type of an arrow type, as etl_stats.stats_column_type does for Spark types."""
+    if pa.types.is_integer(data_type) or pa.types.is_floating(data_type) or pa.types.is_decimal(data_type):
+        return "number"
+    if pa.types.is_string(data_type) or pa.types.is_large_string(data_type):
+        return "string"
+    if pa.types.is_date(data_type):
+        return "date"
+    if pa.types.is_timestamp(data_type):
+        return "timestamp"
+    if pa.types.is_boolean(data_type):
+        return "boolean"
+    return None
+
+def table_file_stats(table):
+    """Zone map entry of a table written as one file, the same as etl_stats.spark_file_stats computes.
+    NaN sorts above every number in Spark, so a column holding one gets no max."""
+    columns = {}
+    for name, column in zip(table.column_names, table.columns):
+        column_type = stats_column_type(column.type)
+        if column_type is None:
+            continue
+        bounds = pc.min_max(column).as_py() if len(column) > column.null_count else {"min": None, "max": None}
+        if pa.types.is_floating(column.type) and pc.any(pc.is_nan(column)).as_py():
+            bounds["max"] = None
+        columns[name] = {
+            "type": column_type,
+            "min": zone_maps.json_bound(bounds["min"], False),
+            "max": zone_maps.json_bound(bounds["max"], True),
+            "nulls": column.null_count,
+            "sketch": zone_maps.sketch_from_strings(pc.unique(spark_strings(column)).to_pylist()),
+        }
+    return {"rows": table.num_rows, "columns": columns}
+
+def apply_basic_cleanup_local(table):
+    """etl_pipeline.apply_basic_cleanup on an arrow table: drop blank columns, standardise names,
+    drop rows with fewer than two values, drop duplicate rows, add extract_date and unique_id.
+    Duplicates are found by the row hash, which covers every column of the row."""
+    logger.info("Applying basic data clean up...")
+    profile = profile_table(table)
+    valid_columns = []
+    for col_name, column_profile in profile["columns"].items():
+        column_profile["dropped"] = column_profile["non_empty_count"] == 0
+        if column_profile["dropped"]:
+            logger.info(f"Dropping column '{col_name}' as it is entirely blank or null.")
+        else:
+            valid_columns.append(col_name)
+    table = table.select(valid_columns)
+
+    renamed_columns = {name: re.sub(r'[^0-9a-zA-Z]+', '_', name.strip().lower()).strip('_') for name in table.column_names}
+    table = table.rename_columns(list(renamed_columns.values()))
+
+    if table.num_columns:
+        non_null_values = np.sum([valid_mask(column) for column in table.columns], axis=0)
+        table = table.filter(pa.array(non_null_values >= 2))
+
+    hashes = row_hashes(table)
+    _, first_rows = np.unique(np.array(hashes, dtype=object), return_index=True)
+    keep = np.sort(first_rows)
+    table = table.take(pa.array(keep, type=pa.int64()))
+    table = table.append_column("extract_date", pa.array([datetime.now().strftime('%Y-%m-%d')] * table.num_rows, pa.string()))
+    table = table.append_column("unique_id", pa.array([hashes[idx] for idx in keep], pa.string()))
+
+    for col_name, new_col_name in renamed_columns.items():
+        profile["columns"][col_name]["renamed_to"] = new_col_name
+    return table, profile
+
+def is_numeric(arrow_type):
+    return pa.types.is_integer(arrow_type) or pa.types.is_floating(arrow_type) or pa.types.is_decimal(arrow_type)
+
+def numeric_values(column):
+    """Float numpy array of a numeric column with NaN for nulls."""
+    return np.array(pc.cast(column, pa.float64(), safe=False).fill_null(np.nan).to_numpy(zero_copy_only=False), dtype=float)
+
+def fit_ml_statistics_local(table, numeric_columns):
+    """etl_pipeline.fit_ml_statistics on an arrow table. The median is the element Spark's exact
+    approxQuantile returns (rank ceil(n / 2)), mean and stddev are combined with the filled medians."""
+    total = table.num_rows
+    statistics = {}
+    for column in numeric_columns:
+        values = numeric_values(table.column(column))
+        observed = np.sort(values[~np.isnan(values)])
+        n = len(observed)
+        if not n:
+            logger.warning(f"Column '{column}' has no values, skipping it")
+            continue
+        median_value = float(observed[max(math.ceil(0.5 * n) - 1, 0)])
+        if pa.types.is_integer(table.column(column).type):
+            median_value = int(median_value)
+
+        observed_m2 = float(observed.var(ddof=1)) * (n - 1) if n > 1 else 0.0
+        mean_value, stddev_value = ml_state.filled_statistics(n, float(observed.mean()), observed_m2, total, median_value)
+        statistics[column] = {"median": median_value, "mean": mean_value, "stddev": stddev_value, "count": total}
+    return statistics
+
+def apply_ml_statistics_local(table, statistics):
+    """Fill missing values with the median and z-scale every fitted column, scaled columns become doubles."""
+    for idx, name in enumerate(table.column_names):
+        column = table.column(name)
+        column_stats = statistics.get(name)
+        if column_stats is None or not is_numeric(column.type):
+            continue
+        if column_stats["stddev"]:
+            values = numeric_values(column)
+            values[np.isnan(values)] = column_stats["median"]
+            scaled = pa.array((values - column_stats["mean"]) / column_stats["stddev"], pa.float64())
+        else:
+            logger.warning(f"Standard deviation is zero for column: {name}")
+            median = pa.scalar(column_stats["median"]).cast(column.type)
+            if pa.types.is_floating(column.type):
+                column = pc.if_else(pc.is_nan(column).fill_null(True), median, column)
+            scaled = pc.fill_null(column, median)
+        table = table.set_column(idx, name, scaled)
+    return table
+
+def apply_ml_preprocessing_local(table, statistics=None):
+    """etl_pipeline.apply_ml_preprocessing on an arrow table, returns the table and the statistics used."""
+    logger.info("Applying preprocessing for Machine Learning...")
+    numeric_columns = [name for name in table.column_names if is_numeric(table.column(name).type)]
+    if statistics is None:
+        statistics = fit_ml_statistics_local(table, numeric_columns)
+    return apply_ml_statistics_local(table, statistics), statistics
+
+def ml_batch_sketch_local(table, numeric_columns):
+    """etl_pipeline.ml_batch_sketch on an arrow table."""
+    sketch = {}
+    for column in numeric_columns:
+        values = numeric_values(table.column(column))
+        observed = values[~np.isnan(values)]
+        n = len(observed)
+        quantiles = np.quantile(observed, ml_state.sketch_quantiles()).tolist() if n else []
+        sketch[column] = ml_state.column_sketch(
+            n, table.num_rows - n, float(observed.mean()) if n else 0.0,
+            float(observed.var(ddof=1)) * (n - 1) if n > 1 else 0.0,
+            quantiles, pa.types.is_integer(table.column(column).type))
+    return sketch
+
+def apply_preprocessing_local(table, preprocessing_option, file_name):
+    """etl_pipeline.apply_preprocessing for arrow tables: returns the table, profile, new ML statistics
+    and the ML statistics state to store."""
+    profile = None
+    ml_statistics = None
+    ml_state_update = None
+    if preprocessing_option == "Data Clean Up":
+        with etl.run_stage("cleanup"):
+            table, profile = apply_basic_cleanup_local(table)
+    elif preprocessing_option == "Preprocessing for Machine Learning" and etl.incremental_ml_stats:
+        with etl.run_stage("ml_preprocessing"):
+            numeric_columns = [name for name in table.column_names if is_numeric(table.column(name).type)]
+            sketch = ml_batch_sketch_local(table, numeric_columns)
+            statistics, ml_statistics, ml_state_update = etl.incremental_ml_statistics(file_name, sketch)
+            table = apply_ml_statistics_local(table, statistics)
+    elif preprocessing_option == "Preprocessing for Machine Learning":
+        previous_statistics = etl.load_ml_statistics(file_name) if etl.reuse_ml_stats else None
+        with etl.run_stage("ml_preprocessing"):
+            table, ml_statistics = apply_ml_preprocessing_local(table, previous_statistics)
+        if previous_statistics is not None:
+            ml_statistics = None
+    return table, profile, ml_statistics, ml_state_update
+
+def write_local_output(table, output_name, file_name):
+    """Replace the parquet directory output_name with one part file, the layout Spark writes, staged and
+    swapped in with etl_commits.publish_output under the output's lease like the Spark writes.
+    Returns the object name of the part file."""
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer, compression="snappy", use_deprecated_int96_timestamps=True)
+    lease = wait_for_lease(directory_lease_key(output_name))
+    try:
+        rollback_incomplete_batches(output_name, leased=True)
+        batch_id = new_batch_id()
+        staged_name = f"{output_name}/_staging/{batch_id}/part-00000-{uuid.uuid4()}-c000.snappy.parquet"
+        buffer.seek(0)
+        minio_client.put_object(destination_bucket, staged_name, buffer, buffer.getbuffer().nbytes,
+                                content_type="application/octet-stream")
+        commit = publish_output(output_name, [staged_name], [file_name], batch_id)
+        remove_objects(destination_bucket, [staged_name])
+    finally:
+        release_lease(lease)
+    return commit["files"][0]
+
+def process_file_local(file_name, preprocessing_option, source_stat):
+    """The local counterpart of the work in etl_pipeline.process_file after the manifest check,
+    returns "processed". Errors are raised to process_file, which reports them."""
+    with etl.run_stage("read"):
+        table = read_source_local(file_name)
+    print(f"Processing file: {file_name} (local engine)")
+
+    table, profile, ml_statistics, ml_state_update = apply_preprocessing_local(table, preprocessing_option, file_name)
+
+    output_name = etl.file_output_name(file_name)
+    with etl.run_stage("write"):
+        part_name = write_local_output(table, output_name, file_name)
+    print(f"Processed and saved file: {file_name} to {destination_bucket}/{output_name}")
+    with etl.run_stage("column_stats"):
+        refresh_column_stats(output_name, compute=lambda bucket_name, root, names: {part_name: table_file_stats(table)})
+    if etl.preview_rows > 0:
+        print(table.slice(0, etl.preview_rows).to_pandas().to_string())
+
+    with etl.run_stage("metadata"):
+        if profile is not None:
+            etl.save_column_profile(f"{output_name.replace('.parquet', '')}_profile.json", profile)
+        if ml_statistics is not None:
+            etl.save_ml_statistics(file_name, ml_statistics)
+        if ml_state_update is not None:
+            etl.save_ml_state([file_name], ml_state_update)
+        etl.mark_file_as_processed(file_name, source_stat, preprocessing_option)
+    return "processed"
+
+def values_match(left, right):
+    if isinstance(left, float) and isinstance(right, float):
+        return (math.isnan(left) and math.isnan(right)) or math.isclose(left, right, rel_tol=float_tolerance, abs_tol=1e-12)
+    return left == right
+
+def check_parity(file_name, preprocessing_option):
+    """Run both engines on a file and report every difference in inferred schema, output schema and values.
+    Nothing is written to silver. Returns the number of differences."""
+    differences = []
+    spark = get_spark()
+    data_table = read_source_local(file_name)  # registers the schema if the header is new
+
+    if etl.source_format(file_name) == "csv":
+        response = minio_client.get_object(source_bucket, file_name)
+        try:
+            local_inferred = infer_spark_schema(parse_csv(response.read(), file_name, etl.read_csv_header(file_name)))
+        finally:
+            response.close()
+            response.release_conn()
+        spark_inferred = spark.read.csv(f"s3a://{source_bucket}/{file_name}", header=True, inferSchema=True).schema
+        for local_field, spark_field in zip(local_inferred.fields, spark_inferred.fields):
+            if local_field != spark_field:
+                differences.append(f"inferred type of {spark_field.name}: spark {spark_field.dataType}, local {local_field.dataType}")
+
+    local_table, _, _, _ = apply_preprocessing_local(data_table, preprocessing_option, file_name)
+    spark_df, _, _, _ = etl.apply_preprocessing(etl.read_source([file_name]), preprocessing_option, file_name)
+
+    local_schema = [(field.name, arrow_to_spark_type(field.type)) for field in local_table.schema]
+    spark_schema = [(field.name, field.dataType) for field in spark_df.schema.fields]
+    if local_schema != spark_schema:
+        differences.append(f"output schema: spark {spark_schema}, local {local_schema}")
+
+    key = (lambda row: row["unique_id"]) if "unique_id" in local_table.column_names else (lambda row: repr(sorted(row.items())))
+    local_rows = sorted(local_table.to_pylist(), key=key)
+    spark_rows = sorted([row.asDict() for row in spark_df.collect()], key=key)
+    if len(local_rows) != len(spark_rows):
+        differences.append(f"row count: spark {len(spark_rows)}, local {len(local_rows)}")
+    for local_row, spark_row in zip(local_rows, spark_rows):
+        mismatched = [name for name in spark_row if not values_match(local_row.get(name), spark_row[name])]
+        if mismatched:
+            differences.append(f"row {key(spark_row)}: {', '.join(f'{name} spark={spark_row[name]!r} local={local_row.get(name)!r}' for name in mismatched)}")
+            if len(differences) >= 50:
+                differences.append("stopping after 50 differences")
+                break
+
+    for difference in differences:
+        print(difference)
+    print(f"{file_name} ({preprocessing_option}): {'engines match' if not differences else f'{len(differences)} differences'}")
+    return len(differences)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local (pyarrow) ETL engine")
+    parser.add_argument("file_name")
+    parser.add_argument("preprocessing_option")
+    parser.add_argument("--check-parity", action="store_true",
+                        help="compare the local engine with Spark on the file instead of processing it")
+    args = parser.parse_args()
+
+    if args.check_parity:
+        sys.exit(1 if check_parity(args.file_name, args.preprocessing_option) else 0)
+    etl.engine = "local"
+    sys.exit(1 if etl.main(args.file_name, args.preprocessing_option) == "failed" else 0)
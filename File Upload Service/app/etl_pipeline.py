@@ -1,49 +1,102 @@
-from pyspark.sql import SparkSession
-from pyspark.sql.functions import when, col, mean, stddev, lit, monotonically_increasing_id
-from minio import Minio
+# Vendored from Core DW Infrastructure/app/etl_pipeline.py by scripts/sync_shared_modules.py, edit that file instead.
+from pyspark.sql.functions import when, col, mean, lit, count, approx_count_distinct, \
+    var_samp, coalesce, nanvl, input_file_name, regexp_extract, xxhash64, pmod, percentile_approx
 from minio.error import S3Error
 import os
-import io  # Import for handling byte streams
-from datetime import datetime
+import json
+from datetime import datetime, date
 import sys
-from pyspark.sql.types import NumericType
+import argparse
+import csv
+import hashlib
+import time
+import uuid
+import tempfile
+import zlib
+import threading
+import urllib.request
+from contextlib import contextmanager
+from pyspark.sql.types import NumericType, IntegralType, FloatType, DoubleType, StructType, StructField, StringType, \
+    IntegerType, LongType, DecimalType, DateType, TimestampType, NullType
 from pyspark.sql.utils import AnalysisException
 import logging
+import math
 import re
+import ml_state
+import etl_storage
+from etl_storage import minio_client, get_spark, source_bucket, destination_bucket, metadata_bucket, \
+    manifest_prefix, ml_stats_prefix, ml_state_prefix, schema_registry_prefix, dataset_prefix, run_reports_prefix, \
+    converted_prefix, write_json_object, read_metadata_json, write_metadata_json, remove_objects
+from etl_leases import acquire_lease, wait_for_lease, release_lease, directory_lease_key
+from etl_dedup import row_hash_column, drop_known_rows, stage_dedup_index, remove_staged_hashes
+from etl_stats import refresh_column_stats
+from etl_commits import new_batch_id, batch_sidecar_prefix, publish_batch, rollback_incomplete_batches, publish_output
 
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Reader format by file extension, the longest matching extension wins (.csv.gz before .csv)
+source_formats = {
+    ".csv": "csv",
+    ".csv.gz": "csv",
+    ".csv.zst": "csv.zst",
+    ".json": "json",
+    ".jsonl": "json",
+    ".xlsx": "xlsx",
+    ".parquet": "parquet",
+}
+xlsx_batch_rows = 10000  # rows per Arrow record batch when converting workbooks
 
-# MinIO creds
-minio_client = Minio(
-    "10.137.0.149:9000",  # Minio IP
-    access_key=os.getenv('AWS_ACCESS_KEY_ID'),  
-    secret_key=os.getenv('AWS_SECRET_ACCESS_KEY'),  
-    secure=False  
-)
-
-# start up spark session with Minio using parquet (instead of Deltatables and no longer iceberg)
-
-spark = SparkSession.builder \
-    .appName("ETL with Spark and Parquet") \
-    .config("spark.jars.packages",
-            "org.apache.hadoop:hadoop-aws:3.3.1,"
-            "com.amazonaws:aws-java-sdk-bundle:1.11.1026") \
-    .config("spark.hadoop.fs.s3a.impl", "org.apache.hadoop.fs.s3a.S3AFileSystem") \
-    .config("spark.hadoop.fs.s3a.endpoint", "http://10.137.0.149:9000") \
-    .config("spark.hadoop.fs.s3a.access.key", os.getenv('AWS_ACCESS_KEY_ID')) \
-    .config("spark.hadoop.fs.s3a.secret.key", os.getenv('AWS_SECRET_ACCESS_KEY')) \
-    .config("spark.hadoop.fs.s3a.path.style.access", "true") \
-    .config("spark.hadoop.fs.s3a.connection.ssl.enabled", "false") \
-    .getOrCreate()
-
-# for ETL the source will be coming from bronze with original data and the result will be stored in silver.
-source_bucket = "dw-bucket-bronze" 
-destination_bucket = "dw-bucket-silver"
-metadata_bucket = "dw-bucket-metadata"  # Bucket to store metadata of processed files
+schema_sample_bytes = 1024 * 1024  # head of the file used to check a registered schema for drift (rows are read FAILFAST)
+schema_sampling_ratio = float(os.getenv('ETL_SCHEMA_SAMPLING_RATIO', '0.1'))  # fraction of rows inferred on drift
+
+# Set ETL_REUSE_ML_STATS=true to scale new files with the statistics already fitted for their dataset
+reuse_ml_stats = os.getenv('ETL_REUSE_ML_STATS', 'false').lower() == 'true'
+
+# Set ETL_INCREMENTAL_ML_STATS=true to merge every file into its dataset's statistics state and scale it with
+# the dataset's stored scaling, which only changes when refit_ml_stats.py refits it
+incremental_ml_stats = os.getenv('ETL_INCREMENTAL_ML_STATS', 'false').lower() == 'true'
+ml_state_updates = True  # turned off by refit_ml_stats.py, which reprocesses files already in the state
+
+# "file" writes one <name>_processed.parquet per input (overwritten on rerun),
+# "incremental" appends each batch to datasets/<dataset>/ partitioned by project and extract_date
+write_mode = os.getenv('ETL_WRITE_MODE', 'file')
+
+# Set ETL_DEDUP_INDEX=true to drop rows already appended to the dataset by earlier runs (incremental mode only)
+dedup_index = os.getenv('ETL_DEDUP_INDEX', 'false').lower() == 'true'
+
+# rows shown from the written silver output after each file, 0 turns the preview off
+preview_rows = int(os.getenv('ETL_PREVIEW_ROWS', '20'))
+
+# Silver parquet files are sized to about ETL_TARGET_FILE_MB instead of one file per Spark partition
+target_file_bytes = int(os.getenv('ETL_TARGET_FILE_MB', '128')) * 1024 * 1024
+text_parquet_ratio = float(os.getenv('ETL_TEXT_PARQUET_RATIO', '0.25'))  # parquet size relative to uncompressed CSV/JSON
+coalesce_max_ratio = 4  # more input partitions per output file than this are shuffled into place instead of coalesced
+
+# Files up to ETL_LOCAL_ENGINE_MAX_MB are processed in-process with pyarrow (etl_local.py) instead of Spark,
+# ETL_ENGINE=spark or ETL_ENGINE=local forces one engine
+engine = os.getenv('ETL_ENGINE', 'auto')
+local_engine_max_bytes = int(float(os.getenv('ETL_LOCAL_ENGINE_MAX_MB', '50')) * 1024 * 1024)
+local_engine_formats = ("csv", "parquet")
+
+# Uncompressed CSVs from ETL_CHUNKED_MIN_MB on are parsed in chunks that are committed one by one (etl_chunked.py),
+# so a run that dies halfway resumes from the last committed chunk, 0 turns chunking off
+chunked_min_bytes = int(float(os.getenv('ETL_CHUNKED_MIN_MB', '2048')) * 1024 * 1024)
+
+# Set ETL_RUN_REPORTS=false to skip the per-run report (stage timings and Spark metrics) in the metadata bucket
+run_reports = os.getenv('ETL_RUN_REPORTS', 'true').lower() == 'true'
+run_state = threading.local()  # report of the run in progress, per thread as Spark job groups are per thread
+stage_metric_fields = {
+    "inputBytes": "input_bytes",
+    "inputRecords": "input_records",
+    "outputBytes": "output_bytes",
+    "outputRecords": "output_records",
+    "shuffleReadBytes": "shuffle_read_bytes",
+    "shuffleWriteBytes": "shuffle_write_bytes",
+    "executorRunTime": "executor_run_ms",
+}
 
 def list_files_in_bucket(bucket_name):
     """List all files in a specified MinIO bucket."""
@@ -68,47 +121,246 @@ def is_file_in_bucket(bucket_name, file_name): # add in the check for the file i
             return False
 
 
-def is_file_processed(file_name):
-    """Check if a file has already been processed by looking for it in the metadata bucket."""
+def spark_stage_metrics(stage_ids):
+    """Sum the task metrics of Spark stages from the status REST API of the driver UI.
+    The status store is updated asynchronously, so stages still running are polled for a moment.
+    Returns zeroes when the UI is disabled or unreachable."""
+    totals = {name: 0 for name in stage_metric_fields.values()}
+    spark = etl_storage.spark
+    ui_url = spark.sparkContext.uiWebUrl
+    if not ui_url or not stage_ids:
+        return totals
+    base_url = f"{ui_url}/api/v1/applications/{spark.sparkContext.applicationId}/stages"
+    for stage_id in stage_ids:
+        for _ in range(10):
+            try:
+                with urllib.request.urlopen(f"{base_url}/{stage_id}", timeout=5) as response:
+                    attempts = json.loads(response.read())
+            except Exception as e:
+                logger.warning(f"Could not read metrics of Spark stage {stage_id}: {e}")
+                attempts = []
+                break
+            if all(attempt["status"] not in ("ACTIVE", "PENDING") for attempt in attempts):
+                break
+            time.sleep(0.2)
+        for attempt in attempts:
+            for rest_name, name in stage_metric_fields.items():
+                totals[name] += attempt.get(rest_name, 0)
+    return totals
+
+def start_run(file_names, preprocessing_option):
+    """Start collecting the report of a run, stages are added by run_stage."""
+    if not run_reports:
+        return
+    run_state.stage = None
+    run_state.report = {
+        "run_id": f"{datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}",
+        "files": list(file_names),
+        "preprocessing_option": preprocessing_option,
+        "write_mode": write_mode,
+        "engine": None,
+        "started_at": datetime.now().isoformat(),
+        "stages": [],
+    }
+    run_state.started = time.time()
+
+@contextmanager
+def run_stage(name):
+    """Time a stage of the run in progress and attribute the Spark jobs it triggers to it:
+    the stage gets its own Spark job group, so jobs, Spark stages, bytes and records can be
+    looked up afterwards. Stages can be nested, jobs then only count for the innermost stage.
+    Only the wall time is recorded while Spark is not running (local engine). Does nothing outside a run."""
+    report = getattr(run_state, "report", None)
+    if report is None:
+        yield
+        return
+    parent = getattr(run_state, "stage", None)
+    group_id = f"{report['run_id']}:{name}"
+    spark = etl_storage.spark  # None until a Spark file starts the session
+    with_spark = spark is not None
+    if with_spark:
+        spark.sparkContext.setJobGroup(group_id, f"{name} ({', '.join(report['files'])})")
+    run_state.stage = name
+    started = time.time()
     try:
-        processed_files = list_files_in_bucket(metadata_bucket)
-        return file_name in processed_files
+        yield
+    finally:
+        wall_seconds = time.time() - started
+        run_state.stage = parent
+        if not with_spark:
+            report["stages"].append(dict({"name": name, "parent": parent, "wall_seconds": round(wall_seconds, 3),
+                                          "started_seconds": round(started - run_state.started, 3),
+                                          "spark_jobs": 0, "spark_stages": 0},
+                                         **{field: 0 for field in stage_metric_fields.values()}))
+            return
+        # later jobs count for the enclosing stage again
+        if parent is not None:
+            spark.sparkContext.setJobGroup(f"{report['run_id']}:{parent}", f"{parent} ({', '.join(report['files'])})")
+        else:
+            spark.sparkContext.setJobGroup(report["run_id"], "")
+        tracker = spark.sparkContext.statusTracker()
+        job_ids = tracker.getJobIdsForGroup(group_id)
+        stage_ids = set()
+        for job_id in job_ids:
+            job_info = tracker.getJobInfo(job_id)
+            if job_info is not None:
+                stage_ids.update(job_info.stageIds)
+        stage = {"name": name, "parent": parent, "wall_seconds": round(wall_seconds, 3),
+                 "started_seconds": round(started - run_state.started, 3),
+                 "spark_jobs": len(job_ids), "spark_stages": len(stage_ids)}
+        stage.update(spark_stage_metrics(sorted(stage_ids)))
+        report["stages"].append(stage)
+
+def finish_run(status):
+    """Write the report of the run in progress to the metadata bucket."""
+    report = getattr(run_state, "report", None)
+    if report is None:
+        return
+    run_state.report = None
+    run_state.last_report = report  # read back by etl_benchmark.py
+    report["status"] = status
+    report["finished_at"] = datetime.now().isoformat()
+    report["wall_seconds"] = round(time.time() - run_state.started, 3)
+    report["totals"] = {
+        name: sum(stage[name] for stage in report["stages"])
+        for name in ["spark_jobs", "spark_stages"] + list(stage_metric_fields.values())
+    }
+    report_name = f"{run_reports_prefix}{report['started_at'][:10]}/{report['run_id']}.json"
+    try:
+        write_metadata_json(report_name, report)
+        print(f"Run {report['run_id']} took {report['wall_seconds']:.1f}s, report saved to {metadata_bucket}/{report_name}")
     except S3Error as e:
-        print(f"Error checking processed files in metadata bucket: {e}")
+        print(f"Failed to save run report {report_name}: {e}")
+
+def shares_dataset_state():
+    """True when processing a file reads and updates state of its whole dataset: the merged ML statistics
+    or the dedup index. Files of the same dataset are then processed one after the other."""
+    return incremental_ml_stats or (write_mode == "incremental" and dedup_index)
+
+def dataset_lease_key(file_name):
+    # the dataset directory, which groups files of the same dataset name across projects
+    return directory_lease_key(dataset_directory(file_name))
+
+def manifest_object_name(file_name):
+    """Name of the manifest entry that records the processed version of a bronze file."""
+    return f"{manifest_prefix}{file_name}.json"
+
+def source_format(file_name):
+    """Reader format of a bronze object from its extension, None if it is not a supported tabular file."""
+    lowered = file_name.lower()
+    if lowered.endswith(".provenance.json"):
+        return None  # upload provenance written next to the file, not data
+    for extension in sorted(source_formats, key=len, reverse=True):
+        if lowered.endswith(extension):
+            return source_formats[extension]
+    return None
+
+def strip_source_extension(file_name):
+    """Object name without its (possibly double, e.g. .csv.gz) extension."""
+    lowered = file_name.lower()
+    for extension in sorted(source_formats, key=len, reverse=True):
+        if lowered.endswith(extension):
+            return file_name[:-len(extension)]
+    return file_name.rsplit('.', 1)[0]
+
+def dataset_name(file_name):
+    """Dataset a bronze file belongs to: the object name without its extension and upload date suffix,
+    e.g. project1/heart_20241201.csv -> project1/heart."""
+    return re.sub(r'_\d{8}$', '', strip_source_extension(file_name))
+
+def is_file_processed(file_name, source_stat=None):
+    """Check if this exact version of a file (object name + ETag) has already been processed.
+    This is a single lookup in the manifest instead of listing the whole metadata bucket,
+    and a re-uploaded file gets a new ETag so it will be processed again."""
+    try:
+        if source_stat is None:
+            source_stat = minio_client.stat_object(source_bucket, file_name)
+        entry = read_metadata_json(manifest_object_name(file_name))
+        if entry is not None:
+            return entry.get("etag") == source_stat.etag
+
+        # Files processed before the manifest existed only have an empty marker object,
+        # treat them as processed unless the source was uploaded again after the marker.
+        marker = minio_client.stat_object(metadata_bucket, file_name)
+        return marker.last_modified >= source_stat.last_modified
+    except S3Error as e:
+        if e.code != 'NoSuchKey':
+            print(f"Error checking processed files in metadata bucket: {e}")
         return False
 
-def mark_file_as_processed(file_name):
-    """Mark a file as processed by uploading an empty object with the file name to the metadata bucket."""
+def mark_file_as_processed(file_name, source_stat=None, preprocessing_option=None):
+    """Mark a file as processed by writing its manifest entry (keyed by object name, holding the source ETag)."""
     try:
-        # Upload an empty object with the file name to mark it as processed
-        minio_client.put_object(metadata_bucket, file_name, io.BytesIO(b''), 0)
+        if source_stat is None:
+            source_stat = minio_client.stat_object(source_bucket, file_name)
+        write_metadata_json(manifest_object_name(file_name), {
+            "object_name": file_name,
+            "etag": source_stat.etag,
+            "size": source_stat.size,
+            "source_last_modified": source_stat.last_modified,
+            "preprocessing_option": preprocessing_option,
+            "processed_at": datetime.now().isoformat(),
+        })
         print(f"Marked file {file_name} as processed.")
     except S3Error as e:
         print(f"Failed to mark file {file_name} as processed: {e}")
 
+def profile_columns(df, columns=None):
+    """Profile every column (or the given columns) in one aggregation pass: non-null count,
+    non-empty count and an approximate distinct count per column, plus the total row count."""
+    columns = columns if columns is not None else df.columns
+    aggregations = [count(lit(1)).alias("row_count")]
+    for idx, col_name in enumerate(columns):
+        aggregations.append(count(col(col_name)).alias(f"non_null_{idx}"))
+        # cast to string so numeric columns are compared with "" as text instead of being nulled out
+        aggregations.append(count(when(col(col_name).isNotNull() & (col(col_name).cast("string") != ""), True)).alias(f"non_empty_{idx}"))
+        aggregations.append(approx_count_distinct(col(col_name)).alias(f"distinct_{idx}"))
+    result = df.agg(*aggregations).collect()[0]
+
+    row_count = result["row_count"]
+    profiled = {}
+    for idx, col_name in enumerate(columns):
+        profiled[col_name] = {
+            "non_null_count": result[f"non_null_{idx}"],
+            "non_empty_count": result[f"non_empty_{idx}"],
+            "null_ratio": round(1 - result[f"non_null_{idx}"] / row_count, 6) if row_count else 1.0,
+            "distinct_estimate": result[f"distinct_{idx}"],
+        }
+    return {"row_count": row_count, "columns": profiled}
+
+def save_column_profile(profile_name, profile):
+    """Store the column profile as JSON next to the silver parquet output."""
+    try:
+        write_json_object(destination_bucket, profile_name, profile)
+        print(f"Saved column profile to {destination_bucket}/{profile_name}")
+    except S3Error as e:
+        print(f"Failed to save column profile {profile_name}: {e}")
+
 # preprocessing option 1 - basic cleanup
-def apply_basic_cleanup(df):
+def apply_basic_cleanup(df, source_column=None):
     """Basic data clean up: remove rows where all but one column is missing data,
     remove duplicates, remove entirely blank columns, standardize column names,
-    add extract date, and unique ID."""
+    add extract date, and unique ID.
+    source_column names a column identifying the source file when several files are cleaned together,
+    it is not profiled or counted as data, but is part of the duplicate check so duplicates are
+    still only removed within a file. It is left out of the unique ID, which stays the one the row
+    gets when its file is cleaned alone.
+    Returns the cleaned DataFrame and the column profile gathered while cleaning."""
     logger.info("Applying basic data clean up...")
 
-    # Initialize a list to hold columns that don't cause errors
-    valid_columns = []
+    # Cache the source so the profiling scan also feeds the dropna/dedup steps below
+    # instead of reading the file again, the caller unpersists it after the write.
+    df = df.persist()
 
-    # Step 1: Remove columns that are entirely blank, null, or empty
-    for col_name in df.columns:
-        try:
-            # Check if the column has at least one non-null and non-empty value
-            non_null_count = df.filter(col(col_name).isNotNull() & (col(col_name) != "")).limit(1).count()
-            if non_null_count > 0:
-                valid_columns.append(col_name)
-            else:
-                logger.info(f"Dropping column '{col_name}' as it is entirely blank or null.")
-        except Exception as e:
-            logger.error(f"Error processing column '{col_name}': {e}")
-            logger.info(f"Skipping column '{col_name}' due to error.")
-            continue
+    # Step 1: Remove columns that are entirely blank, null, or empty (one pass over all columns)
+    profile = profile_columns(df, [c for c in df.columns if c != source_column])
+    valid_columns = [source_column] if source_column else []
+    for col_name, column_profile in profile["columns"].items():
+        column_profile["dropped"] = column_profile["non_empty_count"] == 0
+        if column_profile["dropped"]:
+            logger.info(f"Dropping column '{col_name}' as it is entirely blank or null.")
+        else:
+            valid_columns.append(col_name)
 
     # Select only the valid columns
     df = df.select(valid_columns)
@@ -116,12 +368,14 @@ def apply_basic_cleanup(df):
     # Step 2: Standard column names for governance
     new_column_names = []
     columns_to_drop = []
+    renamed_columns = {}
 
     for col_name in df.columns:
         try:
             # Standardize column name: lowercase, replace special characters with underscores
             new_col_name = re.sub(r'[^0-9a-zA-Z]+', '_', col_name.strip().lower()).strip('_')
             new_column_names.append(new_col_name)
+            renamed_columns[col_name] = new_col_name
         except Exception as e:
             logger.error(f"Error renaming column '{col_name}': {e}")
             logger.info(f"Dropping column '{col_name}' due to error.")
@@ -138,7 +392,7 @@ def apply_basic_cleanup(df):
 
     # Step 3: Remove rows where all but one column is missing data
     min_non_null_values = 2  # At least two non-null values required to keep the row
-    df = df.dropna(thresh=min_non_null_values)
+    df = df.dropna(thresh=min_non_null_values, subset=[c for c in df.columns if c != source_column])
 
     # Step 4: Remove duplicate rows
     df = df.dropDuplicates()
@@ -147,95 +401,1007 @@ def apply_basic_cleanup(df):
     extract_date = datetime.now().strftime('%Y-%m-%d')
     df = df.withColumn("extract_date", lit(extract_date))
 
-    # Step 6: Add unique ID column
-    df = df.withColumn("unique_id", monotonically_increasing_id())
+    # Step 6: Add unique ID column, derived from the row content so it is the same on every run
+    df = df.withColumn("unique_id", row_hash_column(df))
 
-    return df
+    # Record the standardized name of every kept column in the profile
+    for col_name, new_col_name in renamed_columns.items():
+        profile["columns"][col_name]["renamed_to"] = new_col_name
+
+    return df, profile
+
+def _numeric_value(df, column):
+    """Column expression that treats NaN like null, matching na.fill which replaces both."""
+    if isinstance(df.schema[column].dataType, (FloatType, DoubleType)):
+        return nanvl(col(column), lit(None).cast(df.schema[column].dataType))
+    return col(column)
+
+def fit_ml_statistics(df, numeric_columns):
+    """Fit median, mean and standard deviation for all numeric columns in two jobs:
+    one multi-column approxQuantile call for the medians and one aggregation for the rest.
+    Mean and stddev are reported as they would be after filling the missing values with the
+    median, so the result matches filling first and measuring afterwards."""
+    if not numeric_columns:
+        return {}
+
+    medians = df.select([_numeric_value(df, column).alias(column) for column in numeric_columns]) \
+        .approxQuantile(numeric_columns, [0.5], 0.0)
+
+    aggregations = [count(lit(1)).alias("row_count")]
+    for idx, column in enumerate(numeric_columns):
+        value = _numeric_value(df, column)
+        aggregations.append(count(value).alias(f"count_{idx}"))
+        aggregations.append(mean(value).alias(f"mean_{idx}"))
+        aggregations.append(var_samp(value).alias(f"var_{idx}"))
+    result = df.agg(*aggregations).collect()[0]
+    total = result["row_count"]
+
+    statistics = {}
+    for idx, column in enumerate(numeric_columns):
+        if not medians[idx]:
+            logger.warning(f"Column '{column}' has no values, skipping it")
+            continue
+        median_value = medians[idx][0]
+        if isinstance(df.schema[column].dataType, IntegralType):
+            median_value = int(median_value)  # na.fill casts the fill value to the column type
+
+        # Combine the observed values with the (total - n) filled medians
+        n = result[f"count_{idx}"]
+        observed_m2 = (result[f"var_{idx}"] or 0.0) * (n - 1)
+        mean_value, stddev_value = ml_state.filled_statistics(n, result[f"mean_{idx}"], observed_m2, total, median_value)
+
+        statistics[column] = {"median": median_value, "mean": mean_value, "stddev": stddev_value, "count": total}
+    return statistics
+
+def apply_ml_statistics(df, statistics):
+    """Fill missing values with the median and z-scale every fitted column in a single projection."""
+    projection = []
+    for column in df.columns:
+        column_stats = statistics.get(column)
+        if column_stats is None or not isinstance(df.schema[column].dataType, NumericType):
+            projection.append(col(column))
+            continue
+        value = coalesce(_numeric_value(df, column), lit(column_stats["median"]).cast(df.schema[column].dataType))
+        if column_stats["stddev"]:
+            value = (value - lit(column_stats["mean"])) / lit(column_stats["stddev"])
+        else:
+            logger.warning(f"Standard deviation is zero for column: {column}")
+        projection.append(value.alias(column))
+    return df.select(projection)
+
+def ml_stats_object_name(dataset):
+    """Name of the document holding the fitted ML statistics of a dataset."""
+    return f"{ml_stats_prefix}{dataset}.json"
+
+def save_ml_statistics(file_name, statistics):
+    """Write the fitted statistics to the metadata bucket so later files of the dataset can reuse them."""
+    dataset = dataset_name(file_name)
+    try:
+        write_metadata_json(ml_stats_object_name(dataset), {
+            "dataset": dataset,
+            "fitted_on": file_name,
+            "fitted_at": datetime.now().isoformat(),
+            "columns": statistics,
+        })
+        print(f"Saved ML statistics for dataset {dataset}.")
+    except S3Error as e:
+        print(f"Failed to save ML statistics for dataset {dataset}: {e}")
+
+def load_ml_statistics(file_name):
+    """Load the statistics previously fitted for the dataset of a file, None if there are none."""
+    document = read_metadata_json(ml_stats_object_name(dataset_name(file_name)))
+    return document["columns"] if document else None
+
+def ml_state_object_name(dataset):
+    return f"{ml_state_prefix}{dataset}.json"
+
+def load_ml_state(file_name):
+    """Statistics state of the dataset of a file, None before its first file."""
+    return read_metadata_json(ml_state_object_name(dataset_name(file_name)))
+
+def save_ml_state(file_names, state):
+    """Store the dataset state once the files merged into it have been written to silver."""
+    dataset = dataset_name(file_names[0])
+    state["dataset"] = dataset
+    state["sources"] = sorted(set(state["sources"]) | set(file_names))
+    state["updated_at"] = datetime.now().isoformat()
+    try:
+        write_metadata_json(ml_state_object_name(dataset), state)
+        print(f"Updated ML statistics state for dataset {dataset}.")
+    except S3Error as e:
+        print(f"Failed to save ML statistics state for dataset {dataset}: {e}")
+
+def numeric_column_names(df):
+    return [column for column in df.columns if isinstance(df.schema[column].dataType, NumericType)]
+
+def ml_batch_sketch(df, numeric_columns):
+    """Per-column state of a batch (ml_state.column_sketch) in one aggregation: count, mean and
+    variance of the observed values and sketch_points approximate quantiles for the digest."""
+    if not numeric_columns:
+        return {}
+    aggregations = [count(lit(1)).alias("row_count")]
+    for idx, column in enumerate(numeric_columns):
+        value = _numeric_value(df, column).cast("double")
+        aggregations.append(count(value).alias(f"count_{idx}"))
+        aggregations.append(mean(value).alias(f"mean_{idx}"))
+        aggregations.append(var_samp(value).alias(f"var_{idx}"))
+        aggregations.append(percentile_approx(value, ml_state.sketch_quantiles(), 10000).alias(f"quantiles_{idx}"))
+    result = df.agg(*aggregations).collect()[0]
+
+    sketch = {}
+    for idx, column in enumerate(numeric_columns):
+        n = result[f"count_{idx}"]
+        sketch[column] = ml_state.column_sketch(
+            n, result["row_count"] - n, result[f"mean_{idx}"] or 0.0, (result[f"var_{idx}"] or 0.0) * (n - 1),
+            result[f"quantiles_{idx}"] or [], isinstance(df.schema[column].dataType, IntegralType))
+    return sketch
+
+def incremental_ml_statistics(file_name, sketch):
+    """Scaling for a batch in the incremental mode and what to store afterwards.
+    The dataset's stored scaling is used as is, the first batch (and a column seen for the first
+    time) gets its scaling from the merged state. Returns the scaling to apply, the scaling to save
+    (None if unchanged) and the merged state to save (None while refitting)."""
+    state = load_ml_state(file_name)
+    merged = ml_state.merge_state(state, sketch)
+    scaling = load_ml_statistics(file_name) or {}
+    missing = [column for column in sketch if column not in scaling]
+    new_scaling = None
+    if missing:
+        fitted = ml_state.scaling_from_state(merged)
+        new_scaling = dict(scaling, **{column: fitted[column] for column in missing if column in fitted})
+        scaling = new_scaling
+    return scaling, new_scaling, merged if ml_state_updates else None
 
 # Preprocessing option 2
-def apply_ml_preprocessing(df):
+def apply_ml_preprocessing(df, statistics=None):
     """Preprocessing for Machine Learning: fill missing values, scale numeric features
         The ML preprocessing aims to pre-perform some of the fundamental changes required to perform ML
-        this function detects datatypes that are able to """
+        this function detects datatypes that are able to be filled with the median and scaled by the mean and stddev.
+        Pass previously fitted statistics to reapply the same scaling, otherwise they are fitted on this DataFrame.
+        Returns the transformed DataFrame and the statistics used."""
     logger.info("Applying preprocessing for Machine Learning...")
+    numeric_columns = []
     for column in df.columns:
-        try:
-            # Get the data type of the column
-            dtype = df.schema[column].dataType
-
-            # Check if the column is of numeric type
-            if isinstance(dtype, NumericType):
-                # Handle missing values: replace with median
-                median_value = df.approxQuantile(column, [0.5], 0.0)[0]
-                df = df.na.fill({column: median_value})
-
-                # Standard deviation scaling
-                mean_val = df.select(mean(col(column))).collect()[0][0]
-                stddev_val = df.select(stddev(col(column))).collect()[0][0]
-                if stddev_val and stddev_val != 0:
-                    df = df.withColumn(column, (col(column) - mean_val) / stddev_val)
-                else:
-                    logger.warning(f"Standard deviation is zero for column: {column}")
-            else:
-                # Skip non-numeric columns
-                logger.info(f"Skipping non-numeric column: {column}")
-        except Exception as e:
-            # Log the error and continue with the next column
-            logger.error(f"An error occurred while processing column '{column}': {e}")
-            logger.info(f"Skipping column '{column}'")
-            continue
+        if isinstance(df.schema[column].dataType, NumericType):
+            numeric_columns.append(column)
+        else:
+            # Skip non-numeric columns
+            logger.info(f"Skipping non-numeric column: {column}")
+
+    if statistics is None:
+        statistics = fit_ml_statistics(df, numeric_columns)
+    else:
+        for column in numeric_columns:
+            if column not in statistics:
+                logger.warning(f"No fitted statistics for column '{column}', leaving it unscaled")
+
+    return apply_ml_statistics(df, statistics), statistics
+
+def project_name(file_name):
+    """Project of a bronze file, the first folder of its object name."""
+    if file_name.startswith(converted_prefix):
+        file_name = file_name[len(converted_prefix):]
+    return file_name.split('/', 1)[0] if '/' in file_name else "other"
+
+def read_object_head(file_name, length, bucket_name=source_bucket):
+    """First bytes of an object, decompressed for .gz files (the start of a gzip stream decompresses on its own)."""
+    response = minio_client.get_object(bucket_name, file_name, offset=0, length=length)
+    try:
+        data = response.read()
+    finally:
+        response.close()
+        response.release_conn()
+    if file_name.lower().endswith(".gz"):
+        data = zlib.decompressobj(zlib.MAX_WBITS | 16).decompress(data)
+    return data
+
+def read_csv_header(file_name, bucket_name=source_bucket):
+    """Read only the header row of a CSV (first 64 KB of the object)."""
+    first_line = read_object_head(file_name, 65536, bucket_name).decode("utf-8-sig", errors="replace").splitlines()[0]
+    return tuple(next(csv.reader([first_line])))
+
+def schema_object_name(file_name, header):
+    """Registry entry for a dataset shape: the project plus a hash of the header row."""
+    signature = hashlib.sha1("\x1f".join(header).encode("utf-8")).hexdigest()[:16]
+    return f"{schema_registry_prefix}{project_name(file_name)}/{signature}.json"
+
+# order used to decide if a sampled numeric type still fits in the registered one
+numeric_type_rank = {IntegerType: 1, LongType: 2, DecimalType: 3, DoubleType: 4}
+
+def is_type_compatible(registered_type, sampled_type):
+    """True if values inferred as sampled_type can be read with registered_type without losing them."""
+    if registered_type == sampled_type or isinstance(registered_type, StringType) or isinstance(sampled_type, NullType):
+        return True
+    registered_rank = numeric_type_rank.get(type(registered_type))
+    sampled_rank = numeric_type_rank.get(type(sampled_type))
+    if registered_rank and sampled_rank:
+        return sampled_rank <= registered_rank
+    return isinstance(registered_type, TimestampType) and isinstance(sampled_type, DateType)
+
+def infer_head_schema(file_name, bucket_name=source_bucket):
+    """Infer the schema from the first rows of a file (its first schema_sample_bytes) without reading the rest.
+    Columns without any value in the sample are reported as NullType since nothing can be inferred for them."""
+    sample = read_object_head(file_name, schema_sample_bytes, bucket_name).decode("utf-8-sig", errors="replace")
+    lines = sample.splitlines()
+    if len(lines) > 2 and not sample.endswith("\n"):
+        lines = lines[:-1]  # last line was cut off by the byte range
+    return infer_lines_schema(lines)
+
+def infer_lines_schema(lines):
+    """Infer the schema of CSV lines held in memory, the first of them being the header."""
+    session = get_spark()
+    sample_df = session.read.csv(session.sparkContext.parallelize(lines), header=True, inferSchema=True)
+    counts = sample_df.agg(*[count(col(c)).alias(f"count_{idx}") for idx, c in enumerate(sample_df.columns)]).collect()[0]
+    return StructType([
+        StructField(field.name, field.dataType if counts[f"count_{idx}"] else NullType(), True)
+        for idx, field in enumerate(sample_df.schema.fields)
+    ])
+
+def merge_schemas(registered, sampled):
+    """Widen the registered schema with the types seen in a sample, falling back to string."""
+    fields = []
+    for registered_field, sampled_field in zip(registered.fields, sampled.fields):
+        if is_type_compatible(registered_field.dataType, sampled_field.dataType):
+            data_type = registered_field.dataType
+        elif is_type_compatible(sampled_field.dataType, registered_field.dataType):
+            data_type = sampled_field.dataType
+        else:
+            data_type = StringType()
+        fields.append(StructField(registered_field.name, data_type, True))
+    return StructType(fields)
+
+def register_schema(file_name, header, schema, permissive=False):
+    """permissive: the header's files have ragged rows (a wrong number of fields), which a FAILFAST read rejects
+    whatever the types, so they are read in PERMISSIVE mode."""
+    try:
+        write_metadata_json(schema_object_name(file_name, header), {
+            "header": list(header),
+            "schema": schema.jsonValue(),
+            "permissive": permissive,
+            "registered_from": file_name,
+            "registered_at": datetime.now().isoformat(),
+        })
+        print(f"Registered schema for {project_name(file_name)} header signature of {file_name}")
+    except S3Error as e:
+        print(f"Failed to register schema for {file_name}: {e}")
+
+def read_bronze_csv(file_names, bucket_name=source_bucket):
+    """Read one or more bronze CSVs that share a header, using the schema registry to skip the inferSchema pass.
+    A registered schema is checked against the head of every file, when a file drifts from it the schema is
+    re-inferred on a sample (schema_sampling_ratio) of the rows, widened and registered again.
+    Only the head (schema_sample_bytes) and the sample are checked, so the rows are read in FAILFAST mode:
+    a later value the schema cannot hold fails the job instead of being read as null, and the caller widens
+    the registered schema over the whole input (widen_registered_schema) before the file is tried again.
+    Headers registered as permissive are read in PERMISSIVE mode.
+    A header seen for the first time is inferred over the whole input and registered."""
+    if isinstance(file_names, str):
+        file_names = [file_names]
+    paths = [f"s3a://{bucket_name}/{name}" for name in file_names]
+    header = read_csv_header(file_names[0], bucket_name)
+    entry = read_metadata_json(schema_object_name(file_names[0], header))
+
+    if entry is None:
+        df = get_spark().read.csv(paths, header=True, inferSchema=True)
+        register_schema(file_names[0], header, df.schema)
+        return df
+
+    schema = StructType.fromJson(entry["schema"])
+    mode = "PERMISSIVE" if entry.get("permissive") else "FAILFAST"
+    drifted = []
+    for name in file_names:
+        sampled = infer_head_schema(name, bucket_name)
+        if len(sampled.fields) != len(schema.fields) or not all(
+                is_type_compatible(r.dataType, s.dataType) for r, s in zip(schema.fields, sampled.fields)):
+            drifted.append(name)
+    if not drifted:
+        return get_spark().read.csv(paths, header=True, schema=schema, mode=mode)
+
+    print(f"Schema drift detected in {', '.join(drifted)}, re-inferring on a {schema_sampling_ratio:.0%} sample")
+    sampled = get_spark().read.csv(paths, header=True, inferSchema=True, samplingRatio=schema_sampling_ratio).schema
+    schema = merge_schemas(schema, sampled)
+    register_schema(file_names[0], header, schema, permissive=bool(entry.get("permissive")))
+    return get_spark().read.csv(paths, header=True, schema=schema, mode=mode)
+
+def is_malformed_csv_error(error):
+    """True for the error of a FAILFAST CSV read that met a value its schema cannot hold."""
+    message = str(error)
+    return "MALFORMED_RECORD_IN_PARSING" in message or "Malformed records are detected" in message
+
+def widen_registered_schema(file_names):
+    """Infer the schema over the whole of bronze CSVs that share a header and widen their registered schema
+    with it, after a FAILFAST read found a row past the checked head that did not fit. When nothing widens
+    the rows that failed are ragged and the header is registered as permissive. Failures are reported."""
+    try:
+        bucket_name = source_bucket
+        if source_format(file_names[0]) == "csv.zst":  # still converted, removed once the file is done
+            file_names, bucket_name = [converted_object_name(name) for name in file_names], metadata_bucket
+        header = read_csv_header(file_names[0], bucket_name)
+        entry = read_metadata_json(schema_object_name(file_names[0], header))
+        print(f"A row of {', '.join(file_names)} does not fit the registered schema, inferring it over the whole input")
+        inferred = get_spark().read.csv([f"s3a://{bucket_name}/{name}" for name in file_names],
+                                        header=True, inferSchema=True).schema
+        registered = StructType.fromJson(entry["schema"]) if entry is not None else None
+        schema = merge_schemas(registered, inferred) if registered is not None else inferred
+        if schema == registered:
+            print("The rows that do not fit are ragged, files with this header are read in PERMISSIVE mode")
+        register_schema(file_names[0], header, schema, permissive=schema == registered)
+    except Exception as e:
+        print(f"Failed to widen the registered schema of {file_names[0]}: {e}")
+
+def arrow_type_for(value_types):
+    """Arrow type for a workbook column from the Python types of its cells, string when they are mixed."""
+    import pyarrow as pa
+
+    if not value_types or value_types - {int, float, bool, datetime, date}:
+        return pa.string()
+    if value_types == {bool}:
+        return pa.bool_()
+    if value_types == {int}:
+        return pa.int64()
+    if value_types <= {int, float}:
+        return pa.float64()
+    if value_types == {datetime}:
+        return pa.timestamp("us")
+    if value_types == {date}:
+        return pa.date32()
+    return pa.string()
+
+def convert_xlsx_to_parquet(local_source, local_target):
+    """Convert the first sheet of a workbook to Parquet without loading it in memory: openpyxl streams
+    the rows in read-only mode, a first pass picks each column's type and a second pass writes
+    Arrow record batches of xlsx_batch_rows rows."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(local_source, read_only=True, data_only=True)
+    try:
+        sheet = workbook.worksheets[0]
+        header = next(sheet.iter_rows(max_row=1, values_only=True), None)
+        if header is None:
+            raise ValueError("Workbook has no rows")
+        names = [str(value) if value is not None else f"column_{idx}" for idx, value in enumerate(header)]
+        width = len(names)
+
+        value_types = [set() for _ in names]
+        for row in sheet.iter_rows(min_row=2, values_only=True):
+            for idx, value in enumerate(row[:width]):
+                if value is not None:
+                    value_types[idx].add(type(value))
+        schema = pa.schema([pa.field(name, arrow_type_for(types)) for name, types in zip(names, value_types)])
+
+        def to_record_batch(rows):
+            columns = []
+            for idx, field in enumerate(schema):
+                values = [row[idx] if idx < len(row) else None for row in rows]
+                if pa.types.is_string(field.type):
+                    values = [str(value) if value is not None else None for value in values]
+                elif pa.types.is_floating(field.type):
+                    values = [float(value) if value is not None else None for value in values]
+                columns.append(pa.array(values, type=field.type))
+            return pa.RecordBatch.from_arrays(columns, schema=schema)
+
+        with pq.ParquetWriter(local_target, schema) as writer:
+            rows = []
+            for row in sheet.iter_rows(min_row=2, values_only=True):
+                rows.append(row)
+                if len(rows) >= xlsx_batch_rows:
+                    writer.write_batch(to_record_batch(rows))
+                    rows = []
+            if rows:
+                writer.write_batch(to_record_batch(rows))
+    finally:
+        workbook.close()
+
+def converted_object_name(file_name):
+    """Object in the metadata bucket holding the converted copy of a source Spark cannot read directly."""
+    extension = "csv" if source_format(file_name) == "csv.zst" else "parquet"
+    return f"{converted_prefix}{strip_source_extension(file_name)}.{extension}"
+
+def convert_source(file_name):
+    """Stream a source Spark cannot read natively into the metadata bucket: .csv.zst is decompressed
+    to CSV (so it still goes through the schema registry) and .xlsx is converted to Parquet.
+    Returns the converted object name."""
+    converted_name = converted_object_name(file_name)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        local_source = os.path.join(tmp_dir, "source")
+        local_converted = os.path.join(tmp_dir, converted_name.rsplit('/', 1)[-1])
+        minio_client.fget_object(source_bucket, file_name, local_source)
+        if source_format(file_name) == "csv.zst":
+            import zstandard
+
+            with open(local_source, "rb") as source, open(local_converted, "wb") as target:
+                zstandard.ZstdDecompressor().copy_stream(source, target)
+        else:
+            convert_xlsx_to_parquet(local_source, local_converted)
+        minio_client.fput_object(metadata_bucket, converted_name, local_converted)
+    print(f"Converted {file_name} to {metadata_bucket}/{converted_name}")
+    return converted_name
+
+def remove_converted_sources(file_names):
+    """Delete the converted copies once the files have been processed."""
+    converted = [converted_object_name(name) for name in file_names if source_format(name) in ("csv.zst", "xlsx")]
+    if converted:
+        remove_objects(metadata_bucket, converted)
+
+def read_source(file_names):
+    """Read bronze files of the same format with the reader for their extension: CSV (also .csv.gz)
+    through the schema registry, JSON lines or JSON arrays, Parquet, and .csv.zst/.xlsx after converting them."""
+    file_format = source_format(file_names[0])
+    paths = [f"s3a://{source_bucket}/{name}" for name in file_names]
+    if file_format == "csv":
+        return read_bronze_csv(file_names)
+    if file_format == "json":
+        # a JSON array spans many lines, JSON lines has one record per line
+        multi_line = read_object_head(file_names[0], 1024).lstrip().startswith(b"[")
+        return get_spark().read.json(paths, multiLine=multi_line)
+    if file_format == "parquet":
+        return get_spark().read.parquet(*paths)
+    if file_format == "csv.zst":
+        return read_bronze_csv([convert_source(name) for name in file_names], bucket_name=metadata_bucket)
+    if file_format == "xlsx":
+        return get_spark().read.parquet(*[f"s3a://{metadata_bucket}/{convert_source(name)}" for name in file_names])
+    raise ValueError(f"File {file_names[0]} is not a supported file type")
+
+def apply_preprocessing(df, preprocessing_option, file_name, source_column=None):
+    """Apply the selected preprocessing option.
+    Returns the transformed DataFrame, the column profile (clean up only), newly fitted ML statistics (or None)
+    and the dataset's ML statistics state to store (incremental_ml_stats only, else None)."""
+    profile = None
+    ml_statistics = None
+    ml_state_update = None
+    if preprocessing_option == "Data Clean Up":
+        with run_stage("cleanup"):  # blank-column detection, the rest of the clean up runs with the write
+            transformed_df, profile = apply_basic_cleanup(df, source_column=source_column)
+    elif preprocessing_option == "Preprocessing for Machine Learning" and incremental_ml_stats:
+        with run_stage("ml_preprocessing"):
+            sketch = ml_batch_sketch(df, numeric_column_names(df))
+            statistics, ml_statistics, ml_state_update = incremental_ml_statistics(file_name, sketch)
+            transformed_df, _ = apply_ml_preprocessing(df, statistics)
+    elif preprocessing_option == "Preprocessing for Machine Learning":
+        previous_statistics = load_ml_statistics(file_name) if reuse_ml_stats else None
+        with run_stage("ml_preprocessing"):  # fitting the statistics, applying them runs with the write
+            transformed_df, ml_statistics = apply_ml_preprocessing(df, previous_statistics)
+        if previous_statistics is not None:
+            ml_statistics = None  # already stored, keep the original fit
+    else:
+        transformed_df = df  # No preprocessing
+    return transformed_df, profile, ml_statistics, ml_state_update
+
+def dataset_directory(file_name):
+    """Dataset-level silver directory of a file for the incremental write mode, e.g. datasets/heart."""
+    return f"{dataset_prefix}{dataset_name(file_name).rsplit('/', 1)[-1]}"
+
+def estimate_output_bytes(source_stats):
+    """Rough parquet size of a set of sources ({file name: stat}): uncompressed CSV/JSON shrink by
+    text_parquet_ratio, compressed and columnar sources are taken at their own size."""
+    total = 0
+    for name, stat in source_stats.items():
+        is_text = source_format(name) in ("csv", "json") and not name.lower().endswith(".gz")
+        total += stat.size * text_parquet_ratio if is_text else stat.size
+    return total
+
+def size_output(df, output_bytes, partition_columns=()):
+    """Set the number of write tasks so files come out near target_file_bytes.
+    Unpartitioned output is brought to ceil(output_bytes / target) partitions: coalesced (no shuffle) when
+    it has at most coalesce_max_ratio times that many, else repartitioned, because a coalesce also runs the
+    stages before it (the read and every narrow transformation) on only that many tasks.
+    Partitioned output is repartitioned by its partition columns, so a partition value is written
+    as one file instead of one small file per task, spread over that many files by a row hash when
+    the output is larger than the target."""
+    file_count = max(1, math.ceil(output_bytes / target_file_bytes))
+    if partition_columns:
+        if file_count == 1:
+            return df.repartition(*partition_columns)
+        # a deterministic salt (not rand()) so a retried task gets the same rows
+        salt = pmod(xxhash64(*df.columns), lit(file_count))
+        return df.repartition(file_count, *partition_columns, salt)
+    partitions = df.rdd.getNumPartitions()
+    if partitions > file_count * coalesce_max_ratio:
+        return df.repartition(file_count)
+    if partitions > file_count:
+        return df.coalesce(file_count)
     return df
 
+def append_to_dataset(df, file_names, output_bytes=None, batch_id=None):
+    """Append a batch to the dataset directory, partitioned by project and extract_date.
+    The batch is written to _staging/<batch_id> first, its files are then copied into the partitions
+    and _commits/<batch_id>.json is written last as the commit marker. A pending marker listing the
+    published files hides them from readers that list the directory with zone_maps.list_data_files
+    (gold jobs, the Flask API) until the commit, and lets the next append roll back a batch that died
+    before committing. Readers that list the files themselves can see a batch while it is copied in.
+    Appends hold the dataset's lease (taken by the caller when shares_dataset_state), so they commit one
+    at a time. With dedup_index on, rows already in the dataset are dropped first and the index is updated
+    after the commit. output_bytes, the estimated parquet size of the batch, sizes the written files.
+    batch_id is a new one by default, a caller that records it beforehand can tell from the commit marker
+    whether the append committed. Returns the batch id."""
+    dataset_dir = dataset_directory(file_names[0])
+    lease = None if shares_dataset_state() else wait_for_lease(directory_lease_key(dataset_dir))
+    try:
+        return commit_batch(df, file_names, dataset_dir, output_bytes, batch_id)
+    finally:
+        release_lease(lease)
+
+def commit_batch(df, file_names, dataset_dir, output_bytes, batch_id):
+    """append_to_dataset once the dataset's lease is held."""
+    rollback_incomplete_batches(dataset_dir, leased=True)
+
+    batch_id = batch_id or new_batch_id()
+    dedup_files = {}
+    if dedup_index:
+        remove_staged_hashes(dataset_dir)
+        # persisted so the write and the staged hashes use the same rows without recomputing them
+        batch_df = drop_known_rows(df, dataset_dir).persist()
+        df = batch_df.drop("_row_hash")
+        with run_stage("dedup_index"):
+            dedup_files = stage_dedup_index(batch_df, dataset_dir, batch_id)
+
+    staging_dir = f"{dataset_dir}/_staging/{batch_id}"
+    if "extract_date" not in df.columns:
+        df = df.withColumn("extract_date", lit(datetime.now().strftime('%Y-%m-%d')))
+    df = df.withColumn("project", lit(project_name(file_names[0])))
+    if output_bytes is not None:
+        df = size_output(df, output_bytes, ("project", "extract_date"))
+    df.write.mode('overwrite').partitionBy("project", "extract_date").parquet(f"s3a://{destination_bucket}/{staging_dir}")
+
+    # staging/<project=..>/<extract_date=..>/part-x.parquet -> <project=..>/<extract_date=..>/<batch_id>-part-x.parquet
+    published = {}
+    for obj in minio_client.list_objects(destination_bucket, prefix=f"{staging_dir}/", recursive=True):
+        if obj.object_name.endswith('.parquet'):
+            partition_dir, part_file = obj.object_name[len(staging_dir) + 1:].rsplit('/', 1)
+            published[obj.object_name] = f"{dataset_dir}/{partition_dir}/{batch_id}-{part_file}"
+
+    with run_stage("publish"):
+        # the row hashes move into the index with the batch, see etl_commits
+        fields = {"dedup_index": dedup_files} if dedup_index else {}
+        publish_batch(destination_bucket, dataset_dir, published, batch_id, sources=file_names, **fields)
+    remove_objects(destination_bucket, [obj.object_name for obj in minio_client.list_objects(
+        destination_bucket, prefix=f"{staging_dir}/", recursive=True)])
+
+    if dedup_index:
+        batch_df.unpersist()
+    return batch_id
+
+def file_output_name(file_name):
+    """Silver parquet directory of a single file in the file write mode."""
+    return f"{strip_source_extension(file_name)}_processed.parquet"
+
+def select_engine(file_name, source_stat):
+    """Engine for a single file: "local" for CSV and Parquet files up to local_engine_max_bytes written
+    in the file mode, "spark" for everything else (incremental appends and the dedup index need Spark)."""
+    if engine == "spark":
+        return "spark"
+    if source_format(file_name) not in local_engine_formats or write_mode != "file":
+        if engine == "local":
+            print(f"The local engine does not handle {file_name} in {write_mode} mode, using Spark")
+        return "spark"
+    if engine == "local" or source_stat.size <= local_engine_max_bytes:
+        return "local"
+    return "spark"
+
+def is_chunked(file_name, source_stat):
+    """True for the files processed in resumable chunks: uncompressed CSVs of at least chunked_min_bytes."""
+    return (chunked_min_bytes > 0 and source_stat.size >= chunked_min_bytes
+            and source_format(file_name) == "csv" and not file_name.lower().endswith(".gz"))
+
+def set_run_engine(name):
+    report = getattr(run_state, "report", None)
+    if report is not None:
+        report["engine"] = name
+
+def write_silver(transformed_df, file_names, output_bytes=None, batch_id=None):
+    """Write transformed data to the silver bucket in the configured write mode, with files sized
+    from output_bytes (the estimated parquet size) when it is given, batch_id names the append of the
+    incremental mode or the swap of the file mode. Returns the output name and the prefix used for sidecar files (profile etc.) next to it."""
+    if write_mode == "incremental":
+        batch_id = append_to_dataset(transformed_df, file_names, output_bytes, batch_id)
+        dataset_dir = dataset_directory(file_names[0])
+        return dataset_dir, batch_sidecar_prefix(dataset_dir, batch_id)
+
+    if output_bytes is not None:
+        transformed_df = size_output(transformed_df, output_bytes)
+    # Define the output path in the bucket and use parquet now instead of IB/Deltatable,
+    # the new files are staged and swapped in with publish_output
+    output_file_name = file_output_name(file_names[0])
+    lease = wait_for_lease(directory_lease_key(output_file_name))  # the one compactions of the output take
+    try:
+        rollback_incomplete_batches(output_file_name, leased=True)
+        batch_id = batch_id or new_batch_id()
+        staging_dir = f"{output_file_name}/_staging/{batch_id}"
+        transformed_df.write.mode('overwrite').parquet(f"s3a://{destination_bucket}/{staging_dir}")
+        staged = [obj.object_name for obj in minio_client.list_objects(
+            destination_bucket, prefix=f"{staging_dir}/", recursive=True)]
+        with run_stage("publish"):
+            publish_output(output_file_name, [name for name in staged if name.endswith('.parquet')], file_names, batch_id)
+        remove_objects(destination_bucket, staged)
+    finally:
+        release_lease(lease)
+    return output_file_name, f"{output_file_name.replace('.parquet', '')}_"
+
+def preview_output(output_name):
+    """Show a bounded sample of what was written. Reading a few rows back from parquet is cheap,
+    whereas show() on the transformed DataFrame would run the whole transformation a second time."""
+    if preview_rows <= 0:
+        return
+    try:
+        get_spark().read.parquet(f"s3a://{destination_bucket}/{output_name}").limit(preview_rows).show(preview_rows)
+    except AnalysisException as e:
+        print(f"Could not preview {output_name}: {e}")
+
+def estimate_row_count(file_name, size):
+    """Estimate the number of data rows of a CSV from its size and the line length in the first MB."""
+    response = minio_client.get_object(source_bucket, file_name, offset=0, length=schema_sample_bytes)
+    try:
+        sample = response.read()
+    finally:
+        response.close()
+        response.release_conn()
+    lines = max(sample.count(b"\n"), 1)
+    return max(int(size / (len(sample) / lines)) - 1, 0)
+
+def dry_run_file(file_name, preprocessing_option):
+    """Plan a file without writing silver: report the output schema, an estimated row count and
+    the columns clean up would drop. Nothing is marked as processed."""
+    start_run([file_name], preprocessing_option)
+    set_run_engine("spark")
+    status = "failed"
+    try:
+        source_stat = minio_client.stat_object(source_bucket, file_name)
+        with run_stage("spark_start"):
+            get_spark()
+        with run_stage("read"):
+            df = read_source([file_name])
+        transformed_df, profile, _, _ = apply_preprocessing(df, preprocessing_option, file_name)
+
+        estimated = False
+        dropped_columns = []
+        if profile is not None:
+            row_count = profile["row_count"]  # clean up already scanned the file for its profile
+            dropped_columns = [name for name, column in profile["columns"].items() if column["dropped"]]
+        elif source_format(file_name) == "csv" and not file_name.lower().endswith(".gz"):
+            row_count = estimate_row_count(file_name, source_stat.size)
+            estimated = True
+        else:
+            with run_stage("count"):
+                row_count = df.count()
+        df.unpersist()
+
+        print(f"Dry run for {file_name} ({preprocessing_option}), nothing written to {destination_bucket}")
+        print(f"Input size: {source_stat.size / (1024 * 1024):.1f} MB, rows: {'~' if estimated else ''}{row_count}")
+        print(f"Dropped columns: {', '.join(dropped_columns) if dropped_columns else 'none'}")
+        print("Planned schema:")
+        print(transformed_df.schema.treeString())
+        status = "dry-run"
+        return status
+    except Exception as e:
+        print(f"Failed to plan file {file_name}: {e}")
+        return status
+    finally:
+        remove_converted_sources([file_name])
+        finish_run(status)
+
 # actually perform the preprocessing, take from bronze apply changes, save to silver.
-def process_file(file_name, preprocessing_option):
-    """Process a file: read from MinIO, transform based on preprocessing option, and write back as a parquet."""
+def process_file(file_name, preprocessing_option, force=False):
+    """Process a file: read from MinIO, transform based on preprocessing option, and write back as a parquet.
+    force processes it again even if the manifest has it as processed. Returns "processed", "skipped" or "failed"."""
+    start_run([file_name], preprocessing_option)
+    status = "failed"
+    leases = []
     try:
-        if is_file_processed(file_name):  # Check if file has already been processed
+        # Stat the source once, its ETag identifies the version of the file being processed
+        source_stat = minio_client.stat_object(source_bucket, file_name)
+        if not force and is_file_processed(file_name, source_stat):  # Check if this version has already been processed
             print(f"File {file_name} has already been processed. Skipping...")
-            return
+            status = "skipped"
+            return status
+
+        lease = acquire_lease(file_name)
+        if lease is None:
+            print(f"File {file_name} is being processed by another worker. Skipping...")
+            status = "skipped"
+            return status
+        leases.append(lease)
+        if not force and is_file_processed(file_name, source_stat):  # finished by another worker before the claim
+            print(f"File {file_name} has already been processed. Skipping...")
+            status = "skipped"
+            return status
+        if shares_dataset_state():
+            leases.append(wait_for_lease(dataset_lease_key(file_name)))
+
+        selected_engine = select_engine(file_name, source_stat)
+        set_run_engine(selected_engine)
+        if selected_engine == "local":
+            import etl_local  # pyarrow engine for small files, same output without starting Spark
+            status = etl_local.process_file_local(file_name, preprocessing_option, source_stat)
+            return status
 
-        # Read data from MinIO bucket (dw-bucket-bronze)
-        input_path = f"s3a://{source_bucket}/{file_name}"
+        with run_stage("spark_start"):  # JVM start-up on the first Spark file, ~0 afterwards
+            get_spark()
 
-        # Read CSV data into DataFrame
-        df = spark.read.csv(input_path, header=True, inferSchema=True)
+        if is_chunked(file_name, source_stat):
+            import etl_chunked  # large CSVs are parsed in committed chunks and resumed after a failure
+            status = etl_chunked.process_file_chunked(file_name, preprocessing_option, source_stat)
+            return status
+
+        # Read data from MinIO bucket (dw-bucket-bronze) into DataFrame with the reader for its format,
+        # CSVs use the registered schema when their header has been seen before
+        with run_stage("read"):
+            df = read_source([file_name])
         print(f"Processing file: {file_name}")
 
         # Determine and apply transformations based on selected preprocessing option
-        if preprocessing_option == "Data Clean Up":
-            transformed_df = apply_basic_cleanup(df)
-        elif preprocessing_option == "Preprocessing for Machine Learning":
-            transformed_df = apply_ml_preprocessing(df)
-        else:
-            transformed_df = df  # No preprocessing
+        transformed_df, profile, ml_statistics, ml_state_update = apply_preprocessing(df, preprocessing_option, file_name)
+
+        # Save the DataFrame as Parquet in the silver bucket
+        with run_stage("write"):
+            output_name, sidecar_prefix = write_silver(
+                transformed_df, [file_name], output_bytes=estimate_output_bytes({file_name: source_stat}))
+        print(f"Processed and saved file: {file_name} to {destination_bucket}/{output_name}")
+        with run_stage("column_stats"):
+            refresh_column_stats(output_name)
+        with run_stage("preview"):
+            preview_output(output_name)
+
+        with run_stage("metadata"):
+            if profile is not None:
+                save_column_profile(f"{sidecar_prefix}profile.json", profile)
+            if ml_statistics is not None:
+                save_ml_statistics(file_name, ml_statistics)
+            if ml_state_update is not None:
+                save_ml_state([file_name], ml_state_update)
+            df.unpersist()  # release the cached source (only cached by the clean up step)
+
+            # Mark the file as processed in the metadata bucket
+            mark_file_as_processed(file_name, source_stat, preprocessing_option)
+        status = "processed"
+        return status
+    except Exception as e:
+        print(f"Failed to process file {file_name}: {e}")
+        if is_malformed_csv_error(e):
+            widen_registered_schema([file_name])
+            print(f"Processing {file_name} again reads it with the widened schema")
+        return status
+    finally:
+        for lease in reversed(leases):  # released once the file is marked as processed
+            release_lease(lease)
+        remove_converted_sources([file_name])
+        finish_run(status)
+
+def resolve_targets(targets):
+    """Expand object keys and bronze prefixes (e.g. project2/) into a list of supported object names."""
+    file_names = []
+    for target in targets:
+        if source_format(target):
+            file_names.append(target)
+            continue
+        prefix = target if target.endswith('/') else f"{target}/"
+        for obj in minio_client.list_objects(source_bucket, prefix=prefix, recursive=True):
+            if source_format(obj.object_name):
+                file_names.append(obj.object_name)
+    return sorted(set(file_names))
+
+def source_tag(file_name):
+    """Value of the source_file column of a grouped file's rows: its base name without extension."""
+    return re.search(r'([^/]+?)(\.[^/]*)?$', file_name).group(1)
+
+def write_silver_group(transformed_df, file_names, source_stats, source_column):
+    """write_silver for a group of files whose rows carry their file's source_tag in source_column: every file
+    ends up where write_silver puts it when processed alone. In the file mode the group is written once to a
+    staging directory partitioned by source_column and each partition is published to the file's own
+    <name>_processed.parquet, in the incremental mode each dataset directory gets one append with the rows of
+    its files. source_column is not written. Returns the (output name, sidecar prefix) pairs written."""
+    if write_mode == "incremental":
+        by_dataset = {}
+        for name in file_names:
+            by_dataset.setdefault(dataset_directory(name), []).append(name)
+        if len(by_dataset) > 1:
+            transformed_df = transformed_df.persist()  # filtered once per dataset
+        outputs = []
+        for names in by_dataset.values():
+            batch_df = transformed_df.where(col(source_column).isin([source_tag(name) for name in names]))
+            outputs.append(write_silver(batch_df.drop(source_column), names,
+                                        output_bytes=estimate_output_bytes({name: source_stats[name] for name in names})))
+        transformed_df.unpersist()
+        return outputs
 
-        transformed_df.show()
+    output_names = {name: file_output_name(name) for name in file_names}
+    # the leases compactions of the outputs take, in sorted order as in process_file_group
+    leases = [wait_for_lease(directory_lease_key(output_name)) for output_name in sorted(output_names.values())]
+    try:
+        for output_name in output_names.values():
+            rollback_incomplete_batches(output_name, leased=True)
+        batch_id = new_batch_id()
+        staging_dir = f"{output_names[file_names[0]]}/_staging/{batch_id}"
+        transformed_df = size_output(transformed_df, estimate_output_bytes(source_stats), (source_column,))
+        transformed_df.write.mode('overwrite').partitionBy(source_column).parquet(f"s3a://{destination_bucket}/{staging_dir}")
+
+        # staging/<source_column>=<tag>/part-x.parquet -> <name>_processed.parquet/<batch_id>-part-x.parquet
+        staged = {}
+        for obj in minio_client.list_objects(destination_bucket, prefix=f"{staging_dir}/", recursive=True):
+            if obj.object_name.endswith('.parquet'):
+                partition_dir = obj.object_name[len(staging_dir) + 1:].rsplit('/', 1)[0]
+                staged.setdefault(partition_dir.split('=', 1)[1], []).append(obj.object_name)
+        with run_stage("publish"):
+            for name, output_name in output_names.items():
+                publish_output(output_name, staged.get(source_tag(name), []), [name], batch_id)
+        remove_objects(destination_bucket, [obj.object_name for obj in minio_client.list_objects(
+            destination_bucket, prefix=f"{staging_dir}/", recursive=True)])
+    finally:
+        for lease in reversed(leases):
+            release_lease(lease)
+    return [(output_name, f"{output_name.replace('.parquet', '')}_") for output_name in output_names.values()]
+
+def process_file_group(file_names, preprocessing_option):
+    """Process several CSVs that share a registered schema (same project and header, e.g. the files of many
+    devices) in one Spark job. The files are read together and cleaned with duplicates removed per file,
+    each file's rows are then written to the same place as by process_file (see write_silver_group).
+    Blank-column detection, the column profile and ML statistics are computed over the whole group.
+    Files claimed by another worker are left out of the group.
+    Returns a dict of file name to "processed", "skipped" or "failed"."""
+    project = project_name(file_names[0])
+    start_run(file_names, preprocessing_option)
+    set_run_engine("spark")
+    status = "failed"
+    results = {}
+    leases = []
+    try:
+        for name in file_names:
+            lease = acquire_lease(name)
+            if lease is None or is_file_processed(name):
+                print(f"File {name} is being processed by another worker or was just processed. Skipping...")
+                release_lease(lease)
+                results[name] = "skipped"
+            else:
+                leases.append(lease)
+        file_names = [name for name in file_names if name not in results]
+        if not file_names:
+            status = "skipped"
+            return results
+        if shares_dataset_state():
+            # taken in sorted order so two groups sharing datasets cannot wait on each other
+            for lease_key in sorted({dataset_lease_key(name) for name in file_names}):
+                leases.append(wait_for_lease(lease_key))
 
-        # Define the output path in the bucket and use parquet now instead of IB/Deltatable
-        output_file_name = f"{file_name.replace('.csv', '')}_processed.parquet"
-        output_path = f"s3a://{destination_bucket}/{output_file_name}"
+        source_stats = {name: minio_client.stat_object(source_bucket, name) for name in file_names}
+        with run_stage("spark_start"):
+            get_spark()
+        with run_stage("read"):
+            df = read_source(file_names)
+        # tag each row with the file it came from (source_tag)
+        df = df.withColumn("source_file", regexp_extract(input_file_name(), r'([^/]+?)(\.[^/]*)?$', 1))
+        print(f"Processing {len(file_names)} files of project {project} in one batch")
 
-        # Save the DataFrame as a Parquet file
-        transformed_df.write.mode('overwrite').parquet(output_path)
+        transformed_df, profile, ml_statistics, ml_state_update = apply_preprocessing(
+            df, preprocessing_option, file_names[0], source_column="source_file")
 
-        print(f"Processed and saved file: {file_name} to {destination_bucket}")
+        with run_stage("write"):
+            outputs = write_silver_group(transformed_df, file_names, source_stats, "source_file")
+        print(f"Processed and saved {len(file_names)} files to {len(outputs)} output(s) in {destination_bucket}")
+        for output_name, _ in outputs:
+            with run_stage("column_stats"):
+                refresh_column_stats(output_name)
+            with run_stage("preview"):
+                preview_output(output_name)
 
-        # Mark the file as processed in the metadata bucket
-        mark_file_as_processed(file_name)
+        with run_stage("metadata"):
+            if profile is not None:
+                for _, sidecar_prefix in outputs:
+                    save_column_profile(f"{sidecar_prefix}profile.json", profile)
+            if ml_statistics is not None:
+                save_ml_statistics(file_names[0], ml_statistics)
+            if ml_state_update is not None:
+                save_ml_state(file_names, ml_state_update)
+            df.unpersist()
+
+            for name in file_names:
+                mark_file_as_processed(name, source_stats[name], preprocessing_option)
+        status = "processed"
+        return dict(results, **{name: status for name in file_names})
     except Exception as e:
-        print(f"Failed to process file {file_name}: {e}")
+        print(f"Failed to process batch of {len(file_names)} files of project {project}: {e}")
+        if is_malformed_csv_error(e):
+            widen_registered_schema(file_names)  # before the files fall back to process_file
+        return dict(results, **{name: status for name in file_names})
+    finally:
+        for lease in reversed(leases):
+            release_lease(lease)
+        finish_run(status)
+
+def process_batch(file_names, preprocessing_option):
+    """Process many bronze CSVs: files with the same registered schema (project and header) are read and
+    written in one Spark job, whatever their dataset. With ML preprocessing the files of a group also share
+    a dataset, as the statistics are fitted per dataset. Files whose source_tag is not a plain name or is
+    already in the group, other formats, large CSVs and any group that fails are processed one by one.
+    Returns a dict of file name to "processed", "skipped" or "failed"."""
+    results = {}
+    groups = {}
+    group_tags = {}
+    for name in file_names:
+        try:
+            source_stat = minio_client.stat_object(source_bucket, name)
+            if is_file_processed(name, source_stat):
+                print(f"File {name} has already been processed. Skipping...")
+                results[name] = "skipped"
+                continue
+            key = None
+            if source_format(name) == "csv" and not is_chunked(name, source_stat):
+                key = ("csv", schema_object_name(name, read_csv_header(name)))
+                if preprocessing_option == "Preprocessing for Machine Learning":
+                    key += (dataset_name(name),)
+            # the tag is matched against the file path Spark reports (URL encoded) and names the staged partition
+            tag = source_tag(name)
+            if key is not None and re.fullmatch(r'[A-Za-z0-9_-]+', tag) and tag not in group_tags.get(key, ()):
+                groups.setdefault(key, []).append(name)
+                group_tags.setdefault(key, set()).add(tag)
+            else:
+                groups[(name,)] = [name]
+        except S3Error as e:
+            print(f"Failed to read file {name}: {e}")
+            results[name] = "failed"
+
+    for group in groups.values():
+        if len(group) > 1:
+            group_results = process_file_group(group, preprocessing_option)
+            results.update({name: status for name, status in group_results.items() if status != "failed"})
+            group = [name for name, status in group_results.items() if status == "failed"]
+            if group:
+                print(f"Falling back to per-file processing for {len(group)} files")
+        for name in group:
+            results[name] = process_file(name, preprocessing_option)
+    return results
 
 def main(file_name, preprocessing_option):
-    if file_name.endswith('.csv'):  # Ensure only CSV files are processed
-        process_file(file_name, preprocessing_option)
+    if source_format(file_name):  # Ensure only supported tabular files are processed
+        return process_file(file_name, preprocessing_option)
+    else:
+        print(f"File {file_name} is not a supported file type. Skipping.")
+        return "skipped"
+
+def main_batch(targets, preprocessing_option):
+    """Batch mode: process every supported file named in targets, which are object keys or bronze prefixes."""
+    file_names = resolve_targets(targets)
+    if not file_names:
+        print(f"No supported files found for {', '.join(targets)}")
+        return {}
+    results = process_batch(file_names, preprocessing_option)
+    for status in ("processed", "skipped", "failed"):
+        print(f"{status}: {sum(1 for s in results.values() if s == status)}")
+    return results
+
+def cli(argv=None):
+    """Command line of the pipeline, returns the exit status."""
+    global engine, write_mode, preview_rows, dedup_index
+    parser = argparse.ArgumentParser(
+        description="Bronze to silver ETL",
+        usage="python etl_pipeline.py <file_name|prefix/> [<file_name|prefix/> ...] <preprocessing_option>"
+    )
+    parser.add_argument("targets", nargs="+", help="bronze object keys or prefixes such as project2/")
+    parser.add_argument("preprocessing_option")
+    parser.add_argument("--write-mode", choices=["file", "incremental"], default=write_mode,
+                        help="file: one <name>_processed.parquet per input, incremental: append to datasets/<dataset>/")
+    parser.add_argument("--dedup-index", action="store_true", default=dedup_index,
+                        help="skip rows already appended to the dataset by earlier runs (incremental mode)")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="only report the planned schema, estimated rows and dropped columns, write nothing")
+    parser.add_argument("--preview-rows", type=int, default=preview_rows,
+                        help="rows to show from the written output, 0 to skip the preview")
+    parser.add_argument("--engine", choices=["auto", "spark", "local"], default=engine,
+                        help="auto: files up to ETL_LOCAL_ENGINE_MAX_MB run in-process with pyarrow, larger ones on Spark")
+    args = parser.parse_args(argv)
+    engine = args.engine
+    write_mode = args.write_mode
+    preview_rows = args.preview_rows
+    dedup_index = args.dedup_index
+
+    if args.dry_run:
+        statuses = [dry_run_file(name, args.preprocessing_option) for name in resolve_targets(args.targets)]
+    elif len(args.targets) == 1 and source_format(args.targets[0]):
+        statuses = [main(args.targets[0], args.preprocessing_option)]
     else:
-        print(f"File {file_name} is not a CSV file. Skipping.")
+        statuses = list(main_batch(args.targets, args.preprocessing_option).values())
+    return 1 if "failed" in statuses else 0
 
 if __name__ == "__main__":
-    # Read command-line arguments
-    if len(sys.argv) != 3:
-        print("Usage: python etl_pipeline.py <file_name> <preprocessing_option>")
-        sys.exit(1)
-    file_name = sys.argv[1]
-    preprocessing_option = sys.argv[2]
-    main(file_name, preprocessing_option)
+    # run on the module etl_local and etl_chunked import, so they see the settings the command line sets
+    import etl_pipeline
+    sys.exit(etl_pipeline.cli())
@@ -0,0 +1,256 @@
+# Vendored from Core DW Infrastructure/app/gold_jobs.py by scripts/sync_shared_modules.py, edit that file instead.
+import argparse
+import hashlib
+import json
+import os
+import re
+from datetime import datetime, timedelta
+import yaml
+import zone_maps
+from pyspark.sql.functions import col, lit, count, sum as sum_, avg, min as min_, max as max_, \
+    countDistinct, approx_count_distinct, date_trunc, to_date
+from etl_storage import get_spark, minio_client, destination_bucket, read_json_object, read_metadata_json, \
+    write_metadata_json, remove_objects
+from etl_leases import acquire_lease, release_lease
+
+# Gold layer: query-ready aggregates of silver data, declared per project in gold_rollups.yaml.
+# Every rollup is materialized as parquet in dw-bucket-gold/<project>/<rollup>/, partitioned by period
+# (the time column truncated to the rollup's grain). A run only recomputes the periods touched by silver
+# data that arrived since the previous run: the batches committed since then (_commits/ markers of the
+# incremental layout and of file mode outputs, compactions only move rows and are ignored) or, for other
+# silver directories, the parquet files written since then. Touched periods are recomputed from all silver rows of that period
+# and replace their gold partition, so measures that do not add up (avg, count_distinct) stay exact.
+# What has been applied is kept in _gold/<project>/<rollup>.json in the metadata bucket.
+#
+#   python gold_jobs.py                               update every rollup
+#   python gold_jobs.py --project project1 --rollup heart_monthly --full
+#   python gold_jobs.py --dry-run                     only list the periods that would be recomputed
+
+gold_bucket = "dw-bucket-gold"
+gold_state_prefix = "_gold/"  # in the metadata bucket
+rollups_config = os.getenv('GOLD_ROLLUPS_CONFIG', os.path.join(os.path.dirname(os.path.abspath(__file__)), "gold_rollups.yaml"))
+grains = ("day", "week", "month", "quarter", "year")
+aggregations = {
+    "count": count,
+    "sum": sum_,
+    "avg": avg,
+    "min": min_,
+    "max": max_,
+    "count_distinct": countDistinct,
+    "approx_count_distinct": approx_count_distinct,
+}
+measure_pattern = re.compile(r'^(\w+)\(\s*(\w*)\s*\)$')
+# commit markers this close to the newest applied one are remembered by batch id, a marker written just
+# before the newest one can show up in a later listing; older markers are behind the commits_through watermark
+commit_overlap_seconds = 300
+
+def load_rollups(config_path=rollups_config):
+    """Rollup definitions as {(project, rollup): definition}, checked for mistakes before anything runs."""
+    with open(config_path, "r") as f:
+        config = yaml.safe_load(f) or {}
+    rollups = {}
+    for project, project_rollups in config.items():
+        for name, definition in (project_rollups or {}).items():
+            if not definition.get("source") or not definition.get("time_column") or not definition.get("measures"):
+                raise ValueError(f"Rollup {project}/{name} needs a source, a time_column and measures")
+            if definition.get("grain", "day") not in grains:
+                raise ValueError(f"Rollup {project}/{name} has grain {definition['grain']}, expected one of {', '.join(grains)}")
+            for expression in definition["measures"].values():
+                parse_measure(expression)
+            rollups[(project, name)] = definition
+    return rollups
+
+def parse_measure(expression):
+    """Aggregation and column of a measure, "count" or e.g. "avg(age)"."""
+    match = measure_pattern.match(str(expression).strip())
+    aggregation, column = (match.group(1), match.group(2)) if match else (str(expression).strip(), "")
+    if aggregation not in aggregations:
+        raise ValueError(f"Unknown aggregation in measure '{expression}', expected one of {', '.join(aggregations)}")
+    if not column and aggregation != "count":
+        raise ValueError(f"Measure '{expression}' needs a column")
+    return aggregation, column
+
+def definition_hash(definition):
+    return hashlib.sha1(json.dumps(definition, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+
+def state_object_name(project, name):
+    return f"{gold_state_prefix}{project}/{name}.json"
+
+def ensure_gold_bucket():
+    if not minio_client.bucket_exists(gold_bucket):
+        minio_client.make_bucket(gold_bucket)
+        print(f"Created bucket {gold_bucket}")
+
+def silver_changes(source, state):
+    """Committed parquet files of a silver directory holding rows added since the state was saved, and the
+    state to save once they are applied: the newest commit marker applied (and the batch ids close to it)
+    for directories written with the commit protocol, else the newest modification time."""
+    markers = [obj for obj in minio_client.list_objects(destination_bucket, prefix=f"{source}/_commits/")
+               if obj.object_name.endswith('.json') and not obj.object_name.endswith('.pending.json')]
+    if markers:
+        applied = set(state.get("commits", [])) if state else set()
+        since = None
+        if state and state.get("commits_through"):
+            since = datetime.fromisoformat(state["commits_through"]) - timedelta(seconds=commit_overlap_seconds)
+        files, replaced_by = [], {}
+        for obj in markers:
+            if since is not None and obj.last_modified < since:
+                continue
+            batch_id = obj.object_name.rsplit('/', 1)[-1][:-len('.json')]
+            commit = read_json_object(destination_bucket, obj.object_name)
+            if commit is None:
+                continue
+            for name in commit.get("replaces", []):
+                replaced_by[name] = commit["files"]
+            if batch_id not in applied and not commit.get("compaction"):
+                files.extend(commit["files"])
+
+        # files compacted (or swapped) away since their batch committed: their rows are in the files that replaced them
+        current = set(zone_maps.list_data_files(minio_client, destination_bucket, source))
+        changed, seen = set(), set()
+        while files:
+            name = files.pop()
+            if name in seen:
+                continue
+            seen.add(name)
+            if name in current:
+                changed.add(name)
+            else:
+                files.extend(replaced_by.get(name, []))
+
+        newest = max(obj.last_modified for obj in markers)
+        recent = [obj.object_name.rsplit('/', 1)[-1][:-len('.json')] for obj in markers
+                  if (newest - obj.last_modified).total_seconds() <= commit_overlap_seconds]
+        return sorted(changed), {"commits_through": newest.isoformat(), "commits": sorted(recent)}
+
+    watermark = datetime.fromisoformat(state["watermark"]) if state and state.get("watermark") else None
+    files, newest = [], watermark
+    for obj in minio_client.list_objects(destination_bucket, prefix=f"{source}/", recursive=True):
+        relative = obj.object_name[len(source) + 1:]
+        if not obj.object_name.endswith('.parquet') or any(part.startswith(('_', '.')) for part in relative.split('/')):
+            continue
+        if watermark is None or obj.last_modified > watermark:
+            files.append(obj.object_name)
+        newest = obj.last_modified if newest is None else max(newest, obj.last_modified)
+    return files, {"watermark": newest.isoformat() if newest else None}
+
+def read_silver(source, project, files=None):
+    """Silver rows of a rollup's source (or only of some of its files, which must not be empty), limited to
+    the project where the source holds several (the project partition of the incremental layout). Only
+    committed files are read, a batch being appended or swapped in is left out until its commit marker is written."""
+    base_path = f"s3a://{destination_bucket}/{source}"
+    reader = get_spark().read.option("basePath", base_path)  # keeps partition columns when files are listed
+    if files is None:
+        files = sorted(zone_maps.list_data_files(minio_client, destination_bucket, source))
+    df = reader.parquet(*[f"s3a://{destination_bucket}/{name}" for name in files])
+    if "project" in df.columns:
+        df = df.filter(col("project") == lit(project))
+    return df
+
+def with_period(df, definition):
+    return df.withColumn("period", to_date(date_trunc(definition.get("grain", "day"), col(definition["time_column"]))))
+
+def touched_periods(source, project, definition, files):
+    if not files:
+        return []
+    rows = with_period(read_silver(source, project, files), definition).select("period").distinct().collect()
+    return sorted(row["period"] for row in rows if row["period"] is not None)
+
+def aggregate(df, definition):
+    measures = []
+    for name, expression in definition["measures"].items():
+        aggregation, column = parse_measure(expression)
+        measures.append(aggregations[aggregation](col(column) if column else lit(1)).alias(name))
+    return df.groupBy("period", *definition.get("group_by", [])).agg(*measures)
+
+def remove_gold_periods(output_dir, periods):
+    """Delete the gold partitions of periods that no longer have any silver rows."""
+    for period in periods:
+        prefix = f"{output_dir}/period={period.isoformat()}/"
+        remove_objects(gold_bucket, [obj.object_name for obj in minio_client.list_objects(gold_bucket, prefix=prefix, recursive=True)])
+
+def run_rollup(project, name, definition, full=False, dry_run=False):
+    """Bring one rollup up to date, returns the number of periods written."""
+    output_dir = f"{project}/{name}"
+    state = read_metadata_json(state_object_name(project, name))
+    rebuild = full or state is None or state.get("definition") != definition_hash(definition)
+    # taken before reading silver, data arriving during the run is applied (again) by the next run
+    files, new_state = silver_changes(definition["source"], None if rebuild else state)
+    new_state.update({"definition": definition_hash(definition), "updated_at": datetime.now().isoformat()})
+    if not files and not rebuild:
+        print(f"{output_dir}: no new silver data")
+        return 0
+
+    if rebuild:
+        periods = None
+        print(f"{output_dir}: {'would rebuild' if dry_run else 'rebuilding'} every period")
+    else:
+        periods = touched_periods(definition["source"], project, definition, files)
+        print(f"{output_dir}: {'would recompute' if dry_run else 'recomputing'} {len(periods)} period(s) "
+              f"touched by {len(files)} new silver file(s): {', '.join(p.isoformat() for p in periods)}")
+    if dry_run:
+        return len(periods) if periods is not None else 0
+    if periods == []:
+        write_metadata_json(state_object_name(project, name), new_state)
+        return 0
+    if periods:
+        # the zone maps skip silver files that end before the first touched period, the filter on the time
+        # column prunes partitions and row groups of the rest, the period filter keeps only touched periods
+        source_files, total_files = zone_maps.select_files(
+            minio_client, destination_bucket, definition["source"], [(definition["time_column"], ">=", periods[0].isoformat()), ("project", "=", project)])
+        print(f"{output_dir}: reading {len(source_files)} of {total_files} silver file(s)")
+        if not source_files:
+            remove_gold_periods(output_dir, periods)
+            write_metadata_json(state_object_name(project, name), new_state)
+            return 0
+        source_df = with_period(read_silver(definition["source"], project, source_files), definition) \
+            .filter((col(definition["time_column"]) >= lit(periods[0])) & col("period").isin(periods))
+    else:
+        source_df = with_period(read_silver(definition["source"], project), definition)
+
+    ensure_gold_bucket()
+    result = aggregate(source_df, definition).repartition("period").persist()
+    writer = result.write.partitionBy("period")
+    if rebuild:
+        writer.mode("overwrite").parquet(f"s3a://{gold_bucket}/{output_dir}")
+    else:
+        # dynamic overwrite only replaces the partitions of the periods written
+        writer.mode("overwrite").option("partitionOverwriteMode", "dynamic").parquet(f"s3a://{gold_bucket}/{output_dir}")
+    written = {row["period"] for row in result.select("period").distinct().collect()}
+    result.unpersist()
+    if not rebuild:
+        remove_gold_periods(output_dir, [period for period in periods if period not in written])
+
+    write_metadata_json(state_object_name(project, name), new_state)
+    print(f"{output_dir}: wrote {len(written)} period(s) to {gold_bucket}/{output_dir}")
+    return len(written)
+
+def run_rollups(project=None, rollup=None, full=False, dry_run=False, config_path=rollups_config):
+    """Update every rollup (or the selected ones), returns the number that failed."""
+    failed = 0
+    for (rollup_project, name), definition in sorted(load_rollups(config_path).items()):
+        if (project and rollup_project != project) or (rollup and name != rollup):
+            continue
+        lease = None if dry_run else acquire_lease(f"{gold_state_prefix}{rollup_project}/{name}")
+        if not dry_run and lease is None:
+            print(f"{rollup_project}/{name} is being updated by another run, skipping")
+            continue
+        try:
+            run_rollup(rollup_project, name, definition, full, dry_run)
+        except Exception as e:
+            print(f"Failed to update rollup {rollup_project}/{name}: {e}")
+            failed += 1
+        finally:
+            release_lease(lease)
+    return failed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Materialize the gold-layer rollups from silver")
+    parser.add_argument("--project", help="only the rollups of this project")
+    parser.add_argument("--rollup", help="only the rollup with this name")
+    parser.add_argument("--full", action="store_true", help="recompute every period instead of the touched ones")
+    parser.add_argument("--dry-run", action="store_true", help="only list the periods that would be recomputed")
+    parser.add_argument("--config", default=rollups_config, help="rollup definitions (YAML)")
+    args = parser.parse_args()
+
+    raise SystemExit(1 if run_rollups(args.project, args.rollup, args.full, args.dry_run, args.config) else 0)
@@ -0,0 +1,141 @@
+# Vendored from Core DW Infrastructure/app/ml_state.py by scripts/sync_shared_modules.py, edit that file instead.
+import math
+
+# Mergeable per-dataset statistics for the "Preprocessing for Machine Learning" option.
+# Every numeric column keeps Welford-style moments of its observed values (count, mean, M2),
+# the number of missing values and a t-digest (a list of [mean, weight] centroids) for the median.
+# The state of a batch is merged into the dataset state with Chan's parallel update, so the
+# statistics of a dataset do not depend on how its rows were split over files. Plain dicts and
+# lists keep the state JSON-serialisable for the metadata bucket.
+
+digest_compression = 200  # more centroids is a more accurate median, 200 stays a few KB per column
+sketch_points = 100  # quantile points taken from a batch to build its digest
+
+def sketch_quantiles():
+    """Quantile levels sampled from a batch, the midpoints of sketch_points equal-weight bins."""
+    return [(idx + 0.5) / sketch_points for idx in range(sketch_points)]
+
+def column_sketch(count, missing, mean, m2, quantile_values, integral):
+    """State of one column for one batch: its moments plus a digest of equal-weight centroids
+    at the given quantile values (count / len(quantile_values) rows each)."""
+    values = [value for value in quantile_values if value is not None and not math.isnan(value)]
+    weight = count / len(values) if values else 0
+    return {
+        "count": count,
+        "missing": missing,
+        "mean": mean if count else 0.0,
+        "m2": m2 if count > 1 else 0.0,
+        "integral": integral,
+        "centroids": compress_digest([[value, weight] for value in values]) if count else [],
+    }
+
+def k_scale(q):
+    """t-digest k1 scale function: centroids near the tails stay small, near the median they may grow."""
+    return digest_compression / (2 * math.pi) * math.asin(2 * min(max(q, 0.0), 1.0) - 1)
+
+def compress_digest(centroids):
+    """Merge neighbouring centroids as long as each one spans at most one unit of k_scale."""
+    centroids = sorted((c for c in centroids if c[1] > 0), key=lambda c: c[0])
+    total = sum(weight for _, weight in centroids)
+    if not centroids:
+        return []
+    merged = [list(centroids[0])]
+    cumulative = 0.0  # weight before the last merged centroid
+    for value, weight in centroids[1:]:
+        last = merged[-1]
+        if k_scale((cumulative + last[1] + weight) / total) - k_scale(cumulative / total) <= 1:
+            combined = last[1] + weight
+            last[0] += (value - last[0]) * weight / combined
+            last[1] = combined
+        else:
+            cumulative += last[1]
+            merged.append([value, weight])
+    return merged
+
+def digest_quantile(centroids, q):
+    """Quantile of a digest, interpolating between the centres of neighbouring centroids."""
+    if not centroids:
+        return None
+    total = sum(weight for _, weight in centroids)
+    target = q * total
+    cumulative = 0.0
+    previous_center, previous_value = None, None
+    for value, weight in centroids:
+        center = cumulative + weight / 2
+        if target <= center:
+            if previous_center is None:
+                return value
+            fraction = (target - previous_center) / (center - previous_center)
+            return previous_value + fraction * (value - previous_value)
+        previous_center, previous_value = center, value
+        cumulative += weight
+    return centroids[-1][0]
+
+def merge_column_state(left, right):
+    """Combine two column states, as if their rows had been measured together."""
+    count = left["count"] + right["count"]
+    if not left["count"] or not right["count"]:
+        mean, m2 = (left["mean"], left["m2"]) if left["count"] else (right["mean"], right["m2"])
+    else:
+        delta = right["mean"] - left["mean"]
+        mean = left["mean"] + delta * right["count"] / count
+        m2 = left["m2"] + right["m2"] + delta ** 2 * left["count"] * right["count"] / count
+    return {
+        "count": count,
+        "missing": left["missing"] + right["missing"],
+        "mean": mean,
+        "m2": m2,
+        "integral": left["integral"] and right["integral"],
+        "centroids": compress_digest(left["centroids"] + right["centroids"]),
+    }
+
+def merge_state(state, sketch):
+    """Merge a batch sketch ({column: column state}) into a dataset state (None for a new dataset)."""
+    columns = dict(state["columns"]) if state else {}
+    for column, column_state in sketch.items():
+        columns[column] = merge_column_state(columns[column], column_state) if column in columns else column_state
+    return {"columns": columns, "sources": list(state["sources"]) if state else []}
+
+def filled_statistics(count, observed_mean, observed_m2, total, median_value):
+    """Mean and stddev of a column after its (total - count) missing values are filled with the median."""
+    filled = total - count
+    mean_value = (count * observed_mean + filled * median_value) / total
+    m2 = observed_m2 + (observed_mean - median_value) ** 2 * count * filled / total
+    stddev_value = math.sqrt(m2 / (total - 1)) if total > 1 else None
+    return mean_value, stddev_value
+
+def scaling_from_state(state):
+    """Median, mean and stddev to scale with, in the layout of etl_pipeline.fit_ml_statistics."""
+    statistics = {}
+    for column, column_state in state["columns"].items():
+        if not column_state["count"]:
+            continue
+        median_value = digest_quantile(column_state["centroids"], 0.5)
+        if column_state["integral"]:
+            median_value = int(round(median_value))
+        total = column_state["count"] + column_state["missing"]
+        mean_value, stddev_value = filled_statistics(
+            column_state["count"], column_state["mean"], column_state["m2"], total, median_value)
+        statistics[column] = {"median": median_value, "mean": mean_value, "stddev": stddev_value, "count": total}
+    return statistics
+
+def scaling_drift(scaling, state):
+    """How far the scaling in use is from the statistics of all the data seen since, per column:
+    the shift of mean and median in units of the scaling stddev and the relative change of the stddev."""
+    current = scaling_from_state(state)
+    drift = {}
+    for column, fitted in current.items():
+        used = scaling.get(column)
+        if used is None or not used["stddev"]:
+            drift[column] = {"mean_shift": None, "median_shift": None, "stddev_change": None, "drift": math.inf}
+            continue
+        mean_shift = abs(fitted["mean"] - used["mean"]) / used["stddev"]
+        median_shift = abs(fitted["median"] - used["median"]) / used["stddev"]
+        stddev_change = abs((fitted["stddev"] or 0.0) / used["stddev"] - 1)
+        drift[column] = {
+            "mean_shift": mean_shift,
+            "median_shift": median_shift,
+            "stddev_change": stddev_change,
+            "drift": max(mean_shift, median_shift, stddev_change),
+        }
+    return drift
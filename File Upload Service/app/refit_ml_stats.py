@@ -0,0 +1,68 @@
+# Vendored from Core DW Infrastructure/app/refit_ml_stats.py by scripts/sync_shared_modules.py, edit that file instead.
+import argparse
+import sys
+import ml_state
+import etl_pipeline
+from etl_storage import source_bucket, read_metadata_json
+
+# Refits the scaling of a dataset in the incremental ML statistics mode (ETL_INCREMENTAL_ML_STATS=true).
+# New files are scaled with the dataset's stored scaling while its statistics state keeps merging every
+# row seen. This compares the two and, when a column has drifted past the threshold (shift of mean or
+# median in stddevs, or relative change of the stddev), stores the scaling of the whole state and
+# reprocesses every file of the dataset so silver is scaled consistently again.
+#
+#   python refit_ml_stats.py project1/heart              report the drift, refit if above the threshold
+#   python refit_ml_stats.py project1/heart --dry-run    only report
+#   python refit_ml_stats.py project1/heart --force
+
+drift_threshold = 0.1
+
+def report_drift(drift):
+    for column, values in sorted(drift.items()):
+        if values["mean_shift"] is None:
+            print(f"{column}: not in the stored scaling")
+            continue
+        print(f"{column}: mean shift {values['mean_shift']:.3f}, median shift {values['median_shift']:.3f}, "
+              f"stddev change {values['stddev_change']:.3f}")
+
+def refit_dataset(dataset, threshold=drift_threshold, force=False, dry_run=False):
+    """Refit and reprocess a dataset when it drifted, returns the number of files that failed."""
+    state = read_metadata_json(etl_pipeline.ml_state_object_name(dataset))
+    if state is None:
+        print(f"No ML statistics state for dataset {dataset}, run the ETL with ETL_INCREMENTAL_ML_STATS=true first")
+        return 1
+    document = read_metadata_json(etl_pipeline.ml_stats_object_name(dataset))
+    drift = ml_state.scaling_drift(document["columns"] if document else {}, state)
+    report_drift(drift)
+    largest = max((values["drift"] for values in drift.values()), default=0.0)
+    if largest < threshold and not force:
+        print(f"Largest drift {largest:.3f} is below {threshold}, keeping the current scaling")
+        return 0
+    if dry_run:
+        print(f"Largest drift {largest:.3f}, would refit and reprocess {len(state['sources'])} files")
+        return 0
+    if etl_pipeline.write_mode != "file":
+        print("Refitting reprocesses files in place, which needs the file write mode")
+        return 1
+
+    etl_pipeline.save_ml_statistics(state["sources"][0], ml_state.scaling_from_state(state))
+    etl_pipeline.incremental_ml_stats = True
+    etl_pipeline.ml_state_updates = False  # the files are already counted in the state
+    failed = 0
+    for file_name in state["sources"]:
+        if not etl_pipeline.is_file_in_bucket(source_bucket, file_name):
+            print(f"{file_name} is no longer in {source_bucket}, its silver output keeps the old scaling")
+            continue
+        if etl_pipeline.process_file(file_name, "Preprocessing for Machine Learning", force=True) == "failed":
+            failed += 1
+    print(f"Refitted dataset {dataset}, reprocessed {len(state['sources'])} files ({failed} failed)")
+    return failed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Refit the ML scaling of a dataset when its statistics drifted")
+    parser.add_argument("dataset", help="dataset name, the bronze object name without extension and date, e.g. project1/heart")
+    parser.add_argument("--threshold", type=float, default=drift_threshold)
+    parser.add_argument("--force", action="store_true", help="refit even below the threshold")
+    parser.add_argument("--dry-run", action="store_true", help="only report the drift")
+    args = parser.parse_args()
+    sys.exit(1 if refit_dataset(args.dataset, args.threshold, args.force, args.dry_run) else 0)
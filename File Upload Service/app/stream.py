@@ -10,7 +10,7 @@ pipe = pipeline(config)
 
 st.title("Configurable Data Preprocessing Pipeline")
 
-uploaded_file = st.file_uploader("Upload your file must be (CSV or JSON)", type=["csv", "json"])
+uploaded_file = st.file_uploader("Upload your file must be (CSV, JSON, Parquet or Feather)", type=["csv", "json", "parquet", "feather", "arrow"])
 
 if uploaded_file:
     file = os.path.join("temp", uploaded_file.name)
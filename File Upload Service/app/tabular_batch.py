@@ -0,0 +1,180 @@
+import argparse
+import glob
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+import pyarrow as pa
+import yaml
+import tabular_pipeline
+
+# Batch runner for the configurable preprocessing pipeline: applies one config to every file matched by a glob
+# or listed in a manifest, on a pool of processes (one per core by default). Every file is processed with its
+# own pipeline, so its own fitted StandardScaler, and gets its own log. The encoding dictionaries are shared
+# through their folder, a label gets the same code in every file. A file that fails is reported in the summary
+# and the others carry on. A worker that dies (killed for running out of memory, a crash in native code) breaks
+# the whole pool: the files that had not finished are run again on a new pool, and a file that was unfinished
+# in pool_breaks_before_alone broken pools is then run alone, each on a fresh ProcessPoolExecutor of its own, so
+# only the file that kills its worker fails. The summary lists the files run alone (run_alone).
+#
+#   python tabular_batch.py "devices/**/*.csv"
+#   python tabular_batch.py --manifest files.txt --workers 8 --summary batch_summary.json
+#
+# Outputs keep the folders below the common folder of the inputs: devices/a/x.csv and devices/b/x.csv
+# are written to cleaned_files/a/ and cleaned_files/b/.
+
+pool_breaks_before_alone = 2
+
+
+def read_manifest(manifest):
+    """Paths listed one per line, relative ones are relative to the manifest. Blank lines and # comments are skipped."""
+    base = os.path.dirname(os.path.abspath(manifest))
+    with open(manifest, "r") as f:
+        lines = [line.strip() for line in f]
+    return [os.path.join(base, line) for line in lines if line and not line.startswith("#")]
+
+
+def resolve_inputs(patterns=(), manifest=None):
+    """The files matched by the glob patterns (** matches folders recursively) and listed in the manifest, each once."""
+    files = []
+    for pattern in patterns:
+        matches = sorted(name for name in glob.glob(pattern, recursive=True) if os.path.isfile(name))
+        if not matches:
+            print(f"No files match {pattern}")
+        files.extend(matches)
+    if manifest:
+        files.extend(read_manifest(manifest))
+    return list(dict.fromkeys(os.path.abspath(name) for name in files))
+
+
+def output_dirs(input_files, output_dir):
+    #output_dir plus the folder of every file relative to the common folder of all of them
+    root = os.path.commonpath([os.path.dirname(name) for name in input_files])
+    return {name: os.path.normpath(os.path.join(output_dir, os.path.relpath(os.path.dirname(name), root)))
+            for name in input_files}
+
+
+def init_worker():
+    #one Arrow thread per process, the pool already keeps every core busy with a file
+    pa.set_cpu_count(1)
+
+
+def process_file(config, input_file, output_dir):
+    """Run the pipeline on one file in a worker process. Returns its result, errors included, instead of raising."""
+    started = time.time()
+    result = {"input_file": input_file, "output_file": None, "status": "failed", "error": None}
+    with tabular_pipeline.run_log() as logs:
+        try:
+            result["output_file"], _ = tabular_pipeline.pipeline(config).run(input_file, output_dir=output_dir)
+            result["status"] = "processed"
+        except Exception as e:
+            tabular_pipeline.logger.error(f"Failed to process {input_file}: {e}")
+            result["error"] = str(e)
+    result["seconds"] = round(time.time() - started, 3)
+    result["logs"] = logs.getvalue()
+    return result
+
+
+def worker_failed(input_file, error):
+    return {"input_file": input_file, "output_file": None, "status": "failed",
+            "error": f"worker failed: {error}", "seconds": None, "logs": ""}
+
+
+def run_batch(input_files, config, workers=None, output_dir="cleaned_files", progress=None):
+    """Process input_files with config on a pool of workers processes, one per core by default.
+    progress(done, total, result) is called as every file finishes. Returns the summary of the batch:
+    the totals, the files run alone and the result (status, output file, error, seconds and log) of every file."""
+    tabular_pipeline.pipeline(config)  #a config error stops the batch before any file is started
+    workers = max(1, min(workers or os.cpu_count() or 1, len(input_files)))
+    targets = output_dirs(input_files, output_dir) if input_files else {}
+    #sizes are taken once, a file deleted during the batch fails in its worker instead of breaking the sort
+    sizes = {name: os.path.getsize(name) if os.path.isfile(name) else 0 for name in input_files}
+    #largest files first, so a large file does not start last and keep the batch waiting on one worker
+    pending = sorted(input_files, key=sizes.get, reverse=True)
+
+    started = time.time()
+    results = []
+    breaks = {}  #how many broken pools every file was unfinished in
+    run_alone = []
+    while pending:
+        pending.sort(key=sizes.get, reverse=True)
+        shared = [name for name in pending if breaks.get(name, 0) < pool_breaks_before_alone]
+        alone = [name for name in pending if name not in shared]
+        run_alone.extend(alone)
+        pools = ([shared] if shared else []) + [[name] for name in alone]
+        pending = []
+        for names in pools:
+            with ProcessPoolExecutor(max_workers=min(workers, len(names)), initializer=init_worker) as pool:
+                futures = {pool.submit(process_file, config, name, targets[name]): name for name in names}
+                for future in as_completed(futures):
+                    name = futures[future]
+                    try:
+                        result = future.result()
+                    except BrokenProcessPool as e:
+                        breaks[name] = breaks.get(name, 0) + 1
+                        if len(names) > 1:
+                            pending.append(name)  #maybe killed with the worker of another file, run again
+                            continue
+                        result = worker_failed(name, e)
+                    except Exception as e:
+                        result = worker_failed(name, e)
+                    results.append(result)
+                    if progress:
+                        progress(len(results), len(input_files), result)
+            if pending:
+                print(f"A worker died, running {len(pending)} unfinished file(s) again on a new pool", flush=True)
+    wall_seconds = time.time() - started
+
+    processed = sum(1 for result in results if result["status"] == "processed")
+    input_mb = sum(sizes.values()) / (1024 * 1024)
+    return {
+        "files": len(results),
+        "processed": processed,
+        "failed": len(results) - processed,
+        "workers": workers,
+        "wall_seconds": round(wall_seconds, 3),
+        "files_per_second": round(len(results) / wall_seconds, 2) if wall_seconds else None,
+        "input_mb": round(input_mb, 1),
+        "mb_per_second": round(input_mb / wall_seconds, 2) if wall_seconds else None,
+        "run_alone": sorted(run_alone),  #files that broke shared pools, each run on a fresh pool of its own
+        "results": sorted(results, key=lambda result: result["input_file"]),
+    }
+
+
+def print_progress(done, total, result):
+    error = f": {result['error']}" if result["error"] else ""
+    seconds = f" in {result['seconds']:.1f}s" if result["seconds"] is not None else ""
+    print(f"[{done}/{total}] {result['status']} {result['input_file']}{seconds}{error}", flush=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the preprocessing pipeline on many files in parallel")
+    parser.add_argument("patterns", nargs="*", help='files or glob patterns such as "devices/**/*.csv"')
+    parser.add_argument("--manifest", help="text file listing one input file per line")
+    parser.add_argument("--config", default="config.yaml", help="pipeline configuration")
+    parser.add_argument("--workers", type=int, help="worker processes, one per core by default")
+    parser.add_argument("--output-dir", default="cleaned_files", help="folder of the processed files")
+    parser.add_argument("--summary", help="also save the summary with the log of every file as JSON")
+    args = parser.parse_args()
+
+    with open(args.config, "r") as f:
+        batch_config = yaml.safe_load(f)
+    input_files = resolve_inputs(args.patterns, args.manifest)
+    if not input_files:
+        parser.error("no input files, give glob patterns or --manifest")
+
+    print(f"Processing {len(input_files)} file(s)")
+    summary = run_batch(input_files, batch_config, args.workers, args.output_dir, print_progress)
+    print(f"{summary['processed']} processed, {summary['failed']} failed in {summary['wall_seconds']:.1f}s "
+          f"on {summary['workers']} worker(s): {summary['files_per_second']} files/s, {summary['mb_per_second']} MB/s")
+    for name in summary["run_alone"]:
+        print(f"  run alone on a new pool after {pool_breaks_before_alone} broken pools: {name}")
+    for result in summary["results"]:
+        if result["status"] != "processed":
+            print(f"  failed {result['input_file']}: {result['error']}")
+    if args.summary:
+        with open(args.summary, "w") as f:
+            json.dump(summary, f, indent=2)
+        print(f"Summary saved to {args.summary}")
+    raise SystemExit(1 if summary["failed"] else 0)
\ No newline at end of file
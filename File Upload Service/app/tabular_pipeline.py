@@ -1,10 +1,18 @@
 import pandas as pd
+import numpy as np
+import fcntl
+import json
+import pyarrow as pa
+import pyarrow.parquet as pq
 import yaml
 import os
 import logging
+import time
+from contextlib import contextmanager, nullcontext
 from io import StringIO
 from datetime import datetime
-from sklearn.preprocessing import StandardScaler, LabelEncoder
+from urllib.parse import quote
+from sklearn.preprocessing import StandardScaler
 
 
 with open("config.yaml", "r") as f:
@@ -19,136 +27,729 @@ logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 logger.addHandler(sh)
 
+#streaming mode: files of at least stream_min_mb are processed in chunks of chunksize rows (see READCONFIG.md)
+default_chunksize = 100000
+default_stream_min_mb = 256
+
+
+@contextmanager
+def quiet():
+    """Only log warnings, the streaming mode logs the steps of its first chunk and not of every other one."""
+    level = logger.level
+    logger.setLevel(logging.WARNING)
+    try:
+        yield
+    finally:
+        logger.setLevel(level)
+
+
+@contextmanager
+def run_log():
+    """Collect what is logged during one run, so every run (and every file of a batch) gets only its own log."""
+    buffer = StringIO()
+    handler = logging.StreamHandler(buffer)
+    handler.setLevel(logging.INFO)
+    logger.addHandler(handler)
+    try:
+        yield buffer
+    finally:
+        logger.removeHandler(handler)
+
+
+def is_json_lines(file_name):
+    """True for JSON files with one record per line, a single JSON array cannot be read in chunks."""
+    with open(file_name, "r") as f:
+        while True:
+            char = f.read(1)
+            if not char:
+                return False
+            if not char.isspace():
+                return char != "["
+
+
+def common_dtype(left, right):
+    #dtype that holds the values of two chunks of a column: the wider number type, else object (strings)
+    if left == right:
+        return left
+    if all(np.issubdtype(dtype, np.number) for dtype in (left, right)):
+        return np.result_type(left, right)
+    return np.dtype(object)
+
+
+def label_values(values):
+    """The labels of a column to encode: its values as strings, missing values as "nan". Whole floats lose
+    their ".0", so a value gets the same label (and code) whether its column was read as int or float,
+    e.g. a CSV column of ids with a missing value."""
+    labels = values.astype(str)
+    if pd.api.types.is_float_dtype(values.dtype):
+        numbers = values.astype("float64")
+        whole = (numbers % 1 == 0) & (numbers.abs() < 2 ** 53)
+        labels[whole] = numbers[whole].astype("int64").astype(str)
+    return labels.where(values.notna(), "nan")
+
+
+def merge_dtypes(dtypes, chunk):
+    """Merge the dtypes of a chunk into dtypes with common_dtype, returns the columns that have become object
+    (strings) while a chunk held something else in them."""
+    mixed = []
+    for col, dtype in chunk.dtypes.items():
+        merged = common_dtype(dtypes[col], dtype) if col in dtypes else dtype
+        if merged == object and (dtypes.get(col, dtype) != object or dtype != object):
+            mixed.append(col)
+        dtypes[col] = merged
+    return mixed
+
+
+def write_frame(df, output_file, end, compression):
+    if end == ".csv":
+        df.to_csv(output_file, index=False)
+    elif end == ".json":
+        df.to_json(output_file, orient="records")
+    elif end == ".parquet":
+        df.to_parquet(output_file, index=False, compression=compression)
+    else:
+        df.reset_index(drop=True).to_feather(output_file, compression=compression)
+
+
+def arrow_chunks(file_name, chunksize, columns, file):
+    #tables of up to chunksize rows of a Parquet or Feather file, only with the given columns
+    if file == "parquet":
+        for batch in pq.ParquetFile(file_name).iter_batches(batch_size=chunksize, columns=columns):
+            yield pa.Table.from_batches([batch])
+        return
+    with pa.memory_map(file_name) as source:
+        reader = pa.ipc.open_file(source)
+        for idx in range(reader.num_record_batches):
+            table = pa.Table.from_batches([reader.get_batch(idx)]).select(columns)
+            for offset in range(0, table.num_rows, chunksize):
+                yield table.slice(offset, chunksize)
+
+
+def median_from_counts(counts):
+    """Median of the values counted in counts (value -> occurrences), as Series.median gives it."""
+    counts = counts[counts > 0].sort_index()
+    total = int(counts.sum())
+    if total == 0:
+        return np.nan
+    cumulative = counts.cumsum().to_numpy()
+    values = counts.index.to_numpy()
+    lower = values[np.searchsorted(cumulative, (total + 1) // 2)]
+    upper = values[np.searchsorted(cumulative, total // 2 + 1)]
+    return (lower + upper) / 2
+
+
+class Moments:
+    """Count, mean and sum of squared deviations of a column, merged chunk by chunk."""
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, count, mean, m2):
+        if count == 0:
+            return
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.count = total
+
+    def update(self, values):
+        values = values.dropna().astype(float)
+        if len(values):
+            mean = values.mean()
+            self.add(len(values), mean, float(((values - mean) ** 2).sum()))
+
+    def add_weighted(self, values, weights):
+        count = weights.sum()
+        if count:
+            mean = np.average(values, weights=weights)
+            self.add(count, mean, float((weights * (values - mean) ** 2).sum()))
+
+    def variance(self):
+        #population variance, as StandardScaler uses
+        return self.m2 / self.count if self.count else np.nan
+
+
+def row_hashes(df):
+    """64-bit hash of every row of df. Whole numbers hash alike in int and float columns, so a column read as int
+    in one chunk and as float in another (a missing value) keeps the hashes of its rows, as duplicated() does."""
+    columns = {}
+    for idx, (col, values) in enumerate(df.items()):
+        if isinstance(values.dtype, np.dtype) and values.dtype.kind in "iu":
+            values = values.to_numpy().view("u8")
+        elif isinstance(values.dtype, np.dtype) and values.dtype.kind == "f":
+            numbers = values.to_numpy(dtype="float64")
+            whole = (numbers % 1 == 0) & (np.abs(numbers) < 2 ** 63)
+            values = numbers.view("u8").copy()
+            values[whole] = numbers[whole].astype("int64").view("u8")
+        columns[idx] = values
+    return pd.util.hash_pandas_object(pd.DataFrame(columns, index=df.index), index=False).to_numpy()
+
+
+class SeenRows:
+    """Hashes of the rows kept so far, for drop_duplicates across chunks. Kept as sorted uint64 runs that
+    are merged as they grow, so a lookup only checks a few runs and a row takes 8 bytes."""
+    def __init__(self):
+        self.runs = []
+
+    def contains(self, hashes):
+        found = np.zeros(len(hashes), dtype=bool)
+        for run in self.runs:
+            positions = np.searchsorted(run, hashes).clip(max=len(run) - 1)
+            found |= run[positions] == hashes
+        return found
+
+    def add(self, hashes):
+        if len(hashes):
+            self.runs.append(np.unique(hashes))
+        while len(self.runs) > 1 and len(self.runs[-1]) >= len(self.runs[-2]):
+            self.runs[-2:] = [np.union1d(self.runs[-2], self.runs[-1])]
+
+    def new_rows(self, df):
+        """Mask of the rows of df not seen before (first occurrences only), which are then recorded."""
+        hashes = row_hashes(df)
+        mask = ~self.contains(hashes) & ~pd.Series(hashes).duplicated().to_numpy()
+        self.add(hashes[mask])
+        return mask
+
+conversion_types = {"int": int, "float": float, "str": str, "datetime": None}
+#file types read by extension when file_type is empty, feather is the Arrow IPC file format
+input_extensions = {".csv": "csv", ".json": "json", ".jsonl": "json", ".parquet": "parquet", ".pq": "parquet",
+                    ".feather": "feather", ".arrow": "feather"}
+output_extensions = {"parquet": ".parquet", "feather": ".feather", "csv": ".csv", "json": ".json"}
+feather_compressions = ("zstd", "lz4", "uncompressed")
+sections = ("cleaning", "transformation", "validation")
+
+
+class Step:
+    """One operation of a compiled plan: fn(df, stats) returns the new frame, columns must be in the data."""
+    def __init__(self, section, name, detail, fn, columns=()):
+        self.section = section
+        self.name = name
+        self.detail = detail
+        self.fn = fn
+        self.columns = columns
+
+
+class DictionaryStore:
+    """Append-only label dictionaries of the encoded columns, a JSON file per column in directory.
+    The code of a label is its position, so a column is encoded the same way in every file and run and
+    new labels only ever get new codes. Dictionaries are extended under a lock and replaced atomically,
+    so the processes of a batch can share a store."""
+    def __init__(self, directory):
+        self.directory = directory
+        self.labels = {}
+
+    def path(self, column):
+        return os.path.join(self.directory, f"{quote(str(column), safe='')}.json")
+
+    def load(self, column):
+        try:
+            with open(self.path(column), "r") as f:
+                return json.load(f)["labels"]
+        except FileNotFoundError:
+            return []
+
+    def extend(self, column, labels):
+        """The labels of column, with those of labels it does not have yet appended in sorted order."""
+        known = self.labels.get(column)
+        if known is not None and not (known.get_indexer(labels) == -1).any():
+            return known
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, ".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            current = self.load(column)  #other processes may have added labels since it was read
+            new = sorted(set(labels).difference(current))
+            if new:
+                current = current + new
+                temp = f"{self.path(column)}.{os.getpid()}.tmp"
+                with open(temp, "w") as f:
+                    json.dump({"column": column, "labels": current}, f)
+                os.replace(temp, self.path(column))
+                logger.info(f"Added {len(new)} new label(s) to the dictionary of {column}")
+        self.labels[column] = pd.Index(current, dtype=object)
+        return self.labels[column]
+
+
+class ChunkWriter:
+    """Appends the chunks of the streaming mode to one output file, in any of the output formats."""
+    def __init__(self, output_file, end, compression):
+        self.output_file = output_file
+        self.end = end
+        self.compression = compression
+        self.chunks = 0
+        self.rows = 0
+        self.out = None
+        self.writer = None
+        self.schema = None
+        self.last = None
+        if end in (".csv", ".json"):
+            self.out = open(output_file, "w", newline="")
+            if end == ".json":
+                self.out.write("[")
+
+    def write(self, chunk):
+        if self.end == ".csv":
+            chunk.to_csv(self.out, index=False, header=self.chunks == 0)
+        elif self.end == ".json":
+            if len(chunk):
+                #the records of the chunk without the enclosing [ ]
+                self.out.write(("," if self.rows else "") + chunk.to_json(orient="records")[1:-1])
+        elif len(chunk):
+            #later chunks are cast to the types of the first one
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if self.writer is None:
+                #a column with no values in the first chunk has the null type, it is written as strings (what
+                #an object column with values is) so that later chunks with values fit the file's schema
+                self.schema = pa.schema([field.with_type(pa.string()) if pa.types.is_null(field.type) else field
+                                         for field in table.schema], metadata=table.schema.metadata)
+                if self.end == ".parquet":
+                    self.writer = pq.ParquetWriter(self.output_file, self.schema, compression=self.compression)
+                else:
+                    compression = None if self.compression == "uncompressed" else self.compression
+                    self.writer = pa.ipc.new_file(self.output_file, self.schema, options=pa.ipc.IpcWriteOptions(compression=compression))
+            self.writer.write_table(table.cast(self.schema))
+        self.last = chunk
+        self.chunks += 1
+        self.rows += len(chunk)
+
+    def close(self):
+        if self.out is not None:
+            if self.end == ".json":
+                self.out.write("]")
+            self.out.close()
+        elif self.writer is not None:
+            self.writer.close()
+        elif self.last is not None:
+            write_frame(self.last, self.output_file, self.end, self.compression)  #no rows were kept
+
+
 #defining the pipeline procedure
 class pipeline:
     def __init__(self, config):
         self.config = config
-        self.scale = StandardScaler()
-        self.le = LabelEncoder()
+        self.scale = None  #StandardScaler fitted by the last whole-file run, the streaming mode has the one of stream_statistics
+        self.compile()
+        self.dictionaries = DictionaryStore(self.dictionary_dir)
+
+    def compile(self):
+        """Check the config once and turn it into self.plan, the steps of every section in order.
+        Operations of the same kind run as one vectorized call: dropna and drop_duplicates as one row filter,
+        every fillna as one fillna with a dict and the dtype conversions as one astype with a mapping."""
+        tabular = self.config["tabular"]
+        preprocessing = tabular["preprocessing"]
+        cleaning = preprocessing.get("cleaning") or {}
+        transformation = preprocessing.get("transformation") or {}
+        validation = preprocessing.get("validation") or {}
+
+        self.format = (tabular.get("file_type") or "").lower() or None
+        if self.format and self.format not in set(input_extensions.values()):
+            raise ValueError(f"File type {self.format} not supported")
+        self.columns = tabular.get("columns") or []
+        self.output_format = (tabular.get("output_format") or "parquet").lower()
+        if self.output_format not in output_extensions:
+            raise ValueError(f"Output format {self.output_format} not supported, use one of {', '.join(output_extensions)}")
+        self.compression = tabular.get("output_compression") or "zstd"
+        if self.output_format == "feather" and self.compression not in feather_compressions:
+            raise ValueError(f"Feather files can only be compressed with {', '.join(feather_compressions)}")
+        self.drop = cleaning.get("drop_columns") or []
+        self.dropna = bool(cleaning.get("dropna", False))
+        self.dedup = bool(cleaning.get("drop_duplicates", False))
+        self.rename = cleaning.get("rename_columns") or {}
+        encoding = transformation.get("categorical_encoding") or {}
+        self.encode = encoding.get("columns") or []
+        self.dictionary_dir = encoding.get("dictionary_dir") or "dictionaries"
+        self.encode_output = encoding.get("output") or "codes"
+        if self.encode_output not in ("codes", "category"):
+            raise ValueError(f"Encoded columns are output as codes or category, not {self.encode_output}")
+        self.fillna = (transformation.get("fillna") or {}).get("columns") or {}
+        self.norm = (transformation.get("normalize") or {}).get("columns") or []
+        if self.encode_output == "category" and set(self.encode) & set(self.norm):
+            raise ValueError(f"Columns kept as category cannot be normalized: {sorted(set(self.encode) & set(self.norm))}")
+        self.conversions = {}
+        for cols in validation.get("dtype_conversion") or []:
+            for col, dtype in cols.items():
+                if dtype not in conversion_types:
+                    raise ValueError(f"Cannot convert {col} to {dtype}, use one of {', '.join(conversion_types)}")
+                self.conversions[col] = dtype
+
+        self.plan = []
+        if self.drop:
+            self.plan.append(Step("cleaning", "drop_columns", f"drop {self.drop}", self.drop_columns))
+        if self.dropna or self.dedup:
+            detail = " and ".join(name for name, used in (("missing values", self.dropna), ("duplicates", self.dedup)) if used)
+            self.plan.append(Step("cleaning", "filter_rows", f"drop rows with {detail} in one filter", self.filter_rows))
+        if self.rename:
+            self.plan.append(Step("cleaning", "rename", f"rename {self.rename}", self.rename_columns))
+        if self.encode:
+            self.plan.append(Step("transformation", "encode", f"encode {self.encode} as {self.encode_output} with the dictionaries in {self.dictionary_dir}", self.encode_columns, self.encode))
+        if self.fillna:
+            self.plan.append(Step("transformation", "fillna", f"fill {self.fillna} in one fillna", self.fill_missing, list(self.fillna)))
+        if self.norm:
+            self.plan.append(Step("transformation", "normalize", f"standard scale {self.norm}", self.normalize, self.norm))
+        if self.conversions:
+            self.plan.append(Step("validation", "convert", f"convert {self.conversions} in one astype", self.convert_types))
+
+    def input_format(self, file_name):
+        #the configured file_type, else the one of the file's extension
+        return self.format or input_extensions.get(os.path.splitext(file_name)[1].lower(), "csv")
+
+    def wanted(self, col):
+        #column projection on read: only the configured columns, never the dropped ones
+        return (not self.columns or col in self.columns) and col not in self.drop
+
+    def csv_columns(self):
+        return self.wanted if self.columns or self.drop else None
+
+    def arrow_columns(self, schema):
+        return [name for name in schema.names if self.wanted(name)]
 
     def file_type(self, file_name):
-        file = self.config["tabular"].get("file_type", "csv").lower()
+        file = self.input_format(file_name)
 
         if file == "csv":
-            df = pd.read_csv(file_name)
+            df = pd.read_csv(file_name, usecols=self.csv_columns())
             logger.info(f"loaded the inputed CSV file {file_name}")
         elif file =="json":
-            df = pd.read_json(file_name)
+            df = pd.read_json(file_name, lines=is_json_lines(file_name))
+            df = df[[col for col in df.columns if self.wanted(col)]]
             logger.info(f"loaded the inputed JSON file {file_name}")
+        elif file == "parquet":
+            #Arrow-backed dtypes keep the file's integer, datetime and null types as they are
+            df = pd.read_parquet(file_name, columns=self.arrow_columns(pq.read_schema(file_name)), dtype_backend="pyarrow")
+            logger.info(f"loaded the inputed Parquet file {file_name}")
         else:
-            raise ValueError(f"File type {file} not supported")
+            with pa.memory_map(file_name) as source:
+                columns = self.arrow_columns(pa.ipc.open_file(source).schema)
+            df = pd.read_feather(file_name, columns=columns, dtype_backend="pyarrow")
+            logger.info(f"loaded the inputed Feather file {file_name}")
         return df
-    
-    def cleaning(self, df):
-        cleaning = self.config['tabular']['preprocessing']['cleaning']
 
+    def drop_columns(self, df, stats):
         #column filtering or dropping
-        drop = cleaning.get("drop_columns", [])
-        if drop:
-            df.drop(columns=drop, errors="ignore", inplace=True)
-            logger.info(f"Dropped the following columns: {drop}")
-
-        
-        #drop missing values
-        drop_nan = cleaning.get("dropna", False)
-        if drop_nan:
-            df.dropna(inplace=True)
-            logger.info("Dropped rows with missing values")
-
+        df = df.drop(columns=self.drop, errors="ignore")
+        logger.info(f"Dropped the following columns: {self.drop}")
+        return df
 
-        #drop duplicate rows
-        drop_dup = cleaning.get("drop_duplicates", False)
-        if drop_dup:
-            df.drop_duplicates(inplace=True)
+    def filter_rows(self, df, stats):
+        #drop missing values and duplicate rows with one mask, so the frame is copied once
+        keep = np.ones(len(df), dtype=bool)
+        if self.dropna:
+            keep &= df.notna().all(axis=1).to_numpy()
+        if self.dedup:
+            #duplicates of a row with missing values have them too, so the order of the two does not matter
+            keep &= ~df.duplicated().to_numpy()
+        if not keep.all():
+            df = df.take(np.flatnonzero(keep))
+        if self.dropna:
+            logger.info("Dropped rows with missing values")
+        if self.dedup:
             logger.info("Dropped duplicated rows")
-
-
-        #renaming columns
-        rename_dict = cleaning.get("rename_columns", {})
-        if rename_dict:
-            df.rename(columns=rename_dict, inplace=True)
-            logger.info(f"Renamed the following columns: {rename_dict}")
-
         return df
-    
-    def transformation(self, df):
-        transformation = self.config["tabular"]["preprocessing"]["transformation"]
 
-        #encoding with Label encoder
-        encode = transformation.get("categorical_encoding", {}).get("columns", [])
-        for col in encode:
-            df[col] = self.le.fit_transform(df[col].astype(str))
-        logger.info(f"encoded these columns: {encode}")
+    def rename_columns(self, df, stats):
+        df = df.rename(columns=self.rename)
+        logger.info(f"Renamed the following columns: {self.rename}")
+        return df
 
+    def encode_columns(self, df, stats):
+        #encoding with the persisted dictionaries, as codes in the smallest integer type that holds them
+        #(pd.Categorical picks it) or as category columns whose categories are the dictionary
+        for col in self.encode:
+            values = label_values(df[col])
+            labels = stats["dictionaries"][col] if stats else self.dictionaries.extend(col, values.unique())
+            encoded = pd.Categorical(values, categories=labels)
+            unknown = encoded.codes == -1
+            if unknown.any():
+                raise ValueError(f"Labels of {col} missing from its dictionary: {sorted(values[unknown].unique())[:5]}")
+            df[col] = encoded if self.encode_output == "category" else encoded.codes
+        logger.info(f"encoded these columns: {self.encode}")
+        return df
 
-        #filling missing values in columns
-        fillna = transformation.get('fillna', {}).get("columns") or {}
-        for col, method in fillna.items():
+    def fill_values(self, df):
+        #the value fillna puts in each column, encoded columns have no missing values left ("nan" is a label)
+        values = {}
+        for col, method in self.fillna.items():
+            if col in self.encode:
+                continue
             if method == "mean":
-                df[col].fillna(df[col].mean(), inplace=True)
+                values[col] = df[col].mean()
             elif method == "median":
-                df[col].fillna(df[col].median(), inplace=True)
+                values[col] = df[col].median()
+            elif method == "mode":
+                modes = df[col].mode()
+                values[col] = modes.iloc[0] if len(modes) else np.nan
             else:
-                df[col].fillna(method, inplace=True)
+                values[col] = method
+        return values
+
+    def fill_missing(self, df, stats):
+        #filling missing values in all columns at once
+        df = df.fillna(stats["fill"] if stats else self.fill_values(df))
+        for col, method in self.fillna.items():
             logger.info(f"Filled null values in {col} using {method}")
+        return df
 
-        
+    def normalize(self, df, stats):
         #Normalizing numeric columns
-        norm = transformation.get('normalize', {}).get("columns", [])
-        if norm:
-            df[norm] = self.scale.fit_transform(df[norm])
-            logger.info(f"Normalized the following columns: {norm}")
-
+        values = df[self.norm].astype("float64")  #Arrow-backed columns as floats, missing values as NaN
+        if len(values):  #a chunk can lose all its rows to drop_duplicates
+            if stats:
+                scale = stats["scaler"]
+            else:
+                scale = self.scale = StandardScaler().fit(values)
+            df[self.norm] = scale.transform(values)
+        logger.info(f"Normalized the following columns: {self.norm}")
         return df
-    
-    def validation(self, df):
-        validation = self.config["tabular"]["preprocessing"]["validation"]
 
-        #validating data types
-        for cols in validation.get("dtype_conversion", []):
-            for col, dtype in cols.items():
+    def convert_types(self, df, stats):
+        #validating data types: int, float and str in one astype, a column it fails on is converted alone
+        casts = {col: conversion_types[dtype] for col, dtype in self.conversions.items() if dtype != "datetime" and col in df.columns}
+        converted = set()
+        try:
+            df = df.astype(casts)
+            converted.update(casts)
+        except Exception:
+            for col, dtype in casts.items():
                 try:
-                    if dtype == "int":
-                        df[col] = df[col].astype(int)
-                    elif dtype == "float":
-                        df[col] = df[col].astype(float)
-                    elif dtype == "str":
-                        df[col] = df[col].astype(str)
-                    elif dtype == "datetime":
-                        df[col] = pd.to_datetime(df[col], errors="coerce")
-                    logger.info(f"Converted {col} to {dtype}")
-                except Exception as e:
-                    logger.warning(f'Could not convert {col} to {dtype}')
+                    df[col] = df[col].astype(dtype)
+                    converted.add(col)
+                except Exception:
+                    pass
+        for col, dtype in self.conversions.items():
+            if dtype == "datetime" and col in df.columns:
+                df[col] = pd.to_datetime(df[col], errors="coerce")
+                converted.add(col)
 
+        for col, dtype in self.conversions.items():
+            if col in converted:
+                logger.info(f"Converted {col} to {dtype}")
+            else:
+                logger.warning(f'Could not convert {col} to {dtype}')
         return df
+
+    def run_steps(self, df, section, stats=None, profile=None):
+        """Run the steps of a section of the plan. stats: dictionaries, fill values and scaler of the whole file
+        from stream_statistics, fitted on df when None. profile collects (step, seconds, memory change)."""
+        for step in self.plan:
+            if step.section != section:
+                continue
+            missing = [col for col in step.columns if col not in df.columns]
+            if missing:
+                raise ValueError(f"Step {step.name} needs columns that are not in the data: {missing}")
+            if profile is None:
+                df = step.fn(df, stats)
+                continue
+            before = df.memory_usage(deep=True).sum()
+            started = time.perf_counter()
+            df = step.fn(df, stats)
+            profile.append((step, time.perf_counter() - started, int(df.memory_usage(deep=True).sum() - before)))
+        return df
+
+    def cleaning(self, df):
+        return self.run_steps(df, "cleaning")
+
+    def transformation(self, df, stats=None):
+        return self.run_steps(df, "transformation", stats)
+
+    def validation(self, df):
+        return self.run_steps(df, "validation")
+
+    def explain(self, input_file=None):
+        """Print the compiled plan and return it as text. With input_file the plan is run on that file
+        (nothing is saved) and every step shows its time and how much it grew or shrank the frame."""
+        measured = {}
+        lines = [f"Plan for {self.format or 'any'} files to {self.output_format}, {len(self.plan)} step(s)"]
+        if input_file:
+            profile = []
+            with quiet():
+                started = time.perf_counter()
+                df = self.file_type(input_file)
+                lines.append(f"    load {input_file}: {(time.perf_counter() - started) * 1000:.1f} ms, "
+                             f"{len(df)} rows, {df.memory_usage(deep=True).sum() / (1024 * 1024):.1f} MB")
+                for section in sections:
+                    df = self.run_steps(df, section, profile=profile)
+            measured = {id(step): (seconds, delta) for step, seconds, delta in profile}
+        for idx, step in enumerate(self.plan, 1):
+            line = f"{idx:>3}. {step.section:<15} {step.name:<13} {step.detail}"
+            if id(step) in measured:
+                seconds, delta = measured[id(step)]
+                line += f"  [{seconds * 1000:.1f} ms, {delta / (1024 * 1024):+.1f} MB]"
+            lines.append(line)
+        text = "\n".join(lines)
+        print(text)
+        return text
     
     
-    def save(self, df, input_file, output_dir="cleaned_files"):
+    def output_path(self, input_file, output_dir="cleaned_files"):
         os.makedirs(output_dir, exist_ok=True)
         base = os.path.basename(input_file)
-        name, end = os.path.splitext(base)
+        name, source_end = os.path.splitext(base)
+        end = output_extensions[self.output_format]
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        output_file = os.path.join(output_dir, f"processed_{name}{timestamp}{end}")
+        #the source extension stays in the name, x.csv and x.json of one folder do not overwrite each other
+        return os.path.join(output_dir, f"processed_{name}{source_end.replace('.', '_')}{timestamp}{end}"), end
+
+    def save(self, df, input_file, output_dir="cleaned_files"):
+        output_file, end = self.output_path(input_file, output_dir)
 
                                    
-        if end == ".csv":
-            df.to_csv(output_file, index=False)
-        elif end == ".json":
-            df.to_json(output_file, orient="records")
-        else:
-            raise ValueError("Output file must be csv or json")
+        write_frame(df, output_file, end, self.compression)
         logger.info(f"Saved file to {output_file}")
 
         return output_file
     
 
-    def run(self, input_file):
-        df = self.file_type(input_file)
-        df = self.cleaning(df)
-        df = self.transformation(df)
-        df = self.validation(df)
-        output_file = self.save(df, input_file)
+    def read_chunks(self, file_name, chunksize, dtypes=None):
+        #chunks of chunksize rows, dtypes makes every chunk of a CSV or JSON file read a column with the same type
+        file = self.input_format(file_name)
+
+        if file == "csv":
+            return pd.read_csv(file_name, chunksize=chunksize, usecols=self.csv_columns(), dtype=dtypes)
+        elif file == "json":
+            return (chunk[[col for col in chunk.columns if self.wanted(col)]]
+                    for chunk in pd.read_json(file_name, lines=True, chunksize=chunksize, dtype=dtypes))
+        elif file == "parquet":
+            columns = self.arrow_columns(pq.read_schema(file_name))
+        else:
+            with pa.memory_map(file_name) as source:
+                columns = self.arrow_columns(pa.ipc.open_file(source).schema)
+        return (table.to_pandas(types_mapper=pd.ArrowDtype) for table in arrow_chunks(file_name, chunksize, columns, file))
+
+    def clean_chunk(self, chunk, seen):
+        #cleaning of one chunk, seen drops the rows already kept from earlier chunks
+        chunk = self.cleaning(chunk)
+        if seen is not None:
+            mask = seen.new_rows(chunk)
+            if not mask.all():
+                chunk = chunk[mask].copy()
+        return chunk
+
+    def stream_statistics(self, input_file, chunksize):
+        """First pass of the streaming mode: the labels of the encoded columns (added to their dictionaries),
+        the fillna values and the StandardScaler fit of the whole cleaned file, gathered chunk by chunk, and for
+        CSV and JSON files the dtypes that hold every chunk of a column (common_dtype), which the second pass
+        reads every chunk with. Numbers need no second look, the statistics and row_hashes take 1 and 1.0 alike;
+        a column with strings in some chunks and other values in others is read as strings and the pass starts over."""
+        encode, fillna, norm = self.encode, self.fillna, self.norm
+        strings = {}  #columns read as strings from the start
+        while True:
+            labels = {col: pd.Series(dtype=float) for col in encode}
+            moments = {col: Moments() for col in list(norm) + [c for c, m in fillna.items() if m == "mean"] if col not in encode}
+            counts = {col: pd.Series(dtype=float) for col, method in fillna.items() if method in ("median", "mode") and col not in encode}
+            nulls = {col: 0 for col in norm if col not in encode}
+            seen = SeenRows() if self.dedup else None
+            dtypes = {} if self.input_format(input_file) in ("csv", "json") else None
+            rows = 0
+            mixed = []
+            with quiet():
+                for chunk in self.read_chunks(input_file, chunksize, strings or None):
+                    if dtypes is not None:
+                        mixed += merge_dtypes(dtypes, chunk)
+                    if mixed:
+                        continue  #only the dtypes of the rest, so the pass starts over once
+                    chunk = self.clean_chunk(chunk, seen)
+                    rows += len(chunk)
+                    for col in encode:
+                        labels[col] = labels[col].add(label_values(chunk[col]).value_counts(), fill_value=0)
+                    for col in moments:
+                        moments[col].update(chunk[col])
+                    for col in counts:
+                        counts[col] = counts[col].add(chunk[col].value_counts(), fill_value=0)
+                    for col in nulls:
+                        nulls[col] += int(chunk[col].isna().sum())
+            if not mixed:
+                break
+            mixed = list(dict.fromkeys(mixed))
+            logger.info(f"{', '.join(map(str, mixed))} mix strings with other values, reading them as strings")
+            strings.update({col: object for col in mixed})
+
+        dictionaries = {col: self.dictionaries.extend(col, labels[col].index) for col in encode}
+        #encoded columns have no missing values left, so they get no fill value
+        fill = {}
+        for col, method in fillna.items():
+            if col in encode:
+                continue
+            if method == "mean":
+                fill[col] = moments[col].mean if moments[col].count else np.nan
+            elif method == "median":
+                fill[col] = median_from_counts(counts[col])
+            elif method == "mode":
+                top = counts[col][counts[col] == counts[col].max()]
+                fill[col] = top.sort_index().index[0] if len(top) else np.nan
+            else:
+                fill[col] = method
+
+        scaler = None
+        if norm:
+            #normalizing comes after encoding and fillna, so the fit covers the codes and the filled values
+            for col in norm:
+                if col in encode:
+                    moments[col] = Moments()
+                    moments[col].add_weighted(dictionaries[col].get_indexer(labels[col].index), labels[col].to_numpy())
+                elif col in fill and pd.notna(fill[col]):
+                    moments[col].add(nulls[col], float(fill[col]), 0.0)
+            variances = np.array([moments[col].variance() for col in norm])
+            scaler = StandardScaler()
+            scaler.mean_ = np.array([moments[col].mean if moments[col].count else np.nan for col in norm])
+            scaler.var_ = variances
+            scaler.scale_ = np.where(variances > 0, np.sqrt(variances), 1.0)
+            scaler.n_samples_seen_ = np.array([moments[col].count for col in norm], dtype=np.int64)
+            scaler.n_features_in_ = len(norm)
+            scaler.feature_names_in_ = np.array(norm, dtype=object)
+
+        logger.info(f"Computed the statistics of {rows} cleaned rows")
+        return {"dictionaries": dictionaries, "fill": fill, "scaler": scaler, "dtypes": dtypes}
+
+    def run_stream(self, input_file, chunksize, output_dir="cleaned_files"):
+        """Streaming mode of run: statistics from a first pass over the file, then every chunk is cleaned,
+        transformed with them, validated and appended to the output. Memory is bounded by the chunk size,
+        besides 8 bytes per kept row for drop_duplicates and the distinct values of encoded, median and mode columns."""
+        logger.info(f"Processing {input_file} in chunks of {chunksize} rows")
+        stats = self.stream_statistics(input_file, chunksize)
+        seen = SeenRows() if self.dedup else None
+        output_file, end = self.output_path(input_file, output_dir)
+
+        writer = ChunkWriter(output_file, end, self.compression)
+        try:
+            for idx, chunk in enumerate(self.read_chunks(input_file, chunksize, stats["dtypes"])):
+                with quiet() if idx else nullcontext():
+                    chunk = self.clean_chunk(chunk, seen)
+                    chunk = self.transformation(chunk, stats)
+                    chunk = self.validation(chunk)
+                writer.write(chunk)
+        finally:
+            writer.close()
+        logger.info(f"Saved {writer.rows} rows to {output_file}")
+
+        return output_file
+
+    def stream_chunksize(self, input_file):
+        #rows per chunk when input_file is large enough to stream, None to load it whole
+        tabular = self.config["tabular"]
+        stream_min_mb = tabular.get("stream_min_mb", default_stream_min_mb)
+        if stream_min_mb is None or os.path.getsize(input_file) < stream_min_mb * 1024 * 1024:
+            return None
+        return tabular.get("chunksize") or default_chunksize
+
+    def run(self, input_file, chunksize=None, output_dir="cleaned_files"):
+        #chunksize streams the file in chunks of that many rows, by default only files of at least stream_min_mb are
+        with run_log() as run_logs:
+            chunksize = chunksize or self.stream_chunksize(input_file)
+            if chunksize and self.input_format(input_file) == "json" and not is_json_lines(input_file):
+                logger.warning("Only JSON files with one record per line can be streamed, loading the whole file")
+                chunksize = None
+
+            if chunksize:
+                output_file = self.run_stream(input_file, chunksize, output_dir)
+            else:
+                df = self.file_type(input_file)
+                df = self.cleaning(df)
+                df = self.transformation(df)
+                df = self.validation(df)
+                output_file = self.save(df, input_file, output_dir)
 
-        logs = log.getvalue()
+        logs = run_logs.getvalue()
 
         return output_file, logs
\ No newline at end of file
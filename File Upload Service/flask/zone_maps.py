@@ -0,0 +1,271 @@
+# Vendored from Core DW Infrastructure/app/zone_maps.py by scripts/sync_shared_modules.py, edit that file instead.
+import base64
+import hashlib
+import json
+import math
+import re
+from datetime import date, datetime
+from decimal import Decimal
+from minio.error import S3Error
+
+# Zone maps of silver datasets: the _stats.json sidecar written next to the parquet files of a dataset
+# (etl_stats.refresh_column_stats) and the pruning that picks the files a predicate can match.
+# Per file it holds the row count and, per column, the min and max, the null count and a HyperLogLog
+# sketch of the distinct values. Sketches of different files merge (register-wise max), so the distinct
+# count of the whole dataset is known without reading it. Plain Python only, the Flask API uses this
+# module as well.
+#
+#   python zone_maps.py datasets/heart                          dataset-level stats
+#   python zone_maps.py datasets/heart --where "age >= 60"      files that can hold matching rows
+#   python zone_maps.py project1/heart_processed.parquet --refresh   backfill files written without stats
+#
+# {"sketch_precision": 9,
+#  "files": {"datasets/heart/project=p1/extract_date=2024-12-01/x.parquet":
+#            {"etag": "...", "rows": 303, "columns": {"age": {"type": "number", "min": 29, "max": 77, "nulls": 0,
+#                                                              "sketch": "<base64 registers>"}}}},
+#  "dataset": {"files": 1, "rows": 303, "columns": {"age": {"type": "number", "min": 29, "max": 77, "nulls": 0,
+#                                                           "distinct_estimate": 41}}}}
+
+stats_name = "_stats.json"
+sketch_precision = 9  # 512 registers, ~4.6% error, about Spark's approx_count_distinct default
+max_bound_length = 256  # longer strings get no min/max, a truncated max would prune wrongly
+predicate_pattern = re.compile(r'^\s*(\w+)\s*(<=|>=|!=|=|<|>|\bis\s+not\s+null\b|\bis\s+null\b)\s*(.*?)\s*$', re.IGNORECASE)
+
+def value_register(text):
+    """HyperLogLog register and rank of a value, from its string form (Spark's cast to string).
+    etl_stats.spark_file_stats computes the same in Spark SQL: register from the first 4 hex digits of
+    the SHA-256, rank from the leading zeros of the next 52 bits."""
+    digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    register = int(digest[:4], 16) % (1 << sketch_precision)
+    rank = 53 - max(int(digest[4:17], 16).bit_length(), 1)
+    return register, rank
+
+def sketch_from_strings(values):
+    registers = bytearray(1 << sketch_precision)
+    for value in values:
+        if value is not None:
+            register, rank = value_register(value)
+            registers[register] = max(registers[register], rank)
+    return encode_sketch(registers)
+
+def sketch_from_ranks(ranks):
+    """Sketch from {register: rank}, as aggregated by Spark."""
+    registers = bytearray(1 << sketch_precision)
+    for register, rank in ranks.items():
+        registers[register] = rank
+    return encode_sketch(registers)
+
+def encode_sketch(registers):
+    return base64.b64encode(bytes(registers)).decode("ascii")
+
+def merge_sketches(sketches):
+    """Register-wise max of encoded sketches, None if there are none."""
+    merged = None
+    for sketch in sketches:
+        registers = base64.b64decode(sketch)
+        merged = bytearray(registers) if merged is None else bytearray(max(a, b) for a, b in zip(merged, registers))
+    return merged
+
+def estimate_distinct(registers):
+    """HyperLogLog estimate, with linear counting for small cardinalities."""
+    m = len(registers)
+    alpha = 0.7213 / (1 + 1.079 / m)
+    estimate = alpha * m * m / sum(2.0 ** -rank for rank in registers)
+    zeros = registers.count(0)
+    if estimate <= 2.5 * m and zeros:
+        estimate = m * math.log(m / zeros)
+    return int(round(estimate))
+
+def json_bound(value, is_max):
+    """min or max of a column as stored in the sidecar. Decimals are widened by one ulp when turned into
+    floats so the bound still holds, NaN (larger than any number in Spark) and long strings get no bound."""
+    if isinstance(value, Decimal):
+        return math.nextafter(float(value), math.inf if is_max else -math.inf)
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    if isinstance(value, str) and len(value) > max_bound_length:
+        return None
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+def summarize(files):
+    """Dataset-level stats of a sidecar's files: rows, min, max and nulls per column and a distinct count
+    from the merged sketches. A bound is None when a file with values in that column has none."""
+    columns = {}
+    for entry in files.values():
+        for name, column in entry["columns"].items():
+            columns.setdefault(name, []).append(dict(column, rows=entry["rows"]))
+    summary = {}
+    for name, stats in columns.items():
+        mins = [s["min"] for s in stats if s["nulls"] < s["rows"]]
+        maxes = [s["max"] for s in stats if s["nulls"] < s["rows"]]
+        comparable = all(s["type"] == stats[0]["type"] for s in stats)
+        sketch = merge_sketches(s["sketch"] for s in stats if s.get("sketch"))
+        summary[name] = {
+            "type": stats[0]["type"],
+            "min": min(mins, key=lambda v: coerce(v, stats[0]["type"])) if comparable and mins and None not in mins else None,
+            "max": max(maxes, key=lambda v: coerce(v, stats[0]["type"])) if comparable and maxes and None not in maxes else None,
+            "nulls": sum(s["nulls"] for s in stats),
+            "distinct_estimate": estimate_distinct(sketch) if sketch else 0,
+        }
+    return {"files": len(files), "rows": sum(entry["rows"] for entry in files.values()), "columns": summary}
+
+def coerce(value, column_type):
+    """Value of a predicate or bound in a form that compares like the column."""
+    if column_type == "number":
+        return float(value)
+    if column_type == "boolean":
+        return value if isinstance(value, bool) else str(value).lower() in ("true", "1")
+    if column_type in ("date", "timestamp"):
+        parsed = datetime.fromisoformat(str(value))
+        return parsed.replace(tzinfo=None)
+    return str(value)
+
+def parse_where(where):
+    """Conjunctive predicate such as "age >= 40 and sex = 1" into [(column, operator, value)].
+    Operators: = != < <= > >= is null, is not null. Values may be quoted."""
+    predicates = []
+    for part in re.split(r'\s+and\s+', where.strip(), flags=re.IGNORECASE) if where and where.strip() else []:
+        match = predicate_pattern.match(part)
+        if not match:
+            raise ValueError(f"Cannot parse predicate '{part}'")
+        column, operator, value = match.group(1), re.sub(r'\s+', ' ', match.group(2).lower()), match.group(3)
+        if operator in ("is null", "is not null"):
+            value = None
+        elif len(value) >= 2 and value[0] == value[-1] and value[0] in "'\"":
+            value = value[1:-1]
+        predicates.append((column, operator, value))
+    return predicates
+
+def column_may_match(column, rows, operator, value):
+    """False only when the zone map of a column proves no row of the file satisfies the predicate."""
+    if operator == "is null":
+        return column["nulls"] > 0
+    if operator == "is not null":
+        return rows > column["nulls"]
+    if rows == column["nulls"]:
+        return False  # comparisons with null are never true
+    low, high = column["min"], column["max"]
+    if low is None or high is None:
+        return True  # no bounds (NaN, long strings): cannot prune
+    try:
+        value, low, high = coerce(value, column["type"]), coerce(low, column["type"]), coerce(high, column["type"])
+    except (TypeError, ValueError):
+        return True
+    if operator == "=":
+        return low <= value <= high
+    if operator == "!=":
+        return not (low == high == value)
+    if operator == "<":
+        return low < value
+    if operator == "<=":
+        return low <= value
+    if operator == ">":
+        return high > value
+    return high >= value
+
+def file_may_match(entry, predicates):
+    for column_name, operator, value in predicates:
+        column = entry["columns"].get(column_name)
+        if column is None:
+            continue  # not tracked (complex type, or the file predates the column)
+        if not column_may_match(column, entry["rows"], operator, value):
+            return False
+    return True
+
+def prune_files(stats, predicates, current_files):
+    """Files among current_files ({object name: etag}) that may hold rows matching every predicate.
+    Files without an up-to-date entry in the sidecar are always kept."""
+    entries = stats.get("files", {}) if stats else {}
+    selected = []
+    for name, etag in current_files.items():
+        entry = entries.get(name)
+        if entry is None or entry.get("etag") != etag or file_may_match(entry, predicates):
+            selected.append(name)
+    return sorted(selected)
+
+def read_json(minio_client, bucket_name, object_name):
+    """A JSON object, None if it does not exist."""
+    try:
+        response = minio_client.get_object(bucket_name, object_name)
+    except S3Error as e:
+        if e.code == 'NoSuchKey':
+            return None
+        raise
+    try:
+        return json.loads(response.read())
+    finally:
+        response.close()
+        response.release_conn()
+
+def commit_markers(minio_client, bucket_name, root):
+    return {obj.object_name for obj in minio_client.list_objects(bucket_name, prefix=f"{root}/_commits/")}
+
+def uncommitted_files(minio_client, bucket_name, markers):
+    """Files readers must not see while a commit is under way (etl_pipeline.append_to_dataset, compactions and
+    chunked outputs): those of a batch without its commit marker yet, and those a committed swap replaces but
+    has not deleted yet. Only the pending markers are read, they are removed once a commit is finished."""
+    hidden = set()
+    for name in markers:
+        if not name.endswith('.pending.json'):
+            continue
+        pending = read_json(minio_client, bucket_name, name)
+        if pending is None:
+            continue  # finished in the meantime
+        if name.replace('.pending.json', '.json') in markers:
+            hidden.update(pending.get("replaces", []))
+        else:
+            hidden.update(pending["files"])
+    return hidden
+
+def list_data_files(minio_client, bucket_name, root):
+    """Committed parquet files of a silver directory ({object name: etag}), without _staging/, _commits/ and
+    other hidden paths. The commit markers are listed before and after the files and the listing is repeated
+    when a commit moved on in between, so the result is one committed state of the directory."""
+    while True:
+        markers = commit_markers(minio_client, bucket_name, root)
+        files = {}
+        for obj in minio_client.list_objects(bucket_name, prefix=f"{root}/", recursive=True):
+            relative = obj.object_name[len(root) + 1:]
+            if obj.object_name.endswith('.parquet') and not any(part.startswith(('_', '.')) for part in relative.split('/')):
+                files[obj.object_name] = obj.etag
+        if commit_markers(minio_client, bucket_name, root) == markers:
+            break
+    hidden = uncommitted_files(minio_client, bucket_name, markers)
+    return {name: etag for name, etag in files.items() if name not in hidden}
+
+def load_stats(minio_client, bucket_name, root):
+    """The sidecar of a silver directory, None if it has none."""
+    return read_json(minio_client, bucket_name, f"{root}/{stats_name}")
+
+def select_files(minio_client, bucket_name, root, predicates):
+    """Files of a silver directory to read for a predicate (a where string or parsed predicates),
+    and how many files the directory has."""
+    if isinstance(predicates, str):
+        predicates = parse_where(predicates)
+    current_files = list_data_files(minio_client, bucket_name, root)
+    return prune_files(load_stats(minio_client, bucket_name, root), predicates, current_files), len(current_files)
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Show, prune with or refresh the zone maps of a silver directory")
+    parser.add_argument("root", help="silver directory, e.g. datasets/heart or project1/heart_processed.parquet")
+    parser.add_argument("--where", default="", help='predicate such as "age >= 60 and sex = 1"')
+    parser.add_argument("--refresh", action="store_true", help="compute the entries of files without one (needs Spark)")
+    args = parser.parse_args()
+
+    from etl_storage import minio_client, destination_bucket
+    from etl_stats import refresh_column_stats
+    root = args.root.rstrip('/')
+    if args.refresh:
+        refresh_column_stats(root)
+    if args.where:
+        selected, total = select_files(minio_client, destination_bucket, root, args.where)
+        print(f"{len(selected)} of {total} file(s) can hold rows where {args.where}:")
+        for name in selected:
+            print(f"  {name}")
+    else:
+        stats = load_stats(minio_client, destination_bucket, root)
+        print(json.dumps(stats["dataset"], indent=2) if stats else f"No column stats for {root}, use --refresh")
@@ -0,0 +1,64 @@
+import argparse
+import os
+import sys
+
+# Vendors the modules shared by several services from their one implementation in Core DW Infrastructure/app.
+# Every Docker image is built from its own directory, so a service cannot import a module from another tree:
+# the other trees ship a generated copy instead. Edit only the file under Core DW Infrastructure/app, then
+#
+#   python scripts/sync_shared_modules.py            rewrite every copy
+#   python scripts/sync_shared_modules.py --check    list the copies that differ from their source, exit 1 if any
+#
+# tests/test_shared_modules.py runs the check, so a copy edited by hand fails the test suite.
+
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+source_dir = "Core DW Infrastructure/app"
+# module -> directories that ship a copy of it
+shared_modules = {
+    "zone_maps.py": ["Core DW Infrastructure/flask", "File Upload Service/app", "File Upload Service/flask"],
+}
+for name in ("compact_silver.py", "etl_benchmark.py", "etl_chunked.py", "etl_commits.py", "etl_dedup.py",
+             "etl_leases.py", "etl_listener.py", "etl_local.py", "etl_pipeline.py", "etl_queue.py", "etl_stats.py",
+             "etl_storage.py", "etl_worker.py", "gold_jobs.py", "gold_rollups.yaml", "ml_state.py", "refit_ml_stats.py"):
+    shared_modules[name] = ["File Upload Service/app"]
+
+def vendored(name):
+    """Content of the copy of a shared module: a header pointing at the source, then the source as is."""
+    with open(os.path.join(repo_root, source_dir, name), newline='') as source:
+        return f"# Vendored from {source_dir}/{name} by scripts/sync_shared_modules.py, edit that file instead.\n" \
+               + source.read()
+
+def copy_paths():
+    """(module, copy path relative to the repository) of every vendored copy."""
+    return [(name, f"{directory}/{name}") for name, directories in shared_modules.items() for directory in directories]
+
+def stale_copies():
+    """Copies that are missing or differ from their source."""
+    stale = []
+    for name, path in copy_paths():
+        try:
+            with open(os.path.join(repo_root, path), newline='') as copy:
+                current = copy.read()
+        except FileNotFoundError:
+            current = None
+        if current != vendored(name):
+            stale.append(path)
+    return stale
+
+def sync():
+    for name, path in copy_paths():
+        with open(os.path.join(repo_root, path), "w", newline='') as copy:
+            copy.write(vendored(name))
+    print(f"Wrote {len(copy_paths())} vendored copies")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Copy the shared modules from Core DW Infrastructure/app into the other trees")
+    parser.add_argument("--check", action="store_true", help="only report copies that differ from their source")
+    args = parser.parse_args()
+    if not args.check:
+        sync()
+        sys.exit(0)
+    stale = stale_copies()
+    for path in stale:
+        print(f"{path} differs from {source_dir}, run python scripts/sync_shared_modules.py")
+    sys.exit(1 if stale else 0)
@@ -0,0 +1,47 @@
+import os
+import shutil
+import sys
+
+import pytest
+
+from tests.fake_minio import FakeMinio
+
+# The modules under test are plain scripts importing each other by name, as in their Docker images.
+# Core DW Infrastructure/app holds the one implementation of the shared ETL modules (the other trees vendor
+# it, scripts/sync_shared_modules.py), File Upload Service/app adds the tabular pipeline.
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for app_dir in ("File Upload Service/app", "Core DW Infrastructure/app"):
+    sys.path.insert(0, os.path.join(repo_root, app_dir))
+
+
+@pytest.fixture
+def fake_minio(monkeypatch):
+    """A FakeMinio in place of the MinIO client in every ETL module imported so far (they import the client
+    by name from etl_storage). Modules using it must be imported before the fixture runs."""
+    etl_storage = pytest.importorskip("etl_storage")
+    client = etl_storage.minio_client
+    fake = FakeMinio()
+    for module in list(sys.modules.values()):
+        if getattr(module, "minio_client", None) is client:
+            monkeypatch.setattr(module, "minio_client", fake)
+    return fake
+
+
+@pytest.fixture(scope="session")
+def spark_session():
+    """A local SparkSession without the S3A settings of etl_storage.get_spark, skipped without pyspark or Java."""
+    pyspark_sql = pytest.importorskip("pyspark.sql")
+    if not (os.environ.get("JAVA_HOME") or shutil.which("java")):
+        pytest.skip("Spark needs Java (JAVA_HOME or java on the PATH)")
+    session = pyspark_sql.SparkSession.builder.master("local[1]").appName("etl tests") \
+        .config("spark.ui.enabled", "false").config("spark.sql.shuffle.partitions", "1").getOrCreate()
+    yield session
+    session.stop()
+
+
+@pytest.fixture
+def spark(spark_session, monkeypatch):
+    """The local SparkSession, returned by etl_storage.get_spark for the duration of a test."""
+    etl_storage = pytest.importorskip("etl_storage")
+    monkeypatch.setattr(etl_storage, "spark", spark_session)
+    return spark_session
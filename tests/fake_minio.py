@@ -0,0 +1,81 @@
+import hashlib
+import io
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+
+class FakeResponse(io.BytesIO):
+    def release_conn(self):
+        pass
+
+
+class FakeMinio:
+    """In-memory stand-in for the parts of minio.Minio the ETL modules use. Every write moves a clock
+    by a millisecond, so last_modified orders objects by their write like the MinIO listing does."""
+
+    def __init__(self):
+        self.buckets = {}
+        self.now = datetime.now(timezone.utc)
+
+    def tick(self, seconds=0.001):
+        self.now += timedelta(seconds=seconds)
+        return self.now
+
+    def put(self, bucket_name, object_name, data):
+        """Store an object directly, returns nothing."""
+        self.buckets.setdefault(bucket_name, {})[object_name] = SimpleNamespace(
+            data=bytes(data), last_modified=self.tick(), etag=hashlib.md5(data).hexdigest())
+
+    def names(self, bucket_name, prefix=""):
+        return sorted(name for name in self.buckets.get(bucket_name, {}) if name.startswith(prefix))
+
+    def missing(self, bucket_name, object_name):
+        from minio.error import S3Error
+
+        return S3Error(code="NoSuchKey", message="Object does not exist", resource=f"/{bucket_name}/{object_name}",
+                       request_id="", host_id="", response=None)
+
+    def list_objects(self, bucket_name, prefix="", recursive=False):
+        listed, directories = [], set()
+        for name in self.names(bucket_name, prefix):
+            entry = self.buckets[bucket_name][name]
+            rest = name[len(prefix):]
+            if not recursive and '/' in rest:
+                directory = prefix + rest.split('/', 1)[0] + '/'
+                if directory not in directories:
+                    directories.add(directory)
+                    listed.append(SimpleNamespace(object_name=directory, is_dir=True, last_modified=None,
+                                                  etag=None, size=0))
+                continue
+            listed.append(SimpleNamespace(object_name=name, is_dir=False, last_modified=entry.last_modified,
+                                          etag=entry.etag, size=len(entry.data)))
+        return iter(listed)
+
+    def stat_object(self, bucket_name, object_name):
+        entry = self.buckets.get(bucket_name, {}).get(object_name)
+        if entry is None:
+            raise self.missing(bucket_name, object_name)
+        return SimpleNamespace(object_name=object_name, last_modified=entry.last_modified, etag=entry.etag,
+                               size=len(entry.data))
+
+    def get_object(self, bucket_name, object_name, offset=0, length=None):
+        entry = self.buckets.get(bucket_name, {}).get(object_name)
+        if entry is None:
+            raise self.missing(bucket_name, object_name)
+        end = None if length is None else offset + length
+        return FakeResponse(entry.data[offset:end])
+
+    def put_object(self, bucket_name, object_name, data, length, content_type=None):
+        self.put(bucket_name, object_name, data.read(length))
+
+    def copy_object(self, bucket_name, object_name, source):
+        entry = self.buckets.get(source.bucket_name, {}).get(source.object_name)
+        if entry is None:
+            raise self.missing(source.bucket_name, source.object_name)
+        self.put(bucket_name, object_name, entry.data)
+
+    def remove_objects(self, bucket_name, delete_object_list):
+        for delete_object in delete_object_list:
+            name = getattr(delete_object, "name", None) or delete_object._name  # _name before minio 7.2
+            self.buckets.get(bucket_name, {}).pop(name, None)
+        return iter([])
@@ -0,0 +1,22 @@
+import pytest
+
+pytest.importorskip("pyspark")
+pytest.importorskip("minio")
+
+from pyspark.sql.types import IntegerType, StringType  # noqa: E402
+
+import etl_chunked  # noqa: E402
+import etl_pipeline  # noqa: E402
+
+
+def test_initial_schema_is_inferred_from_the_head_only(fake_minio, spark, monkeypatch):
+    monkeypatch.setattr(etl_pipeline, "schema_sample_bytes", 64)
+    rows = ["age,note"] + [f"{age}," for age in range(20, 40)] + ["forty,late value"]
+    fake_minio.put("dw-bucket-bronze", "project1/big.csv", "\n".join(rows).encode())
+    header = etl_pipeline.read_csv_header("project1/big.csv")
+
+    schema = etl_chunked.initial_schema("project1/big.csv", header)
+
+    # the last row is past the head: the chunks that hold it widen the schema
+    assert [(field.name, field.dataType) for field in schema.fields] == [("age", IntegerType()), ("note", StringType())]
+    assert etl_pipeline.read_metadata_json(etl_pipeline.schema_object_name("project1/big.csv", header))["schema"] == schema.jsonValue()
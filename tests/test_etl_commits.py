@@ -0,0 +1,103 @@
+import pytest
+
+pytest.importorskip("pyspark")
+pytest.importorskip("minio")
+
+import etl_commits  # noqa: E402
+import zone_maps  # noqa: E402
+
+bucket = "dw-bucket-silver"
+
+
+def stage(fake, directory, batch_id, count):
+    """Staged parquet files of a batch, {staged name: target name}."""
+    files = {}
+    for idx in range(count):
+        staged_name = f"{directory}/_staging/{batch_id}/part-{idx}.parquet"
+        fake.put(bucket, staged_name, f"{batch_id}-{idx}".encode())
+        files[staged_name] = f"{directory}/{batch_id}-part-{idx}.parquet"
+    return files
+
+
+def test_publish_batch_swaps_the_replaced_files(fake_minio):
+    old = etl_commits.publish_batch(bucket, "datasets/heart", stage(fake_minio, "datasets/heart", "a", 2), "a")
+    new = etl_commits.publish_batch(bucket, "datasets/heart", stage(fake_minio, "datasets/heart", "b", 1), "b",
+                                    replaces=old["files"], compaction=True)
+
+    assert set(zone_maps.list_data_files(fake_minio, bucket, "datasets/heart")) == set(new["files"])
+    assert fake_minio.names(bucket, "datasets/heart/_commits/") == [
+        "datasets/heart/_commits/a.json", "datasets/heart/_commits/b.json"]
+    assert etl_commits.read_json_object(bucket, "datasets/heart/_commits/b.json")["compaction"] is True
+    assert etl_commits.batch_committed("datasets/heart", "b")
+
+
+def test_files_of_a_pending_batch_are_hidden_and_rolled_back(fake_minio):
+    committed = etl_commits.publish_batch(bucket, "datasets/heart", stage(fake_minio, "datasets/heart", "a", 1), "a")
+    files = stage(fake_minio, "datasets/heart", "b", 2)
+    # a run that died while copying batch b into place
+    etl_commits.write_json_object(bucket, "datasets/heart/_commits/b.pending.json",
+                                  {"batch_id": "b", "files": list(files.values()), "replaces": []})
+    for staged_name, target_name in list(files.items())[:1]:
+        fake_minio.put(bucket, target_name, fake_minio.get_object(bucket, staged_name).read())
+
+    assert set(zone_maps.list_data_files(fake_minio, bucket, "datasets/heart")) == set(committed["files"])
+    etl_commits.rollback_incomplete_batches("datasets/heart", bucket)  # younger than stale_batch_seconds
+    assert fake_minio.names(bucket, "datasets/heart/_commits/b")
+
+    etl_commits.rollback_incomplete_batches("datasets/heart", bucket, leased=True)
+    assert fake_minio.names(bucket, "datasets/heart/_commits/") == ["datasets/heart/_commits/a.json"]
+    assert fake_minio.names(bucket, "datasets/heart/_staging/") == []
+    assert [name for name in fake_minio.names(bucket, "datasets/heart/") if name.endswith(".parquet")] == committed["files"]
+
+
+def test_a_committed_swap_is_rolled_forward(fake_minio):
+    old = etl_commits.publish_batch(bucket, "datasets/heart", stage(fake_minio, "datasets/heart", "a", 2), "a")
+    new_files = list(stage(fake_minio, "datasets/heart", "b", 1).values())
+    for name in new_files:
+        fake_minio.put(bucket, name, b"merged")
+    marker = {"batch_id": "b", "files": new_files, "replaces": old["files"]}
+    etl_commits.write_json_object(bucket, "datasets/heart/_commits/b.pending.json", marker)
+    etl_commits.write_json_object(bucket, "datasets/heart/_commits/b.json", marker)  # died after the commit point
+
+    assert set(zone_maps.list_data_files(fake_minio, bucket, "datasets/heart")) == set(new_files)
+    etl_commits.rollback_incomplete_batches("datasets/heart", bucket, leased=True)
+    assert [name for name in fake_minio.names(bucket, "datasets/heart/") if name.endswith(".parquet")
+            and "/_" not in name] == new_files
+
+
+def test_publish_output_replaces_the_output_and_resumes(fake_minio):
+    output = "project1/heart_processed.parquet"
+    fake_minio.put(bucket, f"{output}/part-00000.parquet", b"spark overwrite")
+    staged = list(stage(fake_minio, output, "b", 2))
+    fake_minio.put(bucket, f"{output}/b-part-0.parquet", b"b-0")  # copied by a run that died
+
+    etl_commits.publish_output(output, staged, ["project1/heart.csv"], "b", [f"{output}/part-00000.parquet"], resume=True)
+
+    assert sorted(zone_maps.list_data_files(fake_minio, bucket, output)) == [
+        f"{output}/b-part-0.parquet", f"{output}/b-part-1.parquet"]
+    assert f"{output}/part-00000.parquet" not in fake_minio.names(bucket, output)
+    assert f"{output}/_SUCCESS" in fake_minio.names(bucket, output)
+
+
+def test_row_hashes_of_a_committed_append_are_published_on_rollback(fake_minio):
+    metadata = "dw-bucket-metadata"
+    hashes = {}
+    for batch_id in ("a", "b"):
+        staged_name = f"_dedup/heart/_staging/{batch_id}/bucket=0f/part-0.parquet"
+        fake_minio.put(metadata, staged_name, batch_id.encode())
+        hashes[batch_id] = {staged_name: f"_dedup/heart/bucket=0f/{batch_id}-part-0.parquet"}
+    # a died after its commit point, b before it
+    for batch_id, committed in (("a", True), ("b", False)):
+        files = stage(fake_minio, "datasets/heart", batch_id, 1)
+        marker = {"batch_id": batch_id, "files": list(files.values()), "replaces": [], "dedup_index": hashes[batch_id]}
+        etl_commits.write_json_object(bucket, f"datasets/heart/_commits/{batch_id}.pending.json", marker)
+        for staged_name, target_name in files.items():
+            fake_minio.put(bucket, target_name, b"rows")
+        if committed:
+            etl_commits.write_json_object(bucket, f"datasets/heart/_commits/{batch_id}.json", marker)
+
+    etl_commits.rollback_incomplete_batches("datasets/heart", bucket, leased=True)
+    etl_commits.rollback_incomplete_batches("datasets/heart", bucket, leased=True)
+
+    assert fake_minio.names(metadata, "_dedup/heart/") == ["_dedup/heart/bucket=0f/a-part-0.parquet"]
+    assert fake_minio.names(bucket, "datasets/heart/_commits/") == ["datasets/heart/_commits/a.json"]
@@ -0,0 +1,51 @@
+import pytest
+
+pytest.importorskip("pyspark")
+pytest.importorskip("minio")
+
+import compact_silver  # noqa: E402
+import etl_leases  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def no_settle(monkeypatch):
+    monkeypatch.setattr(etl_leases, "lease_settle_seconds", 0)
+
+
+def test_a_held_key_cannot_be_claimed_until_it_is_released(fake_minio):
+    lease = etl_leases.acquire_lease("project1/heart.csv")
+    assert lease is not None
+    assert etl_leases.acquire_lease("project1/heart.csv") is None
+    assert etl_leases.acquire_lease("project1/other.csv") is not None
+
+    etl_leases.release_lease(lease)
+    assert etl_leases.acquire_lease("project1/heart.csv") is not None
+
+
+def test_an_expired_claim_is_taken_over(fake_minio):
+    assert etl_leases.acquire_lease("project1/heart.csv") is not None
+    fake_minio.tick(etl_leases.lease_seconds + 1)  # its claimant died without renewing it
+
+    assert etl_leases.acquire_lease("project1/heart.csv") is not None
+    assert len(fake_minio.names("dw-bucket-metadata", etl_leases.lease_directory("project1/heart.csv"))) == 1
+
+
+def test_writers_and_compactions_of_a_directory_share_its_lease():
+    assert etl_leases.directory_lease_key("datasets/heart") == "_datasets/heart"
+    assert compact_silver.compaction_lease_key("dw-bucket-silver", "datasets/heart") == "_datasets/heart"
+    # the dedup index is appended to under its dataset's lease
+    assert compact_silver.compaction_lease_key("dw-bucket-metadata", "_dedup/heart") == "_datasets/heart"
+    output = "project1/heart_processed.parquet"
+    assert compact_silver.compaction_lease_key("dw-bucket-silver", output) == etl_leases.directory_lease_key(output)
+    assert etl_leases.directory_lease_key(output) != etl_leases.directory_lease_key(output, "dw-bucket-metadata")
+
+
+def test_compaction_skips_a_file_mode_output_being_written(fake_minio):
+    output = "project1/heart_processed.parquet"
+    for idx in range(3):
+        fake_minio.put("dw-bucket-silver", f"{output}/part-{idx}.parquet", b"small")
+    lease = etl_leases.acquire_lease(etl_leases.directory_lease_key(output))
+
+    assert compact_silver.compact_prefix("dw-bucket-silver", "project1/") == 0
+    assert len(fake_minio.names("dw-bucket-silver", f"{output}/")) == 3
+    etl_leases.release_lease(lease)
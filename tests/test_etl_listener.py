@@ -0,0 +1,31 @@
+import json
+
+import pytest
+
+pytest.importorskip("pyspark")
+pytest.importorskip("minio")
+
+import etl_listener  # noqa: E402
+
+
+def test_a_notified_upload_is_checkpointed_at_its_listing_time(fake_minio, monkeypatch):
+    monkeypatch.setattr(etl_listener, "pending", {})
+    submitted = []
+    monkeypatch.setattr(etl_listener.etl_queue, "ensure_worker_running", lambda: None)
+    monkeypatch.setattr(etl_listener.etl_queue, "submit_job", lambda name, option: submitted.append((name, option)))
+    fake_minio.put("dw-bucket-bronze", "project1/heart.csv", b"age\n63\n")
+    fake_minio.put("dw-bucket-bronze", "project1/heart.provenance.json",
+                   json.dumps({"history": [{"preprocessing": "Data Clean Up"}]}).encode())
+    fake_minio.tick(5)  # the event is delivered later than the upload
+
+    record = {"eventTime": fake_minio.now.isoformat().replace("+00:00", "Z"), "s3": {"object": {"key": "project1/heart.csv"}}}
+    last_modified = etl_listener.event_last_modified("project1/heart.csv", record)
+    assert last_modified == fake_minio.stat_object("dw-bucket-bronze", "project1/heart.csv").last_modified
+    etl_listener.track("project1/heart.csv", last_modified)
+
+    assert etl_listener.dispatch(etl_listener.take_ready(force=True), force=True) == 1
+    assert submitted == [("project1/heart.csv", "Data Clean Up")]
+    # a restart does not list the file again
+    assert etl_listener.load_checkpoint() == (last_modified, {"project1/heart.csv"})
+    etl_listener.poll_new_objects()
+    assert etl_listener.pending == {}
@@ -0,0 +1,85 @@
+import pytest
+
+pytest.importorskip("pyspark")
+pytest.importorskip("minio")
+pa = pytest.importorskip("pyarrow")
+
+import etl_dedup  # noqa: E402
+import etl_local  # noqa: E402
+import etl_pipeline  # noqa: E402
+import zone_maps  # noqa: E402
+
+bucket = "dw-bucket-silver"
+
+
+def test_a_rewritten_output_replaces_the_previous_one_through_a_commit(fake_minio):
+    output = "project1/heart_processed.parquet"
+    first = etl_local.write_local_output(pa.table({"age": [1, 2]}), output, "project1/heart.csv")
+    second = etl_local.write_local_output(pa.table({"age": [3]}), output, "project1/heart.csv")
+
+    assert list(zone_maps.list_data_files(fake_minio, bucket, output)) == [second]
+    assert first not in fake_minio.names(bucket, output)
+    assert fake_minio.names(bucket, f"{output}/_staging/") == []
+    assert not [name for name in fake_minio.names(bucket, f"{output}/_commits/") if name.endswith(".pending.json")]
+
+
+# nulls (empty fields, a row with a single value), duplicate rows, an integer column that turns decimal
+# and a column without any value
+heart_csv = """Patient Age,Resting BP,Chol,Diagnosis,Notes
+63,145,233.5,yes,
+37,,250,no,
+41,130,,yes,
+63,145,233.5,yes,
+,,,maybe,
+56,120,236,,
+57,140.5,354,no,
+"""
+heart_drifted_csv = """Patient Age,Resting BP,Chol,Diagnosis,Notes
+44,high,198,no,
+"""
+
+
+def read_both(spark, tmp_path, name, csv):
+    """The CSV as Spark's inferSchema reads it and as the local engine reads it (registering its schema)."""
+    path = tmp_path / name
+    path.write_text(csv)
+    spark_df = spark.read.csv(str(path), header=True, inferSchema=True)
+    return spark_df, etl_local.read_csv_local(f"project1/{name}", csv.encode())
+
+
+def spark_schema(table):
+    return [(field.name, etl_local.arrow_to_spark_type(field.type)) for field in table.schema]
+
+
+def test_local_engine_matches_spark_on_clean_up_and_ml_statistics(fake_minio, spark, tmp_path):
+    fake_minio.put("dw-bucket-bronze", "project1/heart.csv", heart_csv.encode())
+    spark_df, table = read_both(spark, tmp_path, "heart.csv", heart_csv)
+    assert spark_schema(table) == [(field.name, field.dataType) for field in spark_df.schema.fields]
+
+    spark_clean, _ = etl_pipeline.apply_basic_cleanup(spark_df)
+    local_clean, _ = etl_local.apply_basic_cleanup_local(table)
+    assert spark_schema(local_clean) == [(field.name, field.dataType) for field in spark_clean.schema.fields]
+    assert sorted(row["unique_id"] for row in spark_clean.collect()) == sorted(local_clean.column("unique_id").to_pylist())
+    assert len(set(local_clean.column("unique_id").to_pylist())) == local_clean.num_rows
+
+    _, spark_stats = etl_pipeline.apply_ml_preprocessing(spark_clean)
+    _, local_stats = etl_local.apply_ml_preprocessing_local(local_clean)
+    assert spark_stats.keys() == local_stats.keys() == {"patient_age", "resting_bp", "chol"}
+    for column, stats in spark_stats.items():
+        assert local_stats[column]["median"] == stats["median"]
+        assert local_stats[column]["count"] == stats["count"]
+        assert local_stats[column]["mean"] == pytest.approx(stats["mean"], rel=etl_local.float_tolerance)
+        assert local_stats[column]["stddev"] == pytest.approx(stats["stddev"], rel=etl_local.float_tolerance)
+
+
+def test_local_engine_widens_a_drifted_schema_like_spark(fake_minio, spark, tmp_path):
+    fake_minio.put("dw-bucket-bronze", "project1/heart.csv", heart_csv.encode())
+    fake_minio.put("dw-bucket-bronze", "project1/heart_2.csv", heart_drifted_csv.encode())
+    registered, _ = read_both(spark, tmp_path, "heart.csv", heart_csv)
+    drifted, table = read_both(spark, tmp_path, "heart_2.csv", heart_drifted_csv)
+
+    widened = etl_pipeline.merge_schemas(registered.schema, drifted.schema)
+    assert spark_schema(table) == [(field.name, field.dataType) for field in widened.fields]
+    assert table.column("Resting BP").to_pylist() == ["high"]
+    widened_df = spark.createDataFrame(table.to_pylist(), widened)
+    assert etl_local.row_hashes(table) == [row[0] for row in widened_df.select(etl_dedup.row_hash_column(widened_df)).collect()]
@@ -0,0 +1,19 @@
+import pytest
+
+pytest.importorskip("pyspark")
+pytest.importorskip("minio")
+
+import etl_local  # noqa: E402
+import etl_pipeline  # noqa: E402
+
+
+def test_cli_settings_reach_the_modules_sharing_the_pipeline(monkeypatch):
+    for name in ("engine", "write_mode", "preview_rows", "dedup_index"):
+        monkeypatch.setattr(etl_pipeline, name, getattr(etl_pipeline, name))
+    monkeypatch.setattr(etl_pipeline, "main", lambda file_name, option: "failed")
+
+    status = etl_pipeline.cli(["project1/heart.csv", "Data Clean Up", "--engine", "local", "--preview-rows", "0"])
+
+    assert status == 1
+    assert etl_local.etl.engine == "local"
+    assert etl_local.etl.preview_rows == 0
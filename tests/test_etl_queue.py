@@ -0,0 +1,72 @@
+import sqlite3
+
+import pytest
+
+import etl_queue
+import etl_worker
+
+
+@pytest.fixture(autouse=True)
+def queue_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(etl_queue, "queue_db", str(tmp_path / "etl_jobs.db"))
+
+
+def test_jobs_are_claimed_in_order_and_one_file_runs_once_at_a_time():
+    first = etl_queue.submit_job("project1/heart.csv", "Data Clean Up")
+    again = etl_queue.submit_job("project1/heart.csv", "Data Clean Up")
+    other = etl_queue.submit_job("project1/lungs.csv", "No Pre-processing")
+
+    assert etl_queue.claim_next_job()["id"] == first
+    assert etl_queue.claim_next_job()["id"] == other  # heart.csv is still running
+    assert etl_queue.claim_next_job() is None
+
+    etl_queue.finish_job(first, "processed", "done")
+    assert etl_queue.get_job(first)["status"] == "processed"
+    assert etl_queue.claim_next_job()["id"] == again
+
+
+def test_interrupted_jobs_are_requeued():
+    job_id = etl_queue.submit_job("project1/heart.csv", "Data Clean Up")
+    etl_queue.claim_next_job()
+
+    assert etl_queue.requeue_interrupted_jobs() == 1
+    assert etl_queue.get_job(job_id)["status"] == "queued"
+    etl_queue.fail_unfinished_job(job_id, "worker gone")
+    assert etl_queue.get_job(job_id)["status"] == "failed"
+
+
+def test_heartbeat_survives_a_locked_database(monkeypatch):
+    beats = []
+
+    def record_heartbeat():
+        beats.append(len(beats))
+        if len(beats) == 1:
+            raise sqlite3.OperationalError("database is locked")
+
+    def sleep(seconds):
+        if len(beats) == 2:
+            raise KeyboardInterrupt  # ends the loop
+
+    monkeypatch.setattr(etl_queue, "record_heartbeat", record_heartbeat)
+    monkeypatch.setattr(etl_worker.time, "sleep", sleep)
+    with pytest.raises(KeyboardInterrupt):
+        etl_worker.heartbeat_loop()
+    assert beats == [0, 1]
+
+
+def test_a_job_status_is_stored_after_the_database_was_locked(monkeypatch):
+    job_id = etl_queue.submit_job("project1/heart.csv", "Data Clean Up")
+    etl_queue.claim_next_job()
+    finish_job = etl_queue.finish_job
+    attempts = []
+
+    def locked_once(*args):
+        attempts.append(args)
+        if len(attempts) == 1:
+            raise sqlite3.OperationalError("database is locked")
+        finish_job(*args)
+
+    monkeypatch.setattr(etl_queue, "finish_job", locked_once)
+    monkeypatch.setattr(etl_worker.time, "sleep", lambda seconds: None)
+    assert etl_worker.finish_job({"id": job_id}, "processed", "done")
+    assert len(attempts) == 2 and etl_queue.get_job(job_id)["status"] == "processed"
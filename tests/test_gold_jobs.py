@@ -0,0 +1,47 @@
+import pytest
+
+pytest.importorskip("pyspark")
+pytest.importorskip("minio")
+pytest.importorskip("yaml")
+
+import etl_commits  # noqa: E402
+import gold_jobs  # noqa: E402
+
+bucket = "dw-bucket-silver"
+
+
+def append(fake, batch_id, count, **fields):
+    """Commit a batch of count files to datasets/heart, returns its commit marker."""
+    files = {}
+    for idx in range(count):
+        staged_name = f"datasets/heart/_staging/{batch_id}/part-{idx}.parquet"
+        fake.put(bucket, staged_name, f"{batch_id}-{idx}".encode())
+        files[staged_name] = f"datasets/heart/project=project1/{batch_id}-part-{idx}.parquet"
+    return etl_commits.publish_batch(bucket, "datasets/heart", files, batch_id, **fields)
+
+
+def test_new_batches_are_read_from_the_files_that_compacted_them(fake_minio):
+    first = append(fake_minio, "a", 1)
+    files, state = gold_jobs.silver_changes("datasets/heart", None)
+    assert files == first["files"]
+
+    second = append(fake_minio, "b", 2)
+    compacted = append(fake_minio, "c", 1, replaces=first["files"] + second["files"], compaction=True)
+    files, state = gold_jobs.silver_changes("datasets/heart", state)
+
+    assert files == compacted["files"]
+    assert gold_jobs.silver_changes("datasets/heart", state)[0] == []
+
+
+def test_applied_batches_older_than_the_overlap_are_forgotten(fake_minio):
+    append(fake_minio, "a", 1)
+    fake_minio.tick(gold_jobs.commit_overlap_seconds + 1)
+    latest = append(fake_minio, "b", 1)
+    files, state = gold_jobs.silver_changes("datasets/heart", None)
+    assert state["commits"] == ["b"]
+
+    fake_minio.tick(gold_jobs.commit_overlap_seconds + 1)
+    newer = append(fake_minio, "c", 1)
+    files, state = gold_jobs.silver_changes("datasets/heart", state)
+    assert files == newer["files"] and latest["files"][0] not in files
+    assert state["commits"] == ["c"]
@@ -0,0 +1,53 @@
+import random
+import statistics
+
+import ml_state
+
+
+def batch_sketch(values, missing=0, integral=False):
+    """column_sketch of a batch, as etl_pipeline.ml_batch_sketch computes it in Spark."""
+    ordered = sorted(values)
+    mean = statistics.fmean(values)
+    quantiles = [ordered[min(int(q * len(ordered)), len(ordered) - 1)] for q in ml_state.sketch_quantiles()]
+    return ml_state.column_sketch(len(values), missing, mean, sum((v - mean) ** 2 for v in values), quantiles, integral)
+
+
+def test_merged_batches_have_the_moments_of_all_rows():
+    rng = random.Random(7)
+    batches = [[rng.gauss(50, 10) for _ in range(size)] for size in (300, 1, 2000, 57)]
+    state = None
+    for values in batches:
+        state = ml_state.merge_state(state, {"age": batch_sketch(values, missing=3)})
+
+    every = [value for values in batches for value in values]
+    merged = state["columns"]["age"]
+    assert merged["count"] == len(every) and merged["missing"] == 12
+    assert abs(merged["mean"] - statistics.fmean(every)) < 1e-9
+    assert abs(merged["m2"] / (merged["count"] - 1) - statistics.variance(every)) < 1e-6
+
+
+def test_digest_median_is_close_whatever_the_batches():
+    rng = random.Random(3)
+    every = [rng.lognormvariate(3, 1) for _ in range(20000)]
+    state = None
+    for start in range(0, len(every), 2500):
+        state = ml_state.merge_state(state, {"income": batch_sketch(every[start:start + 2500])})
+
+    centroids = state["columns"]["income"]["centroids"]
+    median = ml_state.digest_quantile(centroids, 0.5)
+    rank = sum(value < median for value in every) / len(every)
+    assert abs(rank - 0.5) < 0.01
+    assert len(centroids) <= ml_state.digest_compression
+
+
+def test_scaling_counts_the_missing_values_filled_with_the_median():
+    state = ml_state.merge_state(None, {"visits": batch_sketch([1, 2, 2, 3, 10], missing=2, integral=True)})
+
+    fitted = ml_state.scaling_from_state(state)
+    scaling = fitted["visits"]
+
+    filled = [1, 2, 2, 3, 10, scaling["median"], scaling["median"]]
+    assert isinstance(scaling["median"], int) and scaling["count"] == 7
+    assert abs(scaling["mean"] - statistics.fmean(filled)) < 1e-9
+    assert abs(scaling["stddev"] - statistics.stdev(filled)) < 1e-9
+    assert ml_state.scaling_drift(fitted, state)["visits"]["drift"] < 1e-9
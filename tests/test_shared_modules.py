@@ -0,0 +1,18 @@
+import importlib.util
+import os
+
+from tests.conftest import repo_root
+
+spec = importlib.util.spec_from_file_location("sync_shared_modules", os.path.join(repo_root, "scripts", "sync_shared_modules.py"))
+sync_shared_modules = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(sync_shared_modules)
+
+
+def test_vendored_copies_match_their_source():
+    assert sync_shared_modules.stale_copies() == []
+
+
+def test_vendored_copy_names_its_source():
+    name, path = sync_shared_modules.copy_paths()[0]
+    with open(os.path.join(repo_root, path)) as copy:
+        assert copy.readline().startswith(f"# Vendored from Core DW Infrastructure/app/{name}")
@@ -0,0 +1,41 @@
+import os
+
+import pytest
+
+pytest.importorskip("pandas")
+pytest.importorskip("pyarrow")
+pytest.importorskip("sklearn")
+pytest.importorskip("yaml")
+
+from tests.test_tabular_pipeline import config, rows, write_csv  # noqa: E402  (imports tabular_pipeline from its folder)
+
+import tabular_batch  # noqa: E402
+
+process_file = tabular_batch.process_file
+
+
+def crash_on_crash_files(config, input_file, output_dir):
+    """process_file that kills its worker on files named crash*, like running out of memory does."""
+    if os.path.basename(input_file).startswith("crash"):
+        os._exit(1)
+    return process_file(config, input_file, output_dir)
+
+
+def test_a_file_deleted_during_the_batch_fails_alone(tmp_path):
+    files = [write_csv(tmp_path, "a.csv", rows), write_csv(tmp_path, "b.csv", rows[:4]), str(tmp_path / "gone.csv")]
+
+    summary = tabular_batch.run_batch(files, config(tmp_path), workers=2, output_dir=str(tmp_path / "out"))
+
+    assert (summary["processed"], summary["failed"]) == (2, 1)
+    assert [result["input_file"] for result in summary["results"] if result["status"] == "failed"] == files[2:]
+
+
+def test_a_file_that_kills_its_worker_is_run_alone(tmp_path, monkeypatch):
+    monkeypatch.setattr(tabular_batch, "process_file", crash_on_crash_files)
+    files = [write_csv(tmp_path, name, rows) for name in ("a.csv", "crash.csv", "b.csv")]
+
+    summary = tabular_batch.run_batch(files, config(tmp_path), workers=2, output_dir=str(tmp_path / "out"))
+
+    assert files[1] in summary["run_alone"]  #with the files that were unfinished in the same broken pools
+    assert {result["input_file"]: result["status"] for result in summary["results"]} == {
+        files[0]: "processed", files[1]: "failed", files[2]: "processed"}
@@ -0,0 +1,112 @@
+import os
+
+import pytest
+
+pd = pytest.importorskip("pandas")
+pytest.importorskip("pyarrow")
+pytest.importorskip("sklearn")
+pytest.importorskip("yaml")
+
+from tests.conftest import repo_root  # noqa: E402
+
+# tabular_pipeline reads config.yaml from the working directory when it is imported, like the app does
+cwd = os.getcwd()
+os.chdir(os.path.join(repo_root, "File Upload Service", "app"))
+try:
+    import tabular_pipeline  # noqa: E402
+finally:
+    os.chdir(cwd)
+
+# an int column with a missing value in a later chunk, duplicates across chunks, a label column whose
+# values read as numbers in the first chunk and a column that mixes numbers and strings
+rows = [
+    "age,bp,site,note",
+    "63,145,1,10",
+    "37,130,2,11",
+    "63,145,1,10",
+    "41,,2,12",
+    "56,120,3,x",
+    "37,130,2,11",
+    "57,,west,14",
+]
+
+
+def config(tmp_path, **transformation):
+    return {"tabular": {
+        "output_format": "parquet",
+        "stream_min_mb": None,
+        "preprocessing": {
+            "cleaning": {"dropna": False, "drop_duplicates": True},
+            "transformation": dict({"categorical_encoding": {"columns": ["site"], "dictionary_dir": str(tmp_path / "dictionaries")}},
+                                   **transformation),
+            "validation": {},
+        },
+    }}
+
+
+def write_csv(tmp_path, name, lines):
+    path = tmp_path / name
+    path.write_text("\n".join(lines) + "\n")
+    return str(path)
+
+
+def test_streaming_gives_the_same_output_as_a_whole_file_run(tmp_path):
+    input_file = write_csv(tmp_path, "heart.csv", rows)
+    settings = config(tmp_path, fillna={"columns": {"bp": "median", "age": "mean"}}, normalize={"columns": ["age", "bp", "site"]})
+
+    whole, _ = tabular_pipeline.pipeline(settings).run(input_file, output_dir=str(tmp_path / "whole"))
+    streamed, _ = tabular_pipeline.pipeline(settings).run(input_file, chunksize=2, output_dir=str(tmp_path / "streamed"))
+
+    whole_df, streamed_df = pd.read_parquet(whole), pd.read_parquet(streamed)
+    assert len(whole_df) == 5
+    pd.testing.assert_frame_equal(streamed_df, whole_df, check_dtype=False)
+
+
+def test_statistics_take_one_pass_unless_strings_mix_with_numbers(tmp_path, monkeypatch):
+    reads = []
+    read_chunks = tabular_pipeline.pipeline.read_chunks
+
+    def counted(self, file_name, chunksize, dtypes=None):
+        reads.append(dtypes)
+        return read_chunks(self, file_name, chunksize, dtypes)
+
+    monkeypatch.setattr(tabular_pipeline.pipeline, "read_chunks", counted)
+    runner = tabular_pipeline.pipeline(config(tmp_path))
+    numbers = write_csv(tmp_path, "numbers.csv", [row.rsplit(",", 1)[0] for row in rows if "west" not in row])
+    stats = runner.stream_statistics(numbers, 2)
+    assert len(reads) == 1 and str(stats["dtypes"]["bp"]) == "float64"
+
+    reads.clear()
+    stats = runner.stream_statistics(write_csv(tmp_path, "mixed.csv", rows), 2)
+    assert reads == [None, {"site": object, "note": object}]
+    assert stats["dtypes"]["note"] == object
+
+
+def test_fill_missing_leaves_its_input_alone(tmp_path):
+    runner = tabular_pipeline.pipeline(config(tmp_path, fillna={"columns": {"bp": 0}}))
+    df = pd.DataFrame({"bp": [1.0, None]})
+
+    filled = runner.fill_missing(df, None)
+
+    assert filled["bp"].tolist() == [1.0, 0.0]
+    assert df["bp"].isna().sum() == 1
+
+
+def test_dictionary_codes_are_stable_across_files_and_types(tmp_path):
+    first = tabular_pipeline.pipeline(config(tmp_path))
+    codes = first.encode_columns(pd.DataFrame({"site": [2, 1, 2]}), None)["site"].tolist()
+
+    second = tabular_pipeline.pipeline(config(tmp_path))  # a later run, e.g. another file of a batch
+    later = second.encode_columns(pd.DataFrame({"site": [1.0, 3.0, None, 2.0]}), None)["site"].tolist()
+
+    assert codes == [1, 0, 1]
+    assert later == [0, 2, 3, 1]  # new labels only get new codes
+    assert tabular_pipeline.DictionaryStore(str(tmp_path / "dictionaries")).load("site") == ["1", "2", "3", "nan"]
+
+
+def test_row_hashes_take_whole_floats_like_ints():
+    ints = pd.DataFrame({"a": [1, 2, -3], "b": ["x", "y", "z"]})
+    floats = pd.DataFrame({"a": [1.0, 2.0, -3.0], "b": ["x", "y", "z"]})
+
+    assert (tabular_pipeline.row_hashes(ints) == tabular_pipeline.row_hashes(floats)).all()
+    assert tabular_pipeline.row_hashes(pd.DataFrame({"a": [1.5]}))[0] != tabular_pipeline.row_hashes(pd.DataFrame({"a": [1]}))[0]
@@ -0,0 +1,65 @@
+import math
+import random
+from decimal import Decimal
+
+import pytest
+
+pytest.importorskip("minio")
+
+import zone_maps  # noqa: E402
+
+bucket = "dw-bucket-silver"
+
+
+def file_entry(rows, low, high, nulls=0, etag="e"):
+    return {"etag": etag, "rows": rows, "columns": {"age": {"type": "number", "min": low, "max": high, "nulls": nulls,
+                                                            "sketch": zone_maps.sketch_from_strings([str(low), str(high)])}}}
+
+
+def test_files_are_pruned_by_their_bounds():
+    stats = {"files": {"a.parquet": file_entry(10, 20, 39), "b.parquet": file_entry(10, 40, 77, nulls=2),
+                       "c.parquet": file_entry(5, None, None, nulls=5)}}
+    current = {"a.parquet": "e", "b.parquet": "e", "c.parquet": "e", "new.parquet": "e"}
+
+    assert zone_maps.prune_files(stats, zone_maps.parse_where("age >= 60"), current) == ["b.parquet", "new.parquet"]
+    assert zone_maps.prune_files(stats, zone_maps.parse_where("age = '39' and age is not null"), current) == ["a.parquet", "new.parquet"]
+    assert zone_maps.prune_files(stats, zone_maps.parse_where("age is null"), current) == ["b.parquet", "c.parquet", "new.parquet"]
+    # a file rewritten since its entry was computed is always read
+    assert zone_maps.prune_files(stats, zone_maps.parse_where("age > 100"), dict(current, **{"a.parquet": "changed"})) == [
+        "a.parquet", "new.parquet"]
+
+
+def test_bounds_hold_for_decimals_and_skip_nan():
+    assert zone_maps.json_bound(Decimal("0.1"), True) > 0.1 > zone_maps.json_bound(Decimal("0.1"), False)
+    assert zone_maps.json_bound(math.nan, True) is None
+    assert zone_maps.json_bound("x" * (zone_maps.max_bound_length + 1), False) is None
+
+
+def test_sketches_merge_into_the_sketch_of_all_values():
+    values = [f"value-{idx}" for idx in range(5000)]
+    random.Random(1).shuffle(values)
+    halves = [zone_maps.sketch_from_strings(values[:3000]), zone_maps.sketch_from_strings(values[2000:])]
+
+    merged = zone_maps.merge_sketches(halves)
+
+    assert zone_maps.encode_sketch(merged) == zone_maps.sketch_from_strings(values)
+    assert zone_maps.estimate_distinct(merged) == pytest.approx(5000, rel=0.1)
+    assert zone_maps.estimate_distinct(zone_maps.merge_sketches([zone_maps.sketch_from_strings(["a", "b", "a"])])) == 2
+
+
+def test_dataset_summary_combines_the_files():
+    summary = zone_maps.summarize({"a.parquet": file_entry(10, 20, 39), "b.parquet": file_entry(10, 40, 77, nulls=2)})
+
+    assert summary["rows"] == 20
+    assert {key: summary["columns"]["age"][key] for key in ("min", "max", "nulls", "distinct_estimate")} == {
+        "min": 20, "max": 77, "nulls": 2, "distinct_estimate": 4}
+
+
+def test_data_files_skip_hidden_paths_and_uncommitted_batches(fake_minio):
+    for name in ("datasets/heart/project=p1/a.parquet", "datasets/heart/_staging/b/part-0.parquet",
+                 "datasets/heart/project=p1/b-part-0.parquet", "datasets/heart/.spark/x.parquet"):
+        fake_minio.put(bucket, name, b"rows")
+    fake_minio.put(bucket, "datasets/heart/_commits/b.pending.json",
+                   b'{"batch_id": "b", "files": ["datasets/heart/project=p1/b-part-0.parquet"], "replaces": []}')
+
+    assert list(zone_maps.list_data_files(fake_minio, bucket, "datasets/heart")) == ["datasets/heart/project=p1/a.parquet"]